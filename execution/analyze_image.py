@@ -15,11 +15,11 @@ except ImportError:
 from dotenv import load_dotenv
 load_dotenv()
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Analizar una imagen usando Gemini Vision.")
     parser.add_argument("--image", required=True, help="Ruta local de la imagen.")
     parser.add_argument("--prompt", default="Describe esta imagen en detalle.", help="Instrucción para el modelo.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
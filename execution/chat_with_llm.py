@@ -2,24 +2,34 @@
 import os
 import sys
 import json
+import time
+import queue
 import argparse
+import importlib
 import requests
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from collections import deque, OrderedDict
 
 # Suppress warnings to ensure clean JSON output
 warnings.filterwarnings("ignore")
 
-# Intentar importar SDK de Google
-try:
-    import google.generativeai as genai
-except ImportError:
-    genai = None
+# Los SDK pesados (google.generativeai; chromadb en memory_daemon) se importan la
+# primera vez que se usan: las herramientas que solo llaman a Groq/OpenAI no
+# pagan su coste al arrancar.
+_lazy_modules = {}
 
-# Intentar importar ChromaDB para memoria a largo plazo
-try:
-    import chromadb
-except ImportError:
-    chromadb = None
+
+def lazy_import(module_name):
+    """Importa un módulo opcional en el primer uso y lo recuerda (None si no está instalado)."""
+    if module_name not in _lazy_modules:
+        try:
+            _lazy_modules[module_name] = importlib.import_module(module_name)
+        except ImportError:
+            _lazy_modules[module_name] = None
+    return _lazy_modules[module_name]
 
 # Intentar cargar variables de entorno si python-dotenv está instalado
 try:
@@ -28,65 +38,264 @@ try:
 except ImportError:
     pass
 
-HISTORY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "chat_history.json")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import state_store
+import provider_stats
+import llm_cache
+import semantic_cache
+import memory_daemon
+
+# Historial: se envían los mensajes más recientes que caben en LLM_HISTORY_TOKENS
+# (estimados); los anteriores se condensan en un resumen acumulado por sesión que
+# se guarda en SQLite y solo se recalcula cuando se acumula otro bloque de mensajes.
+HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKENS", "3000"))
+HISTORY_FETCH_LIMIT = 200
+SUMMARY_MAX_WORDS = 200
+SUMMARY_INPUT_CHARS = 4000  # por mensaje, al pedir el resumen
+SUMMARY_SYSTEM = "Eres un asistente que resume conversaciones de forma fiel y concisa."
+SUMMARY_PREFIX = "Resumen de nuestra conversación anterior:\n"
+SUMMARY_ACK = "Entendido, lo tendré en cuenta."
 
+# Estimación de tokens: caracteres por token aproximados (texto mayormente en
+# español) por modelo y, si el modelo no aparece, por proveedor.
+MODEL_CHARS_PER_TOKEN = {
+    "gpt-4o-mini": 3.9,
+    "claude-3-5-sonnet-20240620": 3.3,
+    "llama-3.3-70b-versatile": 3.6,
+    "gemini-flash-latest": 4.0,
+    "gemini-1.5-flash": 4.0,
+    "gemini-pro": 4.0,
+}
+PROVIDER_CHARS_PER_TOKEN = {"openai": 3.9, "anthropic": 3.3, "groq": 3.6, "gemini": 4.0}
+DEFAULT_CHARS_PER_TOKEN = 3.3
+MESSAGE_OVERHEAD_TOKENS = 4  # rol y separadores de cada mensaje
 
-def load_history():
-    if os.path.exists(HISTORY_FILE):
+# Hedging: si el proveedor principal no ha respondido en su p95 de latencia, se lanza
+# el siguiente en paralelo y gana la primera respuesta. LLM_MAX_HEDGES limita cuántas
+# peticiones extra se lanzan por consulta.
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+MAX_HEDGES = int(os.getenv("LLM_MAX_HEDGES", "1"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "3.0"))  # sin muestras suficientes
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MIN_SAMPLES = 5
+LATENCY_WINDOW = 50
+
+# Modelo por defecto de cada proveedor (para las estadísticas por modelo)
+DEFAULT_MODELS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-sonnet-20240620",
+    "groq": "llama-3.3-70b-versatile",
+}
+GEMINI_MODEL = "gemini-flash-latest"
+
+# Plazo total (deadline_ms / --deadline-ms): el tiempo restante se reparte entre
+# los intentos pendientes, pero cada intento dispone de al menos
+# DEADLINE_MIN_ATTEMPT segundos (o de lo que quede).
+DEADLINE_MIN_ATTEMPT = 5.0
+
+# Lotes (chat_batch): peticiones por segundo que se lanzan a cada proveedor.
+# Se pueden ajustar con LLM_RATE_LIMITS="groq=1,gemini=0.5".
+BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "4"))
+DEFAULT_RATE_LIMITS = {"groq": 0.5, "gemini": 0.25, "openai": 3.0, "anthropic": 0.8}
+
+
+def parse_rate_limits(spec, defaults=DEFAULT_RATE_LIMITS):
+    """Límites "proveedor=peticiones/s,..." sobre los de por defecto; las entradas mal formadas se ignoran."""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
         try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception:
-            return []
-    return []
+            if not name.strip():
+                raise ValueError("falta el proveedor")
+            limits[name.strip()] = float(rate)
+        except ValueError:
+            print(f"⚠️ LLM_RATE_LIMITS: se ignora '{item}' (formato esperado: proveedor=peticiones_por_segundo).",
+                  file=sys.stderr)
+    return limits
 
 
-def save_history(history):
-    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(history, f, indent=2, ensure_ascii=False)
+PROVIDER_RATE_LIMITS = parse_rate_limits(os.getenv("LLM_RATE_LIMITS", ""))
 
-def get_memory_context(query):
-    """Busca contexto relevante en la memoria vectorial (ChromaDB)."""
-    if not chromadb:
-        print("⚠️  [RAG] ChromaDB no instalado o no importado.", file=sys.stderr)
+# Base de la memoria vectorial (mismo path que save_memory.py)
+MEMORY_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "chroma_db")
+GEMINI_FALLBACK_MODELS = ["gemini-1.5-flash", "gemini-pro"]
+
+def get_memory_context(query, sources=None):
+    """
+    Busca contexto relevante en la memoria vectorial (ChromaDB).
+    Si se pasa una lista en sources, se le añaden (id, texto) de los recuerdos usados.
+    """
+    # Sin base de memoria no hace falta importar ChromaDB
+    db_path = MEMORY_DB_PATH
+    if not os.path.exists(db_path):
+        print(f"⚠️  [RAG] No se encontró base de datos en: {db_path}", file=sys.stderr)
         return None
-        
-    try:
-        # Ruta a la base de datos (mismo path que save_memory.py)
-        db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "chroma_db")
-        
-        if not os.path.exists(db_path):
-            print(f"⚠️  [RAG] No se encontró base de datos en: {db_path}", file=sys.stderr)
-            return None
 
-        client = chromadb.PersistentClient(path=db_path)
-        collection = client.get_or_create_collection(name='agent_memory')
-        
-        results = collection.query(
-            query_texts=[query],
-            n_results=3 # Recuperar los 3 recuerdos más relevantes
-        )
-        
-        documents = results.get('documents', [[]])[0]
+    try:
+        # Con el daemon de memoria en marcha no se carga ChromaDB en este proceso;
+        # si no, el cliente y el modelo de embeddings se conservan entre llamadas.
+        # Búsqueda híbrida (vector + BM25) con cortes por distancia y por palabras coincidentes:
+        # MEMORY_SEARCH_MODE, MEMORY_MAX_DISTANCE, MEMORY_LEXICAL_MIN_MATCH
+        results = memory_daemon.call("query", db_path=db_path, query=query, n_results=3,
+                                     mode=memory_daemon.SEARCH_MODE, max_distance=memory_daemon.MAX_DISTANCE,
+                                     min_match=memory_daemon.LEXICAL_MIN_MATCH)
+        documents = results['documents']
+        ids = results['ids']
         if documents:
             # Deduplicar resultados preservando el orden
             seen = set()
             unique_docs = []
-            for doc in documents:
+            for memory_id, doc in zip(ids, documents):
                 if doc not in seen:
                     unique_docs.append(doc)
                     seen.add(doc)
+                    if sources is not None:
+                        sources.append((memory_id, doc))
             
             preview = unique_docs[0][:60] + "..." if len(unique_docs[0]) > 60 else unique_docs[0]
-            print(f"🧠 [RAG] Contexto inyectado ({len(unique_docs)} items): '{preview}'", file=sys.stderr)
+            timings = ", ".join(f"{stage} {ms} ms" for stage, ms in results.get("timings_ms", {}).items())
+            print(f"🧠 [RAG] Contexto inyectado ({len(unique_docs)} items, {timings}): '{preview}'", file=sys.stderr)
             return "\n".join([f"- {doc}" for doc in unique_docs])
         else:
             print("🧠 [RAG] No se encontraron recuerdos relevantes para esta consulta.", file=sys.stderr)
+    except ImportError:
+        print("⚠️  [RAG] ChromaDB no instalado o no importado.", file=sys.stderr)
     except Exception as e:
         print(f"❌ [RAG] Error al consultar memoria: {e}", file=sys.stderr)
     return None
 
+# --- Clientes de proveedores -------------------------------------------------
+# Una sesión keep-alive por endpoint (sin handshake TCP/TLS en cada mensaje) y
+# modelos de Gemini reutilizados por (modelo, instrucción de sistema). Se
+# conservan entre llamadas cuando el módulo corre en proceso (ver tool_runtime.py).
+
+PROVIDER_ENDPOINTS = {
+    "openai": "https://api.openai.com",
+    "anthropic": "https://api.anthropic.com",
+    "groq": "https://api.groq.com",
+}
+GEMINI_MODEL_CACHE_SIZE = 32
+
+_sessions = {}
+_clients_lock = threading.Lock()
+_gemini_api_key = None
+_gemini_models = OrderedDict()
+
+
+def get_session(url):
+    """Sesión HTTP persistente del endpoint (esquema + host) de url."""
+    parts = urlsplit(url)
+    origin = f"{parts.scheme}://{parts.netloc}"
+    with _clients_lock:
+        session = _sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            session.mount(origin, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+            _sessions[origin] = session
+        return session
+
+
+def http_post(url, **kwargs):
+    kwargs["timeout"] = request_timeout(kwargs.get("timeout", 30))
+    return get_session(url).post(url, **kwargs)
+
+
+# --- Plazos ------------------------------------------------------------------
+
+class DeadlineExceeded(TimeoutError):
+    """Se agotó el plazo de la consulta (deadline_ms)."""
+
+
+DEADLINE_ERROR_TYPE = "deadline_exceeded"
+_deadline_state = threading.local()
+
+
+def remaining_time():
+    """Segundos que le quedan al intento en curso (None si no hay plazo)."""
+    at = getattr(_deadline_state, "at", None)
+    return None if at is None else at - time.monotonic()
+
+
+def request_timeout(timeout):
+    """Timeout de una petición HTTP, recortado al plazo restante."""
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded("Plazo agotado antes de enviar la petición.")
+    return min(timeout, remaining)
+
+
+def deadline_expired():
+    """True si el intento en curso tenía plazo y ya se ha agotado."""
+    remaining = remaining_time()
+    return remaining is not None and remaining <= 0
+
+
+def check_deadline():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Plazo agotado durante la respuesta.")
+
+
+def attempt_share(remaining, attempts_left):
+    """Parte del tiempo restante para el siguiente de `attempts_left` intentos."""
+    return min(remaining, max(remaining / max(1, attempts_left), DEADLINE_MIN_ATTEMPT))
+
+
+def get_gemini_model(genai, api_key, model, system_instruction):
+    """GenerativeModel cacheado por (modelo, instrucción); genai.configure solo si cambia la clave."""
+    global _gemini_api_key
+    key = (model, system_instruction)
+    with _clients_lock:
+        if api_key != _gemini_api_key:
+            genai.configure(api_key=api_key)
+            _gemini_api_key = api_key
+            _gemini_models.clear()
+        instance = _gemini_models.get(key)
+        if instance is None:
+            instance = genai.GenerativeModel(model_name=model, system_instruction=system_instruction)
+            _gemini_models[key] = instance
+            if len(_gemini_models) > GEMINI_MODEL_CACHE_SIZE:
+                _gemini_models.popitem(last=False)
+        else:
+            _gemini_models.move_to_end(key)
+        return instance
+
+
+def prewarm(providers=None):
+    """
+    Abre por adelantado las conexiones a los proveedores configurados (y prepara el
+    SDK de Gemini) para que el primer mensaje no pague el handshake. Devuelve
+    {proveedor: milisegundos o error}.
+    """
+    results = {}
+
+    def warm(provider):
+        start = time.monotonic()
+        try:
+            if provider == "gemini":
+                genai = lazy_import("google.generativeai")
+                if not genai:
+                    raise RuntimeError("google-generativeai no instalado")
+                get_gemini_model(genai, os.getenv("GOOGLE_API_KEY"), GEMINI_MODEL, None)
+            else:
+                # Cualquier respuesta HTTP deja la conexión TLS abierta en el pool
+                base = PROVIDER_ENDPOINTS[provider]
+                get_session(base).head(base, timeout=5)
+            results[provider] = round((time.monotonic() - start) * 1000)
+        except Exception as e:
+            results[provider] = f"error: {e}"
+
+    threads = [threading.Thread(target=warm, args=(p,), daemon=True) for p in (providers or get_providers())]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
 def chat_openai(messages, model="gpt-4o-mini", system_instruction=None):
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
@@ -106,7 +315,7 @@ def chat_openai(messages, model="gpt-4o-mini", system_instruction=None):
     }
 
     try:
-        resp = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data, timeout=30)
+        resp = http_post("https://api.openai.com/v1/chat/completions", headers=headers, json=data, timeout=30)
         resp.raise_for_status()
         result = resp.json()
         return {"content": result['choices'][0]['message']['content']}
@@ -133,7 +342,7 @@ def chat_anthropic(messages, model="claude-3-5-sonnet-20240620", system_instruct
     }
 
     try:
-        resp = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=data, timeout=30)
+        resp = http_post("https://api.anthropic.com/v1/messages", headers=headers, json=data, timeout=30)
         resp.raise_for_status()
         result = resp.json()
         return {"content": result['content'][0]['text']}
@@ -169,7 +378,7 @@ def chat_groq(messages, model="llama-3.3-70b-versatile", system_instruction=None
     }
 
     try:
-        resp = requests.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=data, timeout=30)
+        resp = http_post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=data, timeout=30)
         
         if not resp.ok:
             return {"error": f"Groq API Error ({resp.status_code}): {resp.text}"}
@@ -179,7 +388,8 @@ def chat_groq(messages, model="llama-3.3-70b-versatile", system_instruction=None
     except Exception as e:
         return {"error": str(e)}
 
-def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
+def chat_gemini(messages, model=GEMINI_MODEL, system_instruction=None):
+    genai = lazy_import("google.generativeai")
     if not genai:
         return {"error": "Librería 'google-generativeai' no instalada. Ejecuta: pip install -r requirements.txt"}
 
@@ -188,8 +398,6 @@ def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
         return {"error": "Falta GOOGLE_API_KEY en .env"}
 
     try:
-        genai.configure(api_key=api_key)
-
         # Preparar historial y system instruction
         sys_msg = system_instruction or "Eres Gemini, un modelo de IA de Google, actuando como la capa de Orquestación en una arquitectura de 3 capas. Identifícate siempre como Gemini/Google si te preguntan."
         history = []
@@ -210,20 +418,34 @@ def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
 
         # Estrategia de Fallback: Intentar modelos alternativos si el principal falla
         models_to_try = [model]
-        # Lista de modelos seguros para probar en orden si el principal falla
-        fallbacks = ["gemini-1.5-flash", "gemini-pro"]
-        for fb in fallbacks:
+        # Lista de modelos seguros para probar si el principal falla
+        for fb in GEMINI_FALLBACK_MODELS:
             if fb != model:
                 models_to_try.append(fb)
+        # Orden según latencia y errores recientes (los de circuito abierto, al final)
+        stats = provider_stats.get_stats()
+        models_to_try = stats.order_models("gemini", models_to_try)
 
         last_error = None
-        for target_model in models_to_try:
+        for i, target_model in enumerate(models_to_try):
+            start = time.monotonic()
+            # Con plazo, el tiempo que queda se reparte entre los modelos pendientes
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                last_error = DeadlineExceeded("Plazo agotado.")
+                break
+            options = {} if remaining is None else {
+                "request_options": {"timeout": attempt_share(remaining, len(models_to_try) - i)}}
             try:
-                model_instance = genai.GenerativeModel(model_name=target_model, system_instruction=sys_msg)
+                model_instance = get_gemini_model(genai, api_key, target_model, sys_msg)
                 chat = model_instance.start_chat(history=history)
-                response = chat.send_message(last_message["parts"][0])
+                response = chat.send_message(last_message["parts"][0], **options)
+                stats.record("gemini", target_model, time.monotonic() - start, aggregate=False)
                 return {"content": response.text}
             except Exception as e:
+                # Un fallo por plazo agotado no es culpa del modelo: no cuenta para el breaker
+                if not isinstance(e, DeadlineExceeded) and not deadline_expired():
+                    stats.record("gemini", target_model, ok=False, rate_limited=provider_stats.is_rate_limited(e), aggregate=False)
                 print(f"⚠️  Advertencia: Falló {target_model} ({e}). Intentando siguiente...", file=sys.stderr)
                 last_error = e
                 continue
@@ -234,53 +456,528 @@ def chat_gemini(messages, model="gemini-flash-latest", system_instruction=None):
         return {"error": str(e)}
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Enviar un prompt a un LLM (OpenAI/Anthropic).")
-    parser.add_argument("--prompt", required=True, help="El mensaje para el LLM.")
-    parser.add_argument("--provider", choices=["openai", "anthropic", "gemini", "groq"], help="Proveedor de IA.")
-    parser.add_argument("--memory-query", help="Texto específico para buscar en memoria (si es diferente al prompt).")
-    parser.add_argument("--memory-only", action="store_true", help="Solo consulta la memoria y devuelve el resultado directo sin llamar al LLM.")
-    parser.add_argument("--system", help="Instrucción del sistema (personalidad).")
-    args = parser.parse_args()
+# --- Streaming ---------------------------------------------------------------
+# Generadores de fragmentos de texto (deltas) a medida que el proveedor los produce.
+# Lanzan una excepción si la petición falla.
 
-    # --- MODO MEMORY-ONLY ---
-    if args.memory_only:
-        memory_context = get_memory_context(args.prompt)
-        if memory_context:
-            # Si se encuentra algo, se devuelve directamente formateado.
-            result = {"content": f"🧠 Según mi memoria:\n\n{memory_context}"}
+def _iter_sse(resp):
+    """Recorre un stream Server-Sent Events y devuelve el JSON de cada línea 'data:'."""
+    for line in resp.iter_lines(decode_unicode=True):
+        check_deadline()
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except ValueError:
+            continue
+
+
+def _stream_openai_compatible(url, api_key, body):
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    body["stream"] = True
+    with http_post(url, headers=headers, json=body, timeout=30, stream=True) as resp:
+        if not resp.ok:
+            raise RuntimeError(f"API Error ({resp.status_code}): {resp.text}")
+        for event in _iter_sse(resp):
+            choices = event.get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+
+def stream_openai(messages, model="gpt-4o-mini", system_instruction=None):
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Falta OPENAI_API_KEY en .env")
+    sys_msg = system_instruction or "Eres un asistente de IA útil actuando como la capa de Orquestación en una arquitectura de 3 capas."
+    body = {
+        "model": model,
+        "messages": [{"role": "system", "content": sys_msg}] + messages,
+        "temperature": 0.7
+    }
+    yield from _stream_openai_compatible("https://api.openai.com/v1/chat/completions", api_key, body)
+
+
+def stream_groq(messages, model="llama-3.3-70b-versatile", system_instruction=None):
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise RuntimeError("Falta GROQ_API_KEY en .env")
+    clean_messages = [{"role": m.get("role", "user"), "content": str(m.get("content", ""))} for m in messages]
+    sys_msg = system_instruction or "Eres un asistente de IA útil (Llama 3 en Groq) actuando como la capa de Orquestación. Si en el historial ves que te llamaste 'Gemini', ignóralo; ahora eres Llama 3."
+    body = {
+        "model": model,
+        "messages": [{"role": "system", "content": sys_msg}] + clean_messages,
+        "temperature": 0.7
+    }
+    yield from _stream_openai_compatible("https://api.groq.com/openai/v1/chat/completions", api_key, body)
+
+
+def stream_anthropic(messages, model="claude-3-5-sonnet-20240620", system_instruction=None):
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise RuntimeError("Falta ANTHROPIC_API_KEY en .env")
+    headers = {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json"
+    }
+    sys_msg = system_instruction or "Eres un asistente de IA útil actuando como la capa de Orquestación en una arquitectura de 3 capas."
+    body = {
+        "model": model,
+        "max_tokens": 1024,
+        "messages": messages,
+        "system": sys_msg,
+        "stream": True
+    }
+    with http_post("https://api.anthropic.com/v1/messages", headers=headers, json=body, timeout=30, stream=True) as resp:
+        if not resp.ok:
+            raise RuntimeError(f"Anthropic API Error ({resp.status_code}): {resp.text}")
+        for event in _iter_sse(resp):
+            if event.get("type") == "content_block_delta":
+                text = event.get("delta", {}).get("text")
+                if text:
+                    yield text
+            elif event.get("type") == "error":
+                raise RuntimeError(event.get("error", {}).get("message", "Error en el stream"))
+            elif event.get("type") == "message_stop":
+                return
+
+
+def stream_gemini(messages, model=GEMINI_MODEL, system_instruction=None):
+    genai = lazy_import("google.generativeai")
+    if not genai:
+        raise RuntimeError("Librería 'google-generativeai' no instalada. Ejecuta: pip install -r requirements.txt")
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise RuntimeError("Falta GOOGLE_API_KEY en .env")
+
+    sys_msg = system_instruction or "Eres Gemini, un modelo de IA de Google, actuando como la capa de Orquestación en una arquitectura de 3 capas. Identifícate siempre como Gemini/Google si te preguntan."
+    history = []
+    for msg in messages:
+        if msg["role"] == "user":
+            history.append({"role": "user", "parts": [msg["content"]]})
+        elif msg["role"] == "assistant":
+            history.append({"role": "model", "parts": [msg["content"]]})
+    if not history or history[-1]["role"] != "user":
+        raise RuntimeError("El historial debe terminar con un mensaje del usuario.")
+    last_message = history.pop()
+
+    # En streaming no hay reintento entre modelos: se usa el mejor según las estadísticas
+    model = provider_stats.get_stats().order_models("gemini", [model] + [m for m in GEMINI_FALLBACK_MODELS if m != model])[0]
+    model_instance = get_gemini_model(genai, api_key, model, sys_msg)
+    chat = model_instance.start_chat(history=history)
+    remaining = remaining_time()
+    options = {} if remaining is None else {"request_options": {"timeout": request_timeout(remaining)}}
+    for chunk in chat.send_message(last_message["parts"][0], stream=True, **options):
+        check_deadline()
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # fragmento sin texto (p.ej. solo metadatos de seguridad)
+        if text:
+            yield text
+
+
+def call_provider(provider, messages, system_instruction=None):
+    """Respuesta completa (bloqueante) de un proveedor."""
+    if getattr(_batch_state, "active", False):
+        reserved, _batch_state.slot = getattr(_batch_state, "slot", None), None
+        provider_limiter(provider).acquire(reserved[1] if reserved and reserved[0] == provider else None)
+    if provider == "openai":
+        return chat_openai(messages, system_instruction=system_instruction)
+    elif provider == "anthropic":
+        return chat_anthropic(messages, system_instruction=system_instruction)
+    elif provider == "groq":
+        return chat_groq(messages, system_instruction=system_instruction)
+    elif provider == "gemini":
+        return chat_gemini(messages, system_instruction=system_instruction)
+    return {"error": f"Proveedor desconocido: {provider}"}
+
+
+def stream_provider(provider, messages, system_instruction=None):
+    """Generador de deltas de texto de un proveedor."""
+    if provider == "openai":
+        return stream_openai(messages, system_instruction=system_instruction)
+    elif provider == "anthropic":
+        return stream_anthropic(messages, system_instruction=system_instruction)
+    elif provider == "groq":
+        return stream_groq(messages, system_instruction=system_instruction)
+    elif provider == "gemini":
+        return stream_gemini(messages, system_instruction=system_instruction)
+    raise ValueError(f"Proveedor desconocido: {provider}")
+
+
+def _consume_stream(provider, messages, system_instruction, on_delta):
+    """
+    Consume el stream de un proveedor llamando a on_delta(texto_acumulado) con cada
+    fragmento. Devuelve {"content": ...} o {"error": ...} como las funciones chat_*.
+    """
+    text = ""
+    start = time.monotonic()
+    try:
+        for delta in stream_provider(provider, messages, system_instruction):
+            if not text:
+                record_latency(provider, time.monotonic() - start)
+            text += delta
+            on_delta(text)
+    except Exception as e:
+        if text:
+            return {"error": f"Stream interrumpido tras {len(text)} caracteres: {e}", "_partial": text}
+        return {"error": str(e)}
+    if not text:
+        return {"error": "Respuesta vacía"}
+    return {"content": text}
+
+
+def get_providers(provider=None):
+    """Proveedores a intentar en orden de prioridad."""
+    if provider:
+        # Si el usuario fuerza uno, solo intentamos ese
+        return [provider]
+    providers_to_try = []
+    # Orden de preferencia: Groq (Rápido) -> Gemini (Backup robusto) -> Otros
+    if os.getenv("GROQ_API_KEY") and os.getenv("GROQ_API_KEY").strip():
+        providers_to_try.append("groq")
+    if os.getenv("GOOGLE_API_KEY") and os.getenv("GOOGLE_API_KEY").strip():
+        providers_to_try.append("gemini")
+    if os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY").strip():
+        providers_to_try.append("openai")
+    if os.getenv("ANTHROPIC_API_KEY") and os.getenv("ANTHROPIC_API_KEY").strip():
+        providers_to_try.append("anthropic")
+    return providers_to_try
+
+
+# Latencia hasta el primer fragmento (TTFT) de los streams por proveedor: solo alimenta
+# hedge_delay(). La puntuación de provider_stats usa siempre el tiempo total de respuesta.
+_latencies = {}
+_latencies_lock = threading.Lock()
+
+
+def record_latency(provider, seconds):
+    with _latencies_lock:
+        _latencies.setdefault(provider, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def estimate_tokens(text, provider=None, model=None):
+    """Tokens aproximados de un mensaje para un proveedor/modelo (sin tokenizador)."""
+    ratio = MODEL_CHARS_PER_TOKEN.get(model) or PROVIDER_CHARS_PER_TOKEN.get(provider, DEFAULT_CHARS_PER_TOKEN)
+    return int(len(text) / ratio) + 1 + MESSAGE_OVERHEAD_TOKENS
+
+
+def count_tokens(text, providers):
+    """Estimación conservadora: la mayor entre los proveedores candidatos."""
+    return max((estimate_tokens(text, p, model_for(p)) for p in providers), default=estimate_tokens(text))
+
+
+def summarize_history(previous, messages, providers):
+    """Resumen acumulado: el resumen anterior + los mensajes nuevos. None si ningún proveedor responde."""
+    transcript = "\n".join(
+        f"{'Usuario' if m['role'] == 'user' else 'Asistente'}: {m['content'][:SUMMARY_INPUT_CHARS]}" for m in messages)
+    prompt = (f"Actualiza el resumen de esta conversación en un máximo de {SUMMARY_MAX_WORDS} palabras. "
+              "Conserva nombres, datos, decisiones y preguntas pendientes; responde solo con el resumen.\n\n"
+              f"RESUMEN PREVIO:\n{previous or '(ninguno)'}\n\nMENSAJES NUEVOS:\n{transcript}")
+    for provider in providers:
+        try:
+            result = call_provider(provider, [{"role": "user", "content": prompt}], SUMMARY_SYSTEM)
+        except Exception as e:
+            result = {"error": str(e)}
+        if result.get("content"):
+            return result["content"].strip()
+        print(f"⚠️ [HISTORIAL] '{provider}' no pudo resumir: {result.get('error')}", file=sys.stderr)
+    return None
+
+
+def build_history(session, prompt, providers, budget=None):
+    """
+    Mensajes de contexto para la sesión: [resumen] + los más recientes que caben en
+    el presupuesto de tokens + el prompt nuevo.
+
+    Cuando el historial no cabe, los mensajes más antiguos se añaden al resumen
+    acumulado hasta dejar la ventana en la mitad del presupuesto, de modo que el
+    resumen se recalcula una vez por bloque y no en cada mensaje.
+    Si hay más de HISTORY_FETCH_LIMIT mensajes sin resumir, los que no entran en la
+    página se resumen antes, en bloques de ese tamaño.
+    """
+    budget = HISTORY_TOKEN_BUDGET if budget is None else budget
+    store = state_store.get_store()
+    upto_id, summary = store.get_history_summary(session)
+    recent = store.history_since(session, upto_id, limit=HISTORY_FETCH_LIMIT)
+    # Lo que queda fuera de la página (más de HISTORY_FETCH_LIMIT mensajes sin resumir)
+    # se añade al resumen por bloques, del más antiguo al más reciente, para no perderlo
+    while recent:
+        older = store.history_before(session, upto_id, recent[0]["id"], limit=HISTORY_FETCH_LIMIT)
+        if not older:
+            break
+        new_summary = summarize_history(summary, older, providers)
+        if not new_summary:
+            print(f"⚠️ [HISTORIAL] Sin resumen; se omiten los mensajes anteriores a los {len(recent)} más recientes.",
+                  file=sys.stderr)
+            break
+        upto_id, summary = older[-1]["id"], new_summary
+        store.set_history_summary(session, upto_id, summary)
+        print(f"📝 [HISTORIAL] {len(older)} mensajes antiguos añadidos al resumen de '{session}'.", file=sys.stderr)
+    costs = [count_tokens(m["content"], providers) for m in recent]
+
+    def available():
+        summary_cost = count_tokens(SUMMARY_PREFIX + summary, providers) + count_tokens(SUMMARY_ACK, providers) if summary else 0
+        return budget - count_tokens(prompt, providers) - summary_cost
+
+    def user_boundary(i):
+        # La ventana siempre empieza por un mensaje del usuario
+        while i < len(recent) and recent[i]["role"] != "user":
+            i += 1
+        return i
+
+    start, used = len(recent), 0
+    while start > 0 and used + costs[start - 1] <= available():
+        start -= 1
+        used += costs[start]
+    start = user_boundary(start)
+
+    if start > 0:
+        fold, remaining = start, sum(costs[start:])
+        while fold < len(recent) and remaining > available() / 2:
+            remaining -= costs[fold]
+            fold += 1
+        fold = user_boundary(fold)
+        new_summary = summarize_history(summary, recent[:fold], providers)
+        if new_summary:
+            print(f"📝 [HISTORIAL] {fold} mensajes antiguos añadidos al resumen de '{session}'.", file=sys.stderr)
+            store.set_history_summary(session, recent[fold - 1]["id"], new_summary)
+            summary, start = new_summary, fold
         else:
-            # Si no, se devuelve un error especial para que el orquestador sepa que debe continuar.
-            result = {"error": "no_memory_found"}
-        print(json.dumps(result))
-        return
+            print(f"⚠️ [HISTORIAL] Sin resumen; se omiten {start} mensajes antiguos.", file=sys.stderr)
 
-    # Gestión de historial
-    if args.prompt.strip().lower() == "/clear":
-        if os.path.exists(HISTORY_FILE):
-            os.remove(HISTORY_FILE)
-        print(json.dumps({"content": "Historial de conversación borrado."}))
+    messages = []
+    if summary:
+        messages += [
+            {"role": "user", "content": SUMMARY_PREFIX + summary},
+            {"role": "assistant", "content": SUMMARY_ACK},
+        ]
+    messages += [{"role": m["role"], "content": m["content"]} for m in recent[start:]]
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def model_for(provider):
+    """Modelo que se pide por defecto a cada proveedor."""
+    return DEFAULT_MODELS.get(provider, GEMINI_MODEL)
+
+
+def deadline_result(partial=""):
+    """Mejor resultado parcial o error de plazo tipado (error_type=deadline_exceeded)."""
+    if partial:
+        print(f"⏱️ [PLAZO] Se devuelve la respuesta parcial ({len(partial)} caracteres).", file=sys.stderr)
+        return {"content": partial, "partial": True}
+    return {"error": "Plazo agotado: ningún proveedor respondió a tiempo.", "error_type": DEADLINE_ERROR_TYPE}
+
+
+def record_outcome(provider, result, latency=None):
+    """
+    Registra el resultado de un proveedor en las estadísticas persistentes. `latency`
+    es el tiempo total hasta la respuesta completa. Los errores por plazo agotado se
+    ignoran: un plazo corto del llamante no debe abrir el breaker de un proveedor sano.
+    """
+    if result.get("error") == "cancelado":
+        return
+    if "error" in result and (result.get("error_type") == DEADLINE_ERROR_TYPE or deadline_expired()):
         return
+    ok = "content" in result and "error" not in result
+    provider_stats.get_stats().record(provider, DEFAULT_MODELS.get(provider), latency if ok else None, ok=ok,
+                                      rate_limited=not ok and provider_stats.is_rate_limited(result.get("error", "")))
+
+
+def hedge_delay(provider):
+    """Espera antes de lanzar una petición de respaldo: el p95 de latencia del proveedor."""
+    with _latencies_lock:
+        samples = sorted(_latencies.get(provider, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    p95 = samples[int(0.95 * (len(samples) - 1))]
+    return max(HEDGE_MIN_DELAY, p95)
+
+
+def _hedged_chat(providers, messages, system_instruction, on_delta=None, max_hedges=MAX_HEDGES, deadline_at=None):
+    """
+    Carrera entre proveedores. Se lanza el primero; si no responde en hedge_delay(),
+    se lanza el siguiente en paralelo (como mucho max_hedges veces). El primero que
+    produce texto se queda la respuesta y los demás se cancelan (se cierra su stream).
+    Si el ganador falla, se sigue con los proveedores restantes uno a uno.
+
+    Con deadline_at (time.monotonic()), al vencer se cancela todo y se devuelve lo
+    que lleve el ganador ({"content", "partial": True}) o un error de plazo.
+    """
+    events = queue.Queue()
+    lock = threading.Lock()
+    state = {"winner": None, "partial": ""}
+    cancels = {}
+    pending = list(providers)
+
+    def attempt(provider, cancel):
+        # Los intentos compiten entre sí: todos comparten el plazo completo
+        _deadline_state.at = deadline_at
+        text = ""
+        start = time.monotonic()
+        result = {"error": "cancelado"}
+        try:
+            stream = stream_provider(provider, messages, system_instruction)
+            try:
+                for delta in stream:
+                    if cancel.is_set():
+                        return
+                    if not text:
+                        record_latency(provider, time.monotonic() - start)
+                        with lock:
+                            if state["winner"] is None:
+                                state["winner"] = provider
+                        events.put((provider, "first"))
+                        if state["winner"] != provider:
+                            return
+                    text += delta
+                    state["partial"] = text
+                    if on_delta:
+                        on_delta(text)
+            finally:
+                stream.close()
+            result = {"content": text, "_provider": provider} if text else {"error": "Respuesta vacía"}
+        except Exception as e:
+            result = {"error": f"Stream interrumpido tras {len(text)} caracteres: {e}" if text else str(e)}
+        finally:
+            record_outcome(provider, result, time.monotonic() - start)
+            events.put((provider, result))
+
+    def launch():
+        provider = pending.pop(0)
+        cancels[provider] = threading.Event()
+        threading.Thread(target=attempt, args=(provider, cancels[provider]), name=f"hedge-{provider}", daemon=True).start()
+        return provider, time.monotonic() + hedge_delay(provider)
+
+    running = 1
+    hedges = 0
+    last_result = {"error": "Ningún proveedor respondió."}
+    current, hedge_at = launch()
+    while running:
+        can_hedge = pending and hedges < max_hedges and state["winner"] is None
+        wait = max(0.0, hedge_at - time.monotonic()) if can_hedge else None
+        if deadline_at is not None:
+            wait = max(0.0, min(wait if wait is not None else float("inf"), deadline_at - time.monotonic()))
+        try:
+            provider, outcome = events.get(timeout=wait)
+        except queue.Empty:
+            if deadline_at is not None and time.monotonic() >= deadline_at:
+                for cancel in cancels.values():
+                    cancel.set()
+                return deadline_result(state["partial"] if state["winner"] else "")
+            hedges += 1
+            running += 1
+            print(f"🏁 [HEDGE] '{current}' no responde; lanzando también '{pending[0]}'.", file=sys.stderr)
+            current, hedge_at = launch()
+            continue
 
-    history = load_history()
-    # Mantener contexto corto (últimos 10 mensajes) para evitar errores de tokens
-    if len(history) > 10:
-        history = history[-10:]
+        if outcome == "first":
+            # Ya hay ganador: cancelar al resto
+            for other, cancel in cancels.items():
+                if other != state["winner"]:
+                    cancel.set()
+            continue
 
-    history.append({"role": "user", "content": args.prompt})
+        running -= 1
+        if provider == state["winner"] and "content" in outcome:
+            return outcome
+        if outcome.get("error") != "cancelado":
+            last_result = outcome
+            print(f"⚠️ Proveedor '{provider}' falló: {outcome.get('error')}. Intentando siguiente...", file=sys.stderr)
+        if provider == state["winner"]:
+            state["winner"] = None
+        if not running and pending:
+            running += 1
+            current, hedge_at = launch()
+    return last_result
+
+
+def chat(prompt, system=None, provider=None, memory_query=None, session=state_store.DEFAULT_SESSION,
+         no_history=False, on_delta=None, hedge=None, no_cache=False, semantic=None, persona=None, language=None,
+         deadline_ms=None):
+    """
+    API en proceso de este script: historial + RAG + fallback entre proveedores.
+    Devuelve {"content": ...} o {"error": ...}.
+
+    Si se pasa on_delta(texto_acumulado), la respuesta se pide en streaming y el
+    callback recibe el texto parcial a medida que llega (si un proveedor falla a
+    mitad, el siguiente empieza de cero y el texto acumulado se reinicia).
+
+    Con hedge=True (o LLM_HEDGE=1) los proveedores compiten en lugar de probarse
+    en orden (ver _hedged_chat).
+
+    Antes de llamar a ningún proveedor se consulta la caché exacta de respuestas
+    (ver llm_cache.py), salvo con no_cache=True. Con semantic=True (o
+    LLM_SEMANTIC_CACHE=1) también la semántica (ver semantic_cache.py), en el
+    ámbito de persona (por defecto, la instrucción de sistema) + language.
+
+    Con deadline_ms la consulta completa (resumen del historial y fallback entre
+    proveedores y modelos incluidos) termina en ese plazo: el tiempo restante se
+    reparte entre los intentos y, si se agota, se devuelve la mejor respuesta
+    parcial ({"content", "partial": True}) o {"error", "error_type": "deadline_exceeded"}.
+    """
+    deadline_at = time.monotonic() + deadline_ms / 1000.0 if deadline_ms else None
+    previous = getattr(_deadline_state, "at", None)
+    _deadline_state.at = deadline_at
+    try:
+        return _chat(prompt, system, provider, memory_query, session, no_history, on_delta, hedge, no_cache,
+                     semantic, persona, language, deadline_at)
+    finally:
+        _deadline_state.at = previous
+
+
+def _chat(prompt, system, provider, memory_query, session, no_history, on_delta, hedge, no_cache,
+          semantic, persona, language, deadline_at):
+    # Definir lista de proveedores a intentar en orden de prioridad
+    providers_to_try = get_providers(provider)
+    if not providers_to_try:
+        return {"error": "No hay API Keys configuradas en .env"}
+    if not provider:
+        # Orden adaptativo: latencia/errores recientes y circuit breakers (ver provider_stats.py)
+        providers_to_try = provider_stats.get_stats().available(providers_to_try)
+
+    use_cache = llm_cache.CACHE_ENABLED and not no_cache
+    semantic = semantic_cache.SEMANTIC_CACHE_ENABLED if semantic is None else semantic
+    similar = semantic_cache.get_semantic_cache() if use_cache and semantic else None
+    if similar and not no_history and state_store.get_store().history_tail(session, limit=1):
+        # Con conversación previa una pregunta que parece independiente ("¿y en inglés?")
+        # depende del contexto: la respuesta de otra conversación no sirve
+        similar = None
+    scope = semantic_cache.scope_key(system if persona is None else persona, language)
+    if similar:
+        answer = similar.lookup(prompt, scope)
+        if answer:
+            if on_delta:
+                on_delta(answer)
+            result = {"content": answer}
+            _save_turn(prompt, result, session, no_history)
+            return result
 
     # --- RAG: Inyección de Memoria ---
-    # Si se proporciona --memory-query, usarla para la búsqueda. Si no, usar el prompt completo.
-    query_for_memory = args.memory_query if args.memory_query else args.prompt
+    # Si se proporciona memory_query, usarla para la búsqueda. Si no, usar el prompt completo.
+    query_for_memory = memory_query if memory_query else prompt
     
-    if args.memory_query:
+    if memory_query:
         print(f"🧠 [RAG] Usando query optimizada: '{query_for_memory}'", file=sys.stderr)
 
-    # Creamos una copia de los mensajes para enviar al LLM con el contexto inyectado,
-    # pero SIN ensuciar el historial guardado en disco.
-    messages_for_llm = [dict(msg) for msg in history] # Deep copy simple
+    # Historial ajustado al presupuesto de tokens (+ resumen de lo anterior); es una
+    # copia: el contexto inyectado no ensucia el historial guardado en disco.
+    if no_history:
+        messages_for_llm = [{"role": "user", "content": prompt}]
+    else:
+        messages_for_llm = build_history(session, prompt, providers_to_try)
     
-    memory_context = get_memory_context(query_for_memory)
+    memory_sources = []
+    memory_context = get_memory_context(query_for_memory, sources=memory_sources)
     if memory_context:
         # Inyectamos el contexto en el último mensaje del usuario
         last_msg = messages_for_llm[-1]
@@ -291,43 +988,54 @@ CONTEXTO DE MEMORIA (Recuerdos relevantes):
 
 ---
 PREGUNTA DEL USUARIO:
-{args.prompt}"""
+{prompt}"""
 
-    # Definir lista de proveedores a intentar en orden de prioridad
-    providers_to_try = []
-    
-    if args.provider:
-        # Si el usuario fuerza uno, solo intentamos ese
-        providers_to_try.append(args.provider)
-    else:
-        # Orden de preferencia: Groq (Rápido) -> Gemini (Backup robusto) -> Otros
-        if os.getenv("GROQ_API_KEY") and os.getenv("GROQ_API_KEY").strip():
-            providers_to_try.append("groq")
-        if os.getenv("GOOGLE_API_KEY") and os.getenv("GOOGLE_API_KEY").strip():
-            providers_to_try.append("gemini")
-        if os.getenv("OPENAI_API_KEY") and os.getenv("OPENAI_API_KEY").strip():
-            providers_to_try.append("openai")
-        if os.getenv("ANTHROPIC_API_KEY") and os.getenv("ANTHROPIC_API_KEY").strip():
-            providers_to_try.append("anthropic")
-            
-    if not providers_to_try:
-        print(json.dumps({"error": "No hay API Keys configuradas en .env"}))
-        return
+    cache = llm_cache.get_cache() if use_cache else None
+    cached = cache.lookup([(p, model_for(p)) for p in providers_to_try], system, messages_for_llm) if cache else None
 
+    hedge = HEDGE_ENABLED if hedge is None else hedge
     result = {}
-    for provider in providers_to_try:
+    answered_by = None
+    if cached:
+        answered_by, content = cached
+        print(f"⚡ [CACHE] Respuesta en caché ({answered_by}).", file=sys.stderr)
+        result = {"content": content}
+        if on_delta:
+            on_delta(content)
+        providers_to_try = []
+    elif hedge and len(providers_to_try) > 1:
+        result = _hedged_chat(providers_to_try, messages_for_llm, system, on_delta, deadline_at=deadline_at)
+        answered_by = result.pop("_provider", None)
+        providers_to_try = []
+
+    if providers_to_try and not provider and getattr(_batch_state, "active", False):
+        # En lotes, primero los proveedores con turno libre (el orden es estable). El turno
+        # del elegido se reserva en el acto para que los demás hilos vean ya su retraso.
+        with _batch_pick_lock:
+            providers_to_try.sort(key=lambda p: provider_limiter(p).delay())
+            _batch_state.slot = (providers_to_try[0], provider_limiter(providers_to_try[0]).reserve())
+
+    best_partial = ""
+    for i, provider in enumerate(providers_to_try):
+        if deadline_at is not None:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0:
+                break
+            _deadline_state.at = time.monotonic() + attempt_share(remaining, len(providers_to_try) - i)
         try:
-            if provider == "openai":
-                result = chat_openai(messages_for_llm, system_instruction=args.system)
-            elif provider == "anthropic":
-                result = chat_anthropic(messages_for_llm, system_instruction=args.system)
-            elif provider == "groq":
-                result = chat_groq(messages_for_llm, system_instruction=args.system)
-            elif provider == "gemini":
-                result = chat_gemini(messages_for_llm, system_instruction=args.system)
+            start = time.monotonic()
+            if on_delta:
+                result = _consume_stream(provider, messages_for_llm, system, on_delta)
+                partial = result.pop("_partial", "")
+                if len(partial) > len(best_partial):
+                    best_partial = partial
+            else:
+                result = call_provider(provider, messages_for_llm, system)
             
+            record_outcome(provider, result, time.monotonic() - start)
             # Si tuvimos éxito (hay contenido y no error), salimos del bucle
             if "content" in result and "error" not in result:
+                answered_by = provider
                 break
             
             # Si falló, logueamos en stderr (para no ensuciar el JSON de stdout) y seguimos
@@ -337,10 +1045,179 @@ PREGUNTA DEL USUARIO:
         except Exception as e:
             print(f"⚠️ Excepción crítica en '{provider}': {e}. Intentando siguiente...", file=sys.stderr)
             result = {"error": str(e)}
+            record_outcome(provider, result)
+
+    _deadline_state.at = deadline_at
+    if deadline_at is not None and "content" not in result and time.monotonic() >= deadline_at:
+        result = deadline_result(best_partial)
+
+    if cache and not cached and answered_by and "content" in result and not result.get("partial"):
+        cache.put(answered_by, model_for(answered_by), system, messages_for_llm, result["content"])
+    if similar and answered_by and "content" in result and not result.get("partial"):
+        similar.put(prompt, scope, result["content"], memory_sources)
+
+    _save_turn(prompt, result, session, no_history)
+    return result
+
+
+def _save_turn(prompt, result, session, no_history):
+    if "content" in result and not no_history:
+        # Solo se añaden los dos mensajes nuevos; no se reescribe el historial
+        state_store.get_store().append_history([
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": result["content"]},
+        ], session=session)
+
+
+# --- Lotes -------------------------------------------------------------------
+
+class ProviderRateLimiter:
+    """Turnos espaciados 1/rate segundos para un proveedor, compartidos por los hilos del lote."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Segundos que esperaría ahora una petición nueva."""
+        with self._lock:
+            return max(0.0, self._next - self._clock())
+
+    def reserve(self):
+        """Aparta el siguiente turno sin esperar y devuelve su instante (según clock)."""
+        with self._lock:
+            slot = max(self._clock(), self._next)
+            self._next = slot + self.interval
+        return slot
+
+    def acquire(self, slot=None):
+        """Espera al turno `slot` ya reservado o, si no se pasa, al siguiente libre."""
+        slot = self.reserve() if slot is None else slot
+        wait = slot - self._clock()
+        if wait > 0:
+            self._sleep(wait)
+
+
+_batch_state = threading.local()
+_limiters = {}
+_batch_pick_lock = threading.Lock()
+
+
+def provider_limiter(provider):
+    with _clients_lock:
+        if provider not in _limiters:
+            _limiters[provider] = ProviderRateLimiter(PROVIDER_RATE_LIMITS.get(provider, 1.0))
+        return _limiters[provider]
+
+
+def chat_batch(batch, concurrency=BATCH_CONCURRENCY):
+    """
+    Ejecuta muchas consultas independientes a la vez (como mucho `concurrency`).
+
+    Cada petición es un prompt o un dict con los argumentos de chat() (prompt,
+    system, provider, memory_query...). Por defecto no usan historial. Las
+    llamadas respetan el límite de velocidad de cada proveedor y, si el
+    preferido está saturado, se reparten entre los demás.
+
+    Devuelve los resultados en el orden de entrada; un fallo en una petición se
+    devuelve como {"error": ...} en su posición sin afectar al resto.
+    """
+    items = [{"prompt": r} if isinstance(r, str) else dict(r) for r in batch]
+
+    def run(item):
+        _batch_state.active = True
+        try:
+            item.setdefault("no_history", True)
+            item.setdefault("hedge", False)
+            item.pop("on_delta", None)
+            return chat(**item)
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+        finally:
+            _batch_state.active = False
+            _batch_state.slot = None
+
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))), thread_name_prefix="llm-batch") as pool:
+        return list(pool.map(run, items))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Enviar un prompt a un LLM (OpenAI/Anthropic).")
+    parser.add_argument("--prompt", help="El mensaje para el LLM.")
+    parser.add_argument("--batch", help="Archivo JSONL ('-' para stdin) con una petición por línea: un prompt o un objeto con los argumentos de chat().")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="Peticiones simultáneas en modo --batch.")
+    parser.add_argument("--provider", choices=["openai", "anthropic", "gemini", "groq"], help="Proveedor de IA.")
+    parser.add_argument("--memory-query", help="Texto específico para buscar en memoria (si es diferente al prompt).")
+    parser.add_argument("--memory-only", action="store_true", help="Solo consulta la memoria y devuelve el resultado directo sin llamar al LLM.")
+    parser.add_argument("--system", help="Instrucción del sistema (personalidad).")
+    parser.add_argument("--session", default=state_store.DEFAULT_SESSION, help="ID de la conversación (p.ej. el chat de Telegram); cada sesión tiene su propio historial.")
+    parser.add_argument("--no-history", action="store_true", help="Consulta puntual: no usa ni guarda historial.")
+    parser.add_argument("--stream", action="store_true", help="Muestra la respuesta en stderr a medida que se genera.")
+    parser.add_argument("--hedge", action="store_true", default=None, help="Lanza el siguiente proveedor en paralelo si el primero tarda más que su p95 (también LLM_HEDGE=1).")
+    parser.add_argument("--no-cache", action="store_true", help="No consulta ni guarda en la caché de respuestas.")
+    parser.add_argument("--deadline-ms", type=int, help="Plazo total de la consulta en milisegundos (repartido entre los proveedores de fallback).")
+    parser.add_argument("--semantic-cache", action="store_true", default=None, help="Reutiliza respuestas a preguntas equivalentes (también LLM_SEMANTIC_CACHE=1).")
+    parser.add_argument("--persona", help="Ámbito de la caché semántica (por defecto, --system).")
+    parser.add_argument("--lang", help="Idioma de la respuesta, para el ámbito de la caché semántica (p.ej. 'es').")
+    args = parser.parse_args(argv)
+
+    # --- MODO LOTE ---
+    if args.batch:
+        if args.batch == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.batch, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        batch = [json.loads(line) for line in lines if line.strip()]
+        start = time.monotonic()
+        results = chat_batch(batch=batch, concurrency=args.concurrency)
+        print(json.dumps({"results": results, "elapsed": round(time.monotonic() - start, 2)}))
+        return
+    if args.prompt is None:
+        parser.error("falta --prompt (o --batch)")
+
+    # --- MODO MEMORY-ONLY ---
+    if args.memory_only:
+        memory_context = get_memory_context(args.prompt)
+        if memory_context:
+            # Si se encuentra algo, se devuelve directamente formateado.
+            result = {"content": f"🧠 Según mi memoria:\n\n{memory_context}"}
+        else:
+            # Si no, se devuelve un error especial para que el orquestador sepa que debe continuar.
+            result = {"error": "no_memory_found"}
+        print(json.dumps(result))
+        return
+
+    # Gestión de historial
+    if args.prompt.strip().lower() == "/clear":
+        state_store.get_store().clear_history(args.session)
+        print(json.dumps({"content": "Historial de conversación borrado."}))
+        return
+
+    on_delta = None
+    if args.stream:
+        # Los fragmentos van a stderr según llegan; stdout queda reservado para el JSON final
+        printed = [0]
+
+        def on_delta(text):
+            if len(text) < printed[0]:
+                sys.stderr.write("\n")
+                printed[0] = 0
+            sys.stderr.write(text[printed[0]:])
+            sys.stderr.flush()
+            printed[0] = len(text)
 
-    if "content" in result:
-        history.append({"role": "assistant", "content": result["content"]})
-        save_history(history)
+    result = chat(args.prompt, system=args.system, provider=args.provider, memory_query=args.memory_query,
+                  session=args.session, no_history=args.no_history, on_delta=on_delta, hedge=args.hedge,
+                  no_cache=args.no_cache, semantic=args.semantic_cache, persona=args.persona, language=args.lang,
+                  deadline_ms=args.deadline_ms)
+    if args.stream:
+        sys.stderr.write("\n")
 
     # Salida en JSON para que el orquestador la consuma
     print(json.dumps(result))
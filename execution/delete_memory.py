@@ -1,56 +1,65 @@
 #!/usr/bin/env python3
 import argparse
 import json
+import os
 import sys
 
-try:
-    import chromadb
-except ImportError:
-    print("Error: Missing 'chromadb'.", file=sys.stderr)
-    sys.exit(10)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-def main():
+import memory_daemon
+
+PREVIEW_CHARS = 80
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Eliminar un recuerdo por ID.")
-    parser.add_argument("--id", help="ID del recuerdo a eliminar.")
-    parser.add_argument("--text", help="Texto contenido en el recuerdo a eliminar (borra coincidencias).")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--id", help="ID del recuerdo a eliminar.")
+    target.add_argument("--text", help="Texto contenido en el recuerdo a eliminar (borra coincidencias).")
+    target.add_argument("--keywords", help="Palabras clave: borra los recuerdos que las contienen todas (sin distinguir acentos).")
+    parser.add_argument("--dry-run", action="store_true", help="Solo muestra los recuerdos que se borrarían.")
+    parser.add_argument("--batch-size", type=int, default=memory_daemon.DELETE_BATCH, help="Recuerdos borrados por lote.")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Ruta a ChromaDB.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    if not args.id and not args.text:
-        print(json.dumps({"status": "error", "message": "Debes proporcionar --id o --text."}))
+    if not args.id and not args.text and not args.keywords:
+        print(json.dumps({"status": "error", "message": "Debes proporcionar --id, --text o --keywords."}))
         sys.exit(1)
 
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
-        
+        # Por el daemon de memoria si está en marcha; si no, abriendo ChromaDB directamente.
+        # --text y --keywords se resuelven en el índice de texto (memory_index.py)
         if args.id:
-            collection.delete(ids=[args.id])
+            result = memory_daemon.call("delete", db_path=args.db_path, ids=[args.id], dry_run=args.dry_run)
+            if args.dry_run:
+                print(json.dumps({"status": "success", "dry_run": True, "count": 1, "matches": result["matches"]}))
+                return
             print(json.dumps({
                 "status": "success", 
                 "message": f"Recuerdo {args.id} eliminado correctamente."
             }))
-        elif args.text:
-            # Buscar IDs por texto
-            results = collection.get()
-            ids_to_delete = []
-            if results['ids']:
-                for i, doc in enumerate(results['documents']):
-                    if args.text.lower() in doc.lower():
-                        ids_to_delete.append(results['ids'][i])
-            
-            if ids_to_delete:
-                collection.delete(ids=ids_to_delete)
+        else:
+            query = args.text or args.keywords
+            result = memory_daemon.call("delete", db_path=args.db_path, text=args.text, keywords=args.keywords,
+                                        dry_run=args.dry_run, batch_size=args.batch_size)
+            if args.dry_run:
+                matches = [{"id": m["id"], "timestamp": m.get("timestamp", ""),
+                            "content": m["content"][:PREVIEW_CHARS]} for m in result["matches"]]
+                print(json.dumps({"status": "success", "dry_run": True, "count": len(matches), "matches": matches},
+                                 indent=2))
+            elif result["deleted"]:
                 print(json.dumps({
                     "status": "success", 
-                    "message": f"Se eliminaron {len(ids_to_delete)} recuerdos que contenían '{args.text}'."
+                    "message": f"Se eliminaron {len(result['deleted'])} recuerdos que contenían '{query}'."
                 }))
             else:
-                print(json.dumps({"status": "error", "message": f"No se encontraron recuerdos con: {args.text}"}))
+                print(json.dumps({"status": "error", "message": f"No se encontraron recuerdos con: {query}"}))
         
+    except ImportError:
+        print("Error: Missing 'chromadb'.", file=sys.stderr)
+        sys.exit(10)
     except Exception as e:
         print(json.dumps({"status": "error", "message": str(e)}))
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,65 +1,46 @@
 import argparse
 import json
+import os
 import sys
 from pathlib import Path
 
-try:
-    import chromadb
-except ImportError:
-    print("Error: Missing 'chromadb'.", file=sys.stderr)
-    sys.exit(10)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import memory_daemon
 
-def main():
+
+def main(argv=None):
     """
-    Lists the most recent memories stored in ChromaDB by sorting metadata timestamps.
+    Lists the most recent memories, newest first, from the timestamp index
+    (memory_index.py), so the cost depends on --limit and not on the collection size.
+    Uses the memory daemon when it is running and falls back to opening ChromaDB directly.
     """
     parser = argparse.ArgumentParser(description="List recent agent memories.")
     parser.add_argument("--limit", type=int, default=10, help="Number of memories to return.")
+    parser.add_argument("--category", help="Only memories with this category.")
+    parser.add_argument("--chat-id", help="Only memories saved from this chat.")
+    parser.add_argument("--cursor", help="next_cursor of the previous page (older memories).")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Path to ChromaDB.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
-    except Exception as e:
+        page = memory_daemon.call("list", db_path=args.db_path, limit=args.limit, category=args.category,
+                                  chat_id=args.chat_id, cursor=args.cursor)
+    except ImportError:
+        print("Error: Missing 'chromadb'.", file=sys.stderr)
+        sys.exit(10)
+    except memory_daemon.MemoryUnavailable as e:
         print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
         sys.exit(2)
-
-    try:
-        # Fetch all items to sort them in Python (ChromaDB doesn't support native sort by metadata yet)
-        # For a local agent with <10k memories, this is fast enough.
-        data = collection.get()
-
-        memories = []
-        if data['ids']:
-            for i in range(len(data['ids'])):
-                mem_id = data['ids'][i]
-                doc = data['documents'][i] if data['documents'] else ""
-                meta = data['metadatas'][i] if data['metadatas'] else {}
-
-                memories.append({
-                    "id": mem_id,
-                    "content": doc,
-                    "metadata": meta,
-                    "timestamp": meta.get("timestamp", "")
-                })
-
-        # Sort by timestamp descending (newest first)
-        # ISO format strings are sortable lexicographically
-        memories.sort(key=lambda x: x['timestamp'], reverse=True)
-
-        # Slice to limit
-        recent_memories = memories[:args.limit]
-
-    except Exception as e:
+    except memory_daemon.MemoryServiceError as e:
         print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
         sys.exit(3)
 
     print(json.dumps({
         "status": "success",
-        "count": len(recent_memories),
-        "memories": recent_memories
+        "count": len(page["memories"]),
+        "memories": page["memories"],
+        "next_cursor": page["next_cursor"]
     }, indent=2))
 
 
@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 import time
-import subprocess
-import json
+import argparse
+import asyncio
 import sys
 import os
 import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-load_dotenv()
+import tool_runtime
+import state_store
+import telegram_tool
+import telegram_webhook
+from reminder_scheduler import ReminderScheduler, is_valid_tz
+from telegram_broadcast import Broadcast
 
-USERS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "telegram_users.txt")
-REMINDERS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "telegram_reminders.json")
-PERSONA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "telegram_persona.txt")
-CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "telegram_config.json")
+load_dotenv()
 
 PERSONAS = {
     "default": "Eres un asistente de IA creado por el Prof. César Rodríguez con Gemini Code Assist. Tu propósito es apoyar a estudiantes de informática y al equipo de investigación 'Tecnología Venezolana'. Resides en una PC con GNU/Linux. Responde de forma amable, clara y concisa, y si te preguntan quién eres, menciona estos detalles.",
@@ -23,190 +27,362 @@ PERSONAS = {
     "frances": "Tu es un assistant IA créé par le Prof. César Rodríguez. Tu résides sur un PC GNU/Linux. Réponds toujours en français, de manière gentille, claire et concise."
 }
 
+GREETINGS = ["hola", "hola!", "hi", "hello", "/start"]
+THANKS = ["gracias", "gracias!", "thanks", "thank you"]
+
+# Carriles del planificador (modo --async). Se clasifican con los mismos prefijos
+# que la cadena de comandos de handle_message().
+FAST_COMMANDS = ("/ayuda", "/help", "/status", "/modo", "/idioma", "/lang",
+                 "/usuarios", "/users", "/borrar_recordatorios", "/clear_reminders",
+                 "/recordatorio", "/remind", "/zona_horaria", "/timezone",
+                 "/broadcast", "/anuncio", "/reanudar_broadcast", "/cancelar_broadcast")
+HEAVY_COMMANDS = ("/ayuda_medica",)
+# Comandos rápidos que cambian el estado del chat: respetan el orden con el carril pesado
+BARRIER_COMMANDS = ("/modo", "/idioma", "/lang", "/zona_horaria", "/timezone")
+
+# El estado del bot (usuarios, ajustes, recordatorios) vive en SQLite (ver state_store.py)
+
 def get_current_persona():
-    if os.path.exists(PERSONA_FILE):
-        with open(PERSONA_FILE, 'r') as f:
-            return f.read().strip()
-    return PERSONAS["default"]
+    return state_store.get_store().get_setting("persona") or PERSONAS["default"]
 
 def set_persona(persona_key):
-    with open(PERSONA_FILE, 'w') as f:
-        f.write(PERSONAS.get(persona_key, PERSONAS["default"]))
+    state_store.get_store().set_setting("persona", PERSONAS.get(persona_key, PERSONAS["default"]))
 
 def save_user(chat_id):
     """Registra el ID del usuario para futuros broadcasts."""
     if not chat_id: return
-    users = set()
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            users = set(f.read().splitlines())
-    if str(chat_id) not in users:
-        with open(USERS_FILE, 'a') as f:
-            f.write(f"{chat_id}\n")
+    state_store.get_store().add_user(chat_id)
 
 def load_reminders():
-    if os.path.exists(REMINDERS_FILE):
+    return state_store.get_store().load_reminders()
+
+def save_reminder(reminder):
+    state_store.get_store().upsert_reminder(reminder)
+
+def delete_reminder(reminder_id):
+    state_store.get_store().delete_reminder(reminder_id)
+
+def send_reminder(reminder):
+    print(f"   ⏰ Enviando recordatorio a {reminder['chat_id']}: {reminder['message']}")
+    run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏰ *RECORDATORIO:*\n\n{reminder['message']}", "--chat-id", reminder['chat_id']])
+
+_reminder_scheduler = None
+_reminder_lock = threading.Lock()
+
+def get_reminder_scheduler():
+    """Planificador de recordatorios (se carga del disco una sola vez)."""
+    global _reminder_scheduler
+    with _reminder_lock:
+        if _reminder_scheduler is None:
+            _reminder_scheduler = ReminderScheduler(load_reminders, save_reminder, delete_reminder, send_reminder)
+        return _reminder_scheduler
+
+def get_session_id(chat_id):
+    """Sesión de historial de chat_with_llm.py: una por chat, para no mezclar conversaciones."""
+    return f"telegram:{chat_id}"
+
+def get_chat_timezone(chat_id):
+    """Zona horaria configurada por el chat con /zona_horaria (vacío = la del servidor)."""
+    return state_store.get_store().get_chat_setting(chat_id, "timezone", "")
+
+_broadcast = None
+_broadcast_lock = threading.Lock()
+
+def format_broadcast_progress(p):
+    return f"📢 Anuncio: {p['done']}/{p['total']} (✅ {p['sent']} · ❌ {p['failed']})"
+
+def _run_broadcast(broadcast, admin_id):
+    """Hilo de fondo: difunde el anuncio y envía el resumen a quien lo lanzó."""
+    global _broadcast
+    try:
+        summary = broadcast.run()
+        status = "⏸️ *Anuncio detenido*" if summary["status"] == "cancelled" else "✅ *Anuncio completado*"
+        text = (
+            f"{status}\n\n"
+            f"📨 Entregados: {summary['sent']}/{summary['total']}\n"
+            f"❌ Fallidos: {summary['failed']}\n"
+            f"⏳ Pendientes: {summary['pending']}\n"
+            f"⏱️ {summary['elapsed']} s ({summary['per_second']} msg/s)"
+        )
+        if summary["pending"]:
+            text += "\n\nUsa /reanudar_broadcast para continuar."
+    except Exception as e:
+        text = f"❌ Error en el anuncio: {e}\nUsa /reanudar_broadcast para continuar."
+    finally:
+        with _broadcast_lock:
+            _broadcast = None
+    try:
+        broadcast.notify(admin_id, text)
+    except Exception as e:
+        print(f"⚠️ [BROADCAST] No se pudo enviar el resumen a {admin_id}: {e}", file=sys.stderr)
+
+def current_broadcast():
+    """Difusión en curso (None si no hay ninguna)."""
+    with _broadcast_lock:
+        return _broadcast
+
+def start_broadcast(broadcast, admin_id):
+    """
+    Lanza la difusión en segundo plano. Devuelve None si se ha lanzado, o la difusión
+    que ya estaba en curso (comprobación y lectura en un mismo paso con el lock).
+    """
+    global _broadcast
+    with _broadcast_lock:
+        if _broadcast is not None:
+            return _broadcast
+        _broadcast = broadcast
+    # El progreso comparte el limitador del anuncio para no sumar envíos por encima del límite
+    broadcast.on_progress = lambda p: broadcast.notify(admin_id, format_broadcast_progress(p))
+    threading.Thread(target=_run_broadcast, args=(broadcast, admin_id), name="broadcast", daemon=True).start()
+    return None
+
+# Respuestas en streaming: mensaje provisional que se edita mientras el LLM genera
+STREAM_REPLIES = os.getenv("TELEGRAM_STREAM_REPLIES", "1") != "0"
+STREAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_STREAM_EDIT_INTERVAL", "1.0"))
+STREAM_PLACEHOLDER = "✍️ ..."
+TELEGRAM_MAX_LENGTH = 4096
+
+# Pausa (s) antes de volver a consultar updates si la consulta anterior falló
+POLL_ERROR_BACKOFF = 5
+
+# Margen (s) entre el plazo de chat_with_llm en el runtime y el que se le pasa (--deadline-ms)
+LLM_DEADLINE_MARGIN = 5
+
+def split_message(text, limit=TELEGRAM_MAX_LENGTH):
+    """Parte un texto largo en trozos de como mucho `limit` caracteres (por saltos de línea si es posible)."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """
+    Respuesta que se muestra mientras el LLM la genera: se envía un mensaje
+    provisional y se edita (editMessageText) como mucho una vez cada `interval` s,
+    para no chocar con los límites de Telegram.
+    """
+
+    def __init__(self, chat_id, interval=STREAM_EDIT_INTERVAL, clock=time.monotonic):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.message_id = None
+        self._clock = clock
+        self._next_edit = 0.0
+        self._last_text = ""
+
+    def start(self):
+        """Envía el mensaje provisional. Devuelve False si no se pudo."""
         try:
-            with open(REMINDERS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-def load_config():
-    if os.path.exists(CONFIG_FILE):
+            sent = telegram_tool.deliver_message(self.chat_id, STREAM_PLACEHOLDER)
+            self.message_id = sent["message_id"]
+        except Exception as e:
+            print(f"   ⚠️ No se pudo iniciar la respuesta en streaming: {e}")
+            return False
+        self._next_edit = self._clock() + self.interval
+        return True
+
+    def _edit(self, text, parse_mode=None):
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f)
-
-def save_reminders(reminders):
-    with open(REMINDERS_FILE, 'w') as f:
-        json.dump(reminders, f)
-
-def check_reminders():
-    reminders = load_reminders()
-    if not reminders: return
-
-    now = datetime.datetime.now()
-    current_time = now.strftime("%H:%M")
-    today_str = now.strftime("%Y-%m-%d")
-    updated = False
-
-    for r in reminders:
-        # Si coincide la hora y NO se ha enviado hoy
-        if r.get('time') == current_time and r.get('last_sent') != today_str:
-            print(f"   ⏰ Enviando recordatorio a {r['chat_id']}: {r['message']}")
-            run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏰ *RECORDATORIO:*\n\n{r['message']}", "--chat-id", r['chat_id']])
-            r['last_sent'] = today_str
-            updated = True
-    
-    if updated:
-        save_reminders(reminders)
+            telegram_tool.edit_message_text(self.chat_id, self.message_id, text, parse_mode=parse_mode)
+        except telegram_tool.TelegramAPIError as e:
+            if e.retry_after:
+                self._next_edit = self._clock() + e.retry_after
+                return False
+            raise
+        self._next_edit = self._clock() + self.interval
+        return True
 
-def run_tool(script, args):
-    """Ejecuta una herramienta del framework y devuelve su salida JSON."""
-    script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
-    cmd = [sys.executable, script_path] + args
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        # Mostrar stderr para depuración (RAG, errores, etc.)
-        if result.stderr:
-            print(f"   🛠️  [LOG {script}]: {result.stderr.strip()}")
-            
-        return json.loads(result.stdout)
-    except json.JSONDecodeError:
+    def update(self, text):
+        """Callback de streaming (texto acumulado). Las ediciones intermedias van en texto plano."""
+        if not text.strip() or text == self._last_text or self._clock() < self._next_edit:
+            return
+        try:
+            # El Markdown a medio generar suele ser inválido; el formato llega en la edición final
+            if self._edit(text[:TELEGRAM_MAX_LENGTH - 2] + " ▌"):
+                self._last_text = text
+        except Exception as e:
+            print(f"   ⚠️ Error editando respuesta parcial: {e}")
+
+    def finish(self, text):
+        """Deja el texto definitivo (con formato); si no cabe en un mensaje, envía el resto aparte."""
+        chunks = split_message(text)
+        rest = chunks[1:]
+        try:
+            edited = self._edit(chunks[0], parse_mode="Markdown")
+            if not edited:
+                # 429: esperar lo que pide Telegram y reintentar una vez
+                time.sleep(max(0.0, self._next_edit - self._clock()))
+                edited = self._edit(chunks[0], parse_mode="Markdown")
+            if not edited:
+                rest = chunks
+        except Exception as e:
+            print(f"   ⚠️ Error en la edición final ({e}). Enviando como mensaje nuevo.")
+            rest = chunks
+        for chunk in rest:
+            run_tool("telegram_tool.py", ["--action", "send", "--message", chunk, "--chat-id", self.chat_id])
+
+def stream_chat_reply(sender_id, **chat_kwargs):
+    """
+    Chat general con la respuesta en streaming. Devuelve (StreamingReply, resultado de
+    chat_with_llm.chat()) o None si no se puede (sin token, herramienta aislada...),
+    en cuyo caso se usa la llamada normal con run_tool().
+    """
+    if not STREAM_REPLIES or not telegram_tool.TOKEN:
         return None
-    except Exception as e:
-        print(f"Error ejecutando {script}: {e}")
+    if tool_runtime.is_isolated("chat_with_llm.py") or tool_runtime.load_tool("chat_with_llm.py") is None:
+        return None
+    reply = StreamingReply(sender_id)
+    if not reply.start():
         return None
+    chat_kwargs.setdefault("deadline_ms", llm_deadline_ms())
+    result = tool_runtime.call("chat_with_llm.py", "chat", on_delta=reply.update, **chat_kwargs)
+    return reply, result
 
-def main():
-    print("📡 Escuchando Telegram... (Presiona Ctrl+C para detener)")
-    print("   El agente responderá a cualquier mensaje que le envíes.")
-    
-    last_health_check = time.time()
-    HEALTH_CHECK_INTERVAL = 300  # Verificar cada 5 minutos
+def prewarm_llm_clients():
+    """Precalienta las sesiones keep-alive de chat_with_llm (ver chat_with_llm.prewarm)."""
+    result = tool_runtime.call("chat_with_llm.py", "prewarm")
+    if isinstance(result, dict) and "status" not in result:
+        print(f"   🔥 Conexiones LLM precalentadas: {result}")
+
+class ToolTimeout(Exception):
+    """Una herramienta superó su plazo (configurado en tool_runtime.TOOLS)."""
+
+    def __init__(self, result):
+        self.tool = result.get("tool", "")
+        self.timeout = result.get("timeout", 0)
+        super().__init__(result.get("message", "Tiempo de espera agotado."))
+
+def llm_deadline_ms():
+    """
+    Plazo que se pasa a chat_with_llm: el del runtime menos un margen, para que la
+    consulta devuelva una respuesta parcial o un error de plazo antes de cancelarse.
+    """
+    return int(max(1.0, tool_runtime.get_timeout("chat_with_llm.py") - LLM_DEADLINE_MARGIN) * 1000)
+
+def run_tool(script, args):
+    """Ejecuta una herramienta del framework y devuelve su salida JSON.
+
+    Por defecto la herramienta se llama en proceso (ver tool_runtime.py); las
+    marcadas como aisladas siguen ejecutándose en un subproceso.
+    Lanza ToolTimeout si la herramienta supera su plazo.
+    """
+    if script == "chat_with_llm.py" and "--deadline-ms" not in args:
+        args = list(args) + ["--deadline-ms", str(llm_deadline_ms())]
+    res = tool_runtime.run_tool(script, args)
+    if res and res.get("status") == "timeout":
+        raise ToolTimeout(res)
+    return res
 
+def format_timeout_reply(error):
+    """Respuesta para el usuario cuando una herramienta supera su plazo."""
+    tool_name = os.path.splitext(error.tool)[0]
+    return (
+        "⏱️ *La operación tardó demasiado*\n\n"
+        f"La herramienta `{tool_name}` no respondió en {error.timeout:g} s y se canceló.\n"
+        "Inténtalo de nuevo en unos minutos o con una petición más corta."
+    )
+
+def handle_message(msg):
+    """Procesa un mensaje y, si alguna herramienta supera su plazo, avisa al usuario."""
     try:
-        while True:
-            # 1. Consultar nuevos mensajes
-            response = run_tool("telegram_tool.py", ["--action", "check"])
+        process_message(msg)
+    except ToolTimeout as e:
+        sender_id = get_chat_key(msg)
+        print(f"   ⏱️ {e}")
+        if sender_id:
+            # Directo al runtime: si el aviso también vence, no hay nada más que hacer
+            tool_runtime.run_tool("telegram_tool.py", ["--action", "send", "--message", format_timeout_reply(e), "--chat-id", sender_id])
+
+def process_message(msg):
+    """Procesa un mensaje entrante ("CHAT_ID|MENSAJE") y envía la respuesta."""
+    # Parsear formato "CHAT_ID|MENSAJE"
+    if "|" in msg:
+        sender_id, content = msg.split("|", 1)
+    else:
+        sender_id = None
+        content = msg
+
+    save_user(sender_id)
+    print(f"\n📩 Mensaje recibido de {sender_id}: '{content}'")
+    
+    reply_text = ""
+    reply_message = None # StreamingReply si la respuesta se está mostrando en streaming
+    msg = content # Usamos el contenido limpio para la lógica
+    is_voice_interaction = False # Bandera para saber si responder con audio
+    voice_lang_short = "es" # Default language for TTS
+    
+    # --- COMANDOS ESPECIALES (Capa 3: Ejecución) ---
+    
+    # 1. DETECCIÓN DE FOTOS
+    if msg.startswith("__PHOTO__:"):
+        try:
+            parts = msg.replace("__PHOTO__:", "").split("|||")
+            file_id = parts[0]
+            caption = parts[1] if len(parts) > 1 else "Describe esta imagen."
+            if not caption.strip(): caption = "Describe qué ves en esta imagen."
             
-            if response and response.get("status") == "error":
-                print(f"⚠️ Error en Telegram: {response.get('message')}")
-                time.sleep(5) # Esperar un poco más si hubo error para no saturar
-
-            if response and response.get("status") == "success":
-                messages = response.get("messages", [])
-                for msg in messages:
-                    # Parsear formato "CHAT_ID|MENSAJE"
-                    if "|" in msg:
-                        sender_id, content = msg.split("|", 1)
-                    else:
-                        sender_id = None
-                        content = msg
+            print(f"   📸 Foto recibida. Descargando ID: {file_id}...")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", "👀 Analizando imagen...", "--chat-id", sender_id])
+            
+            # Descargar
+            local_path = os.path.join(".tmp", f"photo_{sender_id}_{int(time.time())}.jpg")
+            run_tool("telegram_tool.py", ["--action", "download", "--file-id", file_id, "--dest", local_path])
+            
+            # Analizar
+            res = run_tool("analyze_image.py", ["--image", local_path, "--prompt", caption])
+            if res and res.get("status") == "success":
+                reply_text = f"👁️ *Análisis Visual:*\n{res.get('description')}"
+            else:
+                reply_text = f"❌ Error analizando imagen: {res.get('message')}"
+                
+        except ToolTimeout:
+            raise
+        except Exception as e:
+            reply_text = f"❌ Error procesando foto: {e}"
 
-                    save_user(sender_id)
-                    print(f"\n📩 Mensaje recibido de {sender_id}: '{content}'")
-                    
-                    reply_text = ""
-                    msg = content # Usamos el contenido limpio para la lógica
-                    is_voice_interaction = False # Bandera para saber si responder con audio
-                    voice_lang_short = "es" # Default language for TTS
-                    
-                    # --- COMANDOS ESPECIALES (Capa 3: Ejecución) ---
+    # 1.2 DETECCIÓN DE DOCUMENTOS (PDF)
+    elif msg.startswith("__DOCUMENT__:"):
+        try:
+            parts = msg.replace("__DOCUMENT__:", "").split("|||")
+            file_id = parts[0]
+            file_name = parts[1]
+            caption = parts[2] if len(parts) > 2 else ""
+            
+            print(f"   📄 Documento recibido: {file_name}. Descargando...")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", f"📂 Recibí `{file_name}`. Leyendo contenido...", "--chat-id", sender_id])
+            
+            # Descargar a .tmp (que se monta en /mnt/out en el sandbox)
+            local_path = os.path.join(".tmp", file_name)
+            run_tool("telegram_tool.py", ["--action", "download", "--file-id", file_id, "--dest", local_path])
+            
+            # Extraer texto usando el Sandbox (ya tiene pypdf)
+            # Nota: .tmp está montado en /mnt/out dentro del contenedor
+            path_in_sandbox = f"/mnt/out/{file_name}"
+            
+            read_code = (
+                f"from pypdf import PdfReader; "
+                f"reader = PdfReader('{path_in_sandbox}'); "
+                f"print('\\n'.join([page.extract_text() for page in reader.pages]))"
+            )
+            
+            res_sandbox = run_tool("run_sandbox.py", ["--code", read_code])
+            
+            if res_sandbox and res_sandbox.get("status") == "success":
+                content = res_sandbox.get("stdout", "")
+                if len(content) > 15000:
+                    content = content[:15000] + "... (truncado)"
+                
+                if not content.strip():
+                    reply_text = "⚠️ El documento parece estar vacío o es una imagen escaneada sin texto (OCR no disponible en sandbox)."
+                else:
+                    # Analizar con LLM
+                    analysis_prompt = f"""Actúa como un Asistente Médico experto y empático. Analiza el siguiente informe médico proporcionado por el usuario.
                     
-                    # 1. DETECCIÓN DE FOTOS
-                    if msg.startswith("__PHOTO__:"):
-                        try:
-                            parts = msg.replace("__PHOTO__:", "").split("|||")
-                            file_id = parts[0]
-                            caption = parts[1] if len(parts) > 1 else "Describe esta imagen."
-                            if not caption.strip(): caption = "Describe qué ves en esta imagen."
-                            
-                            print(f"   📸 Foto recibida. Descargando ID: {file_id}...")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", "👀 Analizando imagen...", "--chat-id", sender_id])
-                            
-                            # Descargar
-                            local_path = os.path.join(".tmp", f"photo_{int(time.time())}.jpg")
-                            run_tool("telegram_tool.py", ["--action", "download", "--file-id", file_id, "--dest", local_path])
-                            
-                            # Analizar
-                            res = run_tool("analyze_image.py", ["--image", local_path, "--prompt", caption])
-                            if res and res.get("status") == "success":
-                                reply_text = f"👁️ *Análisis Visual:*\n{res.get('description')}"
-                            else:
-                                reply_text = f"❌ Error analizando imagen: {res.get('message')}"
-                                
-                        except Exception as e:
-                            reply_text = f"❌ Error procesando foto: {e}"
-
-                    # 1.2 DETECCIÓN DE DOCUMENTOS (PDF)
-                    elif msg.startswith("__DOCUMENT__:"):
-                        try:
-                            parts = msg.replace("__DOCUMENT__:", "").split("|||")
-                            file_id = parts[0]
-                            file_name = parts[1]
-                            caption = parts[2] if len(parts) > 2 else ""
-                            
-                            print(f"   📄 Documento recibido: {file_name}. Descargando...")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", f"📂 Recibí `{file_name}`. Leyendo contenido...", "--chat-id", sender_id])
-                            
-                            # Descargar a .tmp (que se monta en /mnt/out en el sandbox)
-                            local_path = os.path.join(".tmp", file_name)
-                            run_tool("telegram_tool.py", ["--action", "download", "--file-id", file_id, "--dest", local_path])
-                            
-                            # Extraer texto usando el Sandbox (ya tiene pypdf)
-                            # Nota: .tmp está montado en /mnt/out dentro del contenedor
-                            path_in_sandbox = f"/mnt/out/{file_name}"
-                            
-                            read_code = (
-                                f"from pypdf import PdfReader; "
-                                f"reader = PdfReader('{path_in_sandbox}'); "
-                                f"print('\\n'.join([page.extract_text() for page in reader.pages]))"
-                            )
-                            
-                            res_sandbox = run_tool("run_sandbox.py", ["--code", read_code])
-                            
-                            if res_sandbox and res_sandbox.get("status") == "success":
-                                content = res_sandbox.get("stdout", "")
-                                if len(content) > 15000:
-                                    content = content[:15000] + "... (truncado)"
-                                
-                                if not content.strip():
-                                    reply_text = "⚠️ El documento parece estar vacío o es una imagen escaneada sin texto (OCR no disponible en sandbox)."
-                                else:
-                                    # Analizar con LLM
-                                    analysis_prompt = f"""Actúa como un Asistente Médico experto y empático. Analiza el siguiente informe médico proporcionado por el usuario.
-                                    
 CONTEXTO DEL USUARIO: {caption}
 
 CONTENIDO DEL DOCUMENTO:
@@ -218,111 +394,116 @@ TAREA:
 3. Si hay diagnósticos o tratamientos, explícalos brevemente.
 4. IMPORTANTE: Termina con un disclaimer: "Nota: Soy una IA. Este análisis es informativo y no sustituye la opinión de un médico."
 """
-                                    run_tool("telegram_tool.py", ["--action", "send", "--message", "🧠 Analizando informe médico...", "--chat-id", sender_id])
-                                    
-                                    llm_res = run_tool("chat_with_llm.py", ["--prompt", analysis_prompt])
-                                    
-                                    if llm_res and "content" in llm_res:
-                                        reply_text = llm_res["content"]
-                                    else:
-                                        reply_text = "❌ Error al analizar el documento con la IA."
-                            else:
-                                err = res_sandbox.get("stderr") or res_sandbox.get("message")
-                                reply_text = f"❌ Error leyendo el PDF: {err}"
-
-                        except Exception as e:
-                            reply_text = f"❌ Error procesando documento: {e}"
-
-                    # 1.5 DETECCIÓN DE VOZ
-                    elif msg.startswith("__VOICE__:"):
-                        try:
-                            is_voice_interaction = True
-                            file_id = msg.replace("__VOICE__:", "")
-                            print(f"   🎤 Nota de voz recibida. Descargando ID: {file_id}...")
-
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", "👂 Escuchando...", "--chat-id", sender_id])
-                            
-                            local_path = os.path.join(".tmp", f"voice_{int(time.time())}.ogg")
-                            run_tool("telegram_tool.py", ["--action", "download", "--file-id", file_id, "--dest", local_path])
-                            
-                            # Transcribir
-                            # Cargar idioma configurado (default es-ES)
-                            config = load_config()
-                            lang_code = config.get("voice_lang", "es-ES")
-                            voice_lang_short = lang_code.split('-')[0] # 'es-ES' -> 'es'
-                            
-                            res = run_tool("transcribe_audio.py", ["--file", local_path, "--lang", lang_code])
-                            if res and res.get("status") == "success":
-                                text = res.get("text")
-                                print(f"   📝 Transcripción: '{text}'")
-                                # ¡Truco! Reemplazamos el mensaje de voz por su texto y dejamos que el flujo continúe
-                                msg = text
-                                run_tool("telegram_tool.py", ["--action", "send", "--message", f"🗣️ Dijiste: \"{text}\"", "--chat-id", sender_id])
-                            else:
-                                err_msg = res.get("message", "Error desconocido") if res else "Falló el script de transcripción"
-                                reply_text = f"❌ No pude entender el audio. Detalle: {err_msg}"
-                        except Exception as e:
-                            reply_text = f"❌ Error procesando audio: {e}"
-
-                    # 2. COMANDOS DE TEXTO
-                    # (Nota: usamos 'if' aquí en lugar de 'elif' para que el texto transcrito de voz pueda entrar)
-                    if msg.startswith("/investigar") or msg.startswith("/research"):
-                        topic = msg.split(" ", 1)[1] if " " in msg else ""
-                        if not topic:
-                            reply_text = "⚠️ Uso: /investigar [tema]"
-                        else:
-                            print(f"   🔍 Ejecutando investigación sobre: {topic}")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", f"🕵️‍♂️ Investigando sobre '{topic}'... dame unos segundos.", "--chat-id", sender_id])
-                            
-                            # Ejecutar herramienta de research
-                            res = run_tool("research_topic.py", ["--query", topic, "--output-file", ".tmp/tg_research.txt"])
-                            
-                            if res and res.get("status") == "success":
-                                # Leer y resumir resultados
-                                try:
-                                    with open(".tmp/tg_research.txt", "r", encoding="utf-8") as f:
-                                        data = f.read()
-                                    print("   🧠 Resumiendo resultados...")
-                                    
-                                    # Prompt mejorado: pide al LLM que use su memoria (RAG) y los resultados de la búsqueda.
-                                    summarization_prompt = f"""Considerando lo que ya sabes en tu memoria y los siguientes resultados de búsqueda sobre '{topic}', crea un resumen conciso para Telegram.
+                    run_tool("telegram_tool.py", ["--action", "send", "--message", "🧠 Analizando informe médico...", "--chat-id", sender_id])
+                    
+                    llm_res = run_tool("chat_with_llm.py", ["--prompt", analysis_prompt, "--no-history"])
+                    
+                    if llm_res and "content" in llm_res:
+                        reply_text = llm_res["content"]
+                    else:
+                        reply_text = "❌ Error al analizar el documento con la IA."
+            else:
+                err = res_sandbox.get("stderr") or res_sandbox.get("message")
+                reply_text = f"❌ Error leyendo el PDF: {err}"
+
+        except ToolTimeout:
+            raise
+        except Exception as e:
+            reply_text = f"❌ Error procesando documento: {e}"
+
+    # 1.5 DETECCIÓN DE VOZ
+    elif msg.startswith("__VOICE__:"):
+        try:
+            is_voice_interaction = True
+            file_id = msg.replace("__VOICE__:", "")
+            print(f"   🎤 Nota de voz recibida. Descargando ID: {file_id}...")
+
+            run_tool("telegram_tool.py", ["--action", "send", "--message", "👂 Escuchando...", "--chat-id", sender_id])
+            
+            local_path = os.path.join(".tmp", f"voice_{sender_id}_{int(time.time())}.ogg")
+            run_tool("telegram_tool.py", ["--action", "download", "--file-id", file_id, "--dest", local_path])
+            
+            # Transcribir
+            # Cargar idioma configurado (default es-ES)
+            lang_code = state_store.get_store().get_setting("voice_lang", "es-ES")
+            voice_lang_short = lang_code.split('-')[0] # 'es-ES' -> 'es'
+            
+            res = run_tool("transcribe_audio.py", ["--file", local_path, "--lang", lang_code])
+            if res and res.get("status") == "success":
+                text = res.get("text")
+                print(f"   📝 Transcripción: '{text}'")
+                # ¡Truco! Reemplazamos el mensaje de voz por su texto y dejamos que el flujo continúe
+                msg = text
+                run_tool("telegram_tool.py", ["--action", "send", "--message", f"🗣️ Dijiste: \"{text}\"", "--chat-id", sender_id])
+            else:
+                err_msg = res.get("message", "Error desconocido") if res else "Falló el script de transcripción"
+                reply_text = f"❌ No pude entender el audio. Detalle: {err_msg}"
+        except ToolTimeout:
+            raise
+        except Exception as e:
+            reply_text = f"❌ Error procesando audio: {e}"
+
+    # 2. COMANDOS DE TEXTO
+    # (Nota: usamos 'if' aquí en lugar de 'elif' para que el texto transcrito de voz pueda entrar)
+    if msg.startswith("/investigar") or msg.startswith("/research"):
+        topic = msg.split(" ", 1)[1] if " " in msg else ""
+        if not topic:
+            reply_text = "⚠️ Uso: /investigar [tema]"
+        else:
+            print(f"   🔍 Ejecutando investigación sobre: {topic}")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", f"🕵️‍♂️ Investigando sobre '{topic}'... dame unos segundos.", "--chat-id", sender_id])
+            
+            # Ejecutar herramienta de research
+            res = run_tool("research_topic.py", ["--query", topic, "--output-file", f".tmp/tg_research_{sender_id}.txt"])
+            
+            if res and res.get("status") == "success":
+                # Leer y resumir resultados
+                try:
+                    with open(f".tmp/tg_research_{sender_id}.txt", "r", encoding="utf-8") as f:
+                        data = f.read()
+                    print("   🧠 Resumiendo resultados...")
+                    
+                    # Prompt mejorado: pide al LLM que use su memoria (RAG) y los resultados de la búsqueda.
+                    summarization_prompt = f"""Considerando lo que ya sabes en tu memoria y los siguientes resultados de búsqueda sobre '{topic}', crea un resumen conciso para Telegram.
 
 Resultados de Búsqueda:
 ---
 {data}"""
-                                    llm_res = run_tool("chat_with_llm.py", ["--prompt", summarization_prompt, "--memory-query", topic])
-                                    
-                                    if llm_res and "content" in llm_res:
-                                        reply_text = llm_res["content"]
-                                    elif llm_res and "error" in llm_res:
-                                        reply_text = f"⚠️ Error del modelo: {llm_res['error']}"
-                                    else:
-                                        reply_text = "❌ No se pudo generar el resumen (Respuesta vacía o inválida)."
-                                except Exception as e:
-                                    reply_text = f"Error procesando resultados: {e}"
-                            else:
-                                reply_text = "❌ Error al ejecutar la herramienta de investigación."
+                    llm_res = run_tool("chat_with_llm.py", ["--prompt", summarization_prompt, "--memory-query", topic, "--no-history"])
                     
-                    elif msg.startswith("/reporte") or msg.startswith("/report"):
-                        topic = msg.split(" ", 1)[1] if " " in msg else ""
-                        if not topic:
-                            reply_text = "⚠️ Uso: /reporte [tema médico o de investigación]"
-                        else:
-                            print(f"   🏥 Generando reporte sobre: {topic}")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", f"👩‍⚕️ Iniciando investigación profunda sobre '{topic}'... Esto tomará unos segundos.", "--chat-id", sender_id])
-                            
-                            # 1. Investigar (Search)
-                            # Buscamos específicamente tratamientos y terapias
-                            query = f"tratamientos terapias y recuperación para {topic}"
-                            res_search = run_tool("research_topic.py", ["--query", query, "--output-file", ".tmp/med_research.txt"])
-                            
-                            if res_search and res_search.get("status") == "success":
-                                try:
-                                    with open(".tmp/med_research.txt", "r", encoding="utf-8") as f:
-                                        search_data = f.read()
-                                    
-                                    # 2. Generar Reporte (LLM)
-                                    report_prompt = f"""Actúa como un Asistente Médico de Investigación experto y empático.
+                    if llm_res and "content" in llm_res:
+                        reply_text = llm_res["content"]
+                    elif llm_res and "error" in llm_res:
+                        reply_text = f"⚠️ Error del modelo: {llm_res['error']}"
+                    else:
+                        reply_text = "❌ No se pudo generar el resumen (Respuesta vacía o inválida)."
+                except ToolTimeout:
+                    raise
+                except Exception as e:
+                    reply_text = f"Error procesando resultados: {e}"
+            else:
+                reply_text = "❌ Error al ejecutar la herramienta de investigación."
+    
+    elif msg.startswith("/reporte") or msg.startswith("/report"):
+        topic = msg.split(" ", 1)[1] if " " in msg else ""
+        if not topic:
+            reply_text = "⚠️ Uso: /reporte [tema médico o de investigación]"
+        else:
+            print(f"   🏥 Generando reporte sobre: {topic}")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", f"👩‍⚕️ Iniciando investigación profunda sobre '{topic}'... Esto tomará unos segundos.", "--chat-id", sender_id])
+            
+            # 1. Investigar (Search)
+            # Buscamos específicamente tratamientos y terapias
+            query = f"tratamientos terapias y recuperación para {topic}"
+            res_search = run_tool("research_topic.py", ["--query", query, "--output-file", f".tmp/med_research_{sender_id}.txt"])
+            
+            if res_search and res_search.get("status") == "success":
+                try:
+                    with open(f".tmp/med_research_{sender_id}.txt", "r", encoding="utf-8") as f:
+                        search_data = f.read()
+                    
+                    # 2. Generar Reporte (LLM)
+                    report_prompt = f"""Actúa como un Asistente Médico de Investigación experto y empático.
 Basado en los siguientes resultados de búsqueda, genera un REPORTE DETALLADO en formato Markdown sobre '{topic}'.
 
 Estructura sugerida:
@@ -339,469 +520,787 @@ IMPORTANTE:
 - Usa un tono profesional pero claro y esperanzador.
 - INCLUYE UN DISCLAIMER AL INICIO: "Nota: Soy una IA. Este reporte es informativo y no sustituye el consejo médico profesional."
 """
-                                    run_tool("telegram_tool.py", ["--action", "send", "--message", "🧠 Analizando datos y redactando informe...", "--chat-id", sender_id])
-                                    
-                                    # Usamos --memory-query para que busque en memoria solo el tema, no el prompt entero
-                                    llm_res = run_tool("chat_with_llm.py", ["--prompt", report_prompt, "--memory-query", topic])
-                                    
-                                    if llm_res and "content" in llm_res:
-                                        report_content = llm_res["content"]
-                                        
-                                        # 3. Guardar en docs/
-                                        safe_topic = "".join([c if c.isalnum() else "_" for c in topic])[:30]
-                                        filename = f"Reporte_Medico_{safe_topic}.md"
-                                        # Construir ruta absoluta a docs/
-                                        docs_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", filename)
-                                        
-                                        with open(docs_path, "w", encoding="utf-8") as f:
-                                            f.write(report_content)
-                                            
-                                        reply_text = f"✅ *Reporte Generado Exitosamente*\n\nHe guardado el informe detallado en:\n`docs/{filename}`\n\nAquí tienes un resumen:\n\n" + report_content[:400] + "...\n\n_(Lee el archivo completo en tu carpeta docs)_"
-                                    else:
-                                        reply_text = "❌ Error al redactar el reporte con el modelo."
-                                        
-                                except Exception as e:
-                                    reply_text = f"❌ Error procesando el reporte: {e}"
-                            else:
-                                reply_text = "❌ Error en la fase de investigación (Búsqueda)."
-
-                    elif msg.startswith("/recordatorio") or msg.startswith("/remind"):
-                        try:
-                            parts = msg.split(" ", 2)
-                            if len(parts) < 3:
-                                reply_text = "⚠️ Uso: /recordatorio HH:MM Mensaje\nEj: `/recordatorio 08:00 Tomar antibiótico`"
-                            else:
-                                time_str = parts[1]
-                                note = parts[2]
-                                # Validar formato de hora
-                                datetime.datetime.strptime(time_str, "%H:%M")
-                                
-                                reminders = load_reminders()
-                                reminders.append({
-                                    "chat_id": str(sender_id),
-                                    "time": time_str,
-                                    "message": note,
-                                    "last_sent": ""
-                                })
-                                save_reminders(reminders)
-                                reply_text = f"✅ Recordatorio configurado.\nTe avisaré todos los días a las {time_str}: '{note}'."
-                        except ValueError:
-                            reply_text = "❌ Hora inválida. Usa formato 24h (HH:MM), ej: 14:30."
-
-                    elif msg.startswith("/borrar_recordatorios") or msg.startswith("/clear_reminders"):
-                        reminders = load_reminders()
-                        # Filtrar, manteniendo solo los recordatorios de OTROS usuarios
-                        reminders_to_keep = [r for r in reminders if r.get('chat_id') != str(sender_id)]
-                        if len(reminders) == len(reminders_to_keep):
-                            reply_text = "🤔 No tienes recordatorios configurados para borrar."
-                        else:
-                            save_reminders(reminders_to_keep)
-                            reply_text = "✅ Todos tus recordatorios han sido eliminados."
-
-                    elif msg.startswith("/traducir") or msg.startswith("/translate"):
-                        content = msg.split(" ", 1)[1].strip() if " " in msg else ""
-                        if not content:
-                            reply_text = "⚠️ Uso: /traducir [texto | nombre_archivo]"
-                        else:
-                            # Verificar si es un archivo local (docs o .tmp)
-                            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-                            docs_file = os.path.join(base_dir, "docs", content)
-                            tmp_file = os.path.join(base_dir, ".tmp", content)
-                            
-                            target_file = None
-                            if os.path.exists(docs_file): target_file = docs_file
-                            elif os.path.exists(tmp_file): target_file = tmp_file
-                            
-                            if target_file:
-                                print(f"   📄 Traduciendo archivo: {content}")
-                                run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏳ Traduciendo `{content}` al español...", "--chat-id", sender_id])
-                                
-                                res = run_tool("translate_text.py", ["--file", target_file, "--lang", "Español"])
-                                
-                                if res and res.get("status") == "success":
-                                    out_path = res.get("file_path")
-                                    run_tool("telegram_tool.py", ["--action", "send-document", "--file-path", out_path, "--chat-id", sender_id, "--caption", "📄 Traducción al Español"])
-                                    reply_text = "✅ Archivo traducido enviado."
-                                else:
-                                    err = res.get("message", "Error desconocido") if res else "Error en script"
-                                    reply_text = f"❌ Error al traducir archivo: {err}"
-                            else:
-                                # Traducir texto plano
-                                print(f"   🔤 Traduciendo texto...")
-                                prompt = f"Traduce el siguiente texto al Español. Devuelve solo la traducción:\n\n{content}"
-                                llm_res = run_tool("chat_with_llm.py", ["--prompt", prompt])
-                                if llm_res and "content" in llm_res:
-                                    reply_text = f"🇪🇸 *Traducción:*\n\n{llm_res['content']}"
-                                else:
-                                    reply_text = "❌ Error al traducir texto."
-
-                    elif msg.startswith("/idioma") or msg.startswith("/lang"):
-                        parts = msg.split(" ")
-                        if len(parts) < 2:
-                            reply_text = "⚠️ Uso: /idioma [es/en]\nEj: `/idioma en` (para inglés)"
-                        else:
-                            lang_map = {"es": "es-ES", "en": "en-US", "fr": "fr-FR", "pt": "pt-BR"}
-                            selection = parts[1].lower()
-                            code = lang_map.get(selection, "es-ES")
-                            config = load_config()
-                            config["voice_lang"] = code
-                            save_config(config)
-                            reply_text = f"✅ Idioma de voz cambiado a: `{code}`.\nAhora te escucharé en ese idioma."
-
-                    elif msg.startswith("/ayuda_medica"):
-                        manual_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", "manual_medico.pdf")
-                        if os.path.exists(manual_path):
-                            print(f"   🏥 Enviando manual médico a {sender_id}...")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", "📘 Aquí tienes la guía de uso para tu recuperación.", "--chat-id", sender_id])
-                            run_tool("telegram_tool.py", ["--action", "send-document", "--file-path", manual_path, "--chat-id", sender_id, "--caption", "Manual de Asistente Médico (IA)"])
-                        else:
-                            reply_text = "⚠️ El manual PDF no ha sido generado aún. Pide al administrador que ejecute `pdflatex`."
-
-                    elif msg.startswith("/resumir_archivo") or msg.startswith("/summarize_file"):
-                        filename = msg.split(" ", 1)[1].strip() if " " in msg else ""
-                        if not filename:
-                            reply_text = "⚠️ Uso: /resumir_archivo [nombre_del_archivo_en_docs]"
-                        else:
-                            print(f"   📄 Resumiendo archivo local: {filename}")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏳ Leyendo y resumiendo `{filename}`...", "--chat-id", sender_id])
-
-                            # 1. Leer el archivo desde el Sandbox
-                            path_in_container = f"/mnt/docs/{filename}"
-                            
-                            if filename.lower().endswith(".pdf"):
-                                # Código para extraer texto de PDF usando pypdf
-                                read_code = (
-                                    f"from pypdf import PdfReader; "
-                                    f"reader = PdfReader('{path_in_container}'); "
-                                    f"print('\\n'.join([page.extract_text() for page in reader.pages]))"
-                                )
-                            else:
-                                read_code = f"with open('{path_in_container}', 'r', encoding='utf-8') as f: print(f.read())"
-                            
-                            read_res = run_tool("run_sandbox.py", ["--code", read_code])
-
-                            if read_res and read_res.get("status") == "success" and read_res.get("stdout"):
-                                content = read_res.get("stdout")
-                                
-                                if len(content) > 10000:
-                                    content = content[:10000] + "... (truncado)"
-                                
-                                # 2. Enviar a LLM para resumir
-                                prompt = f"Resume el siguiente documento llamado '{filename}':\n\n{content}"
-                                llm_res = run_tool("chat_with_llm.py", ["--prompt", prompt])
-
-                                if llm_res and "content" in llm_res:
-                                    reply_text = llm_res["content"]
-                                else:
-                                    reply_text = "❌ Error generando el resumen."
-                            else:
-                                error_details = read_res.get("stderr") or read_res.get("message", "No se pudo leer el archivo.")
-                                reply_text = f"❌ Error al leer el archivo `{filename}` desde el Sandbox:\n`{error_details}`"
-
-                    elif msg.startswith("/resumir") or msg.startswith("/summarize"):
-                        url = msg.split(" ", 1)[1] if " " in msg else ""
-                        if not url:
-                            reply_text = "⚠️ Uso: /resumir [url]"
-                        else:
-                            print(f"   🌐 Resumiendo URL: {url}")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏳ Leyendo {url}...", "--chat-id", sender_id])
-                            
-                            # 1. Scrape
-                            scrape_res = run_tool("scrape_single_site.py", ["--url", url, "--output-file", ".tmp/web_content.txt"])
-                            
-                            if scrape_res and scrape_res.get("status") == "success":
-                                # 2. Summarize
-                                try:
-                                    with open(".tmp/web_content.txt", "r", encoding="utf-8") as f:
-                                        content = f.read()
-                                    
-                                    # Truncar si es muy largo (ej. 10k caracteres) para no saturar CLI args
-                                    if len(content) > 10000:
-                                        content = content[:10000] + "... (truncado)"
-                                        
-                                    prompt = f"Resume el siguiente contenido web para Telegram:\n\n{content}"
-                                    llm_res = run_tool("chat_with_llm.py", ["--prompt", prompt])
-                                    
-                                    if llm_res and "content" in llm_res:
-                                        reply_text = llm_res["content"]
-                                    elif llm_res and "error" in llm_res:
-                                        reply_text = f"⚠️ Error del modelo: {llm_res['error']}"
-                                    else:
-                                        reply_text = "❌ Error generando resumen."
-                                        
-                                except Exception as e:
-                                    reply_text = f"❌ Error leyendo contenido: {e}"
-                            else:
-                                err = scrape_res.get("message") if scrape_res else "Error desconocido"
-                                # Ayuda contextual si el usuario intenta usar /resumir con un archivo local
-                                if "No scheme supplied" in str(err):
-                                    filename = url.split('/')[-1]
-                                    reply_text = f"🤔 El comando `/resumir` es para URLs (ej: `https://...`).\n\nSi querías resumir el archivo local `{filename}`, el comando correcto es:\n`/resumir_archivo {filename}`"
-                                else:
-                                    reply_text = f"❌ Error leyendo la web: {err}"
-
-                    elif msg.startswith("/recordar") or msg.startswith("/remember"):
-                        memory_text = msg.split(" ", 1)[1] if " " in msg else ""
-                        if not memory_text:
-                            reply_text = "⚠️ Uso: /recordar [dato a guardar]"
-                        else:
-                            print(f"   💾 Guardando en memoria: {memory_text}")
-                            run_tool("telegram_tool.py", ["--action", "send", "--message", "💾 Guardando nota...", "--chat-id", sender_id])
-                            
-                            # Ejecutar herramienta de memoria (save_memory.py)
-                            res = run_tool("save_memory.py", ["--text", memory_text, "--category", "telegram_note"])
-                            
-                            if res and res.get("status") == "success":
-                                reply_text = "✅ Nota guardada en memoria a largo plazo."
-                            else:
-                                reply_text = "❌ Error al guardar. (Verifica que save_memory.py exista y funcione)."
-
-                    elif msg.startswith("/memorias") or msg.startswith("/memories"):
-                        print("   🧠 Consultando lista de recuerdos...")
-                        run_tool("telegram_tool.py", ["--action", "send", "--message", "🧠 Consultando base de datos...", "--chat-id", sender_id])
+                    run_tool("telegram_tool.py", ["--action", "send", "--message", "🧠 Analizando datos y redactando informe...", "--chat-id", sender_id])
+                    
+                    # Usamos --memory-query para que busque en memoria solo el tema, no el prompt entero
+                    llm_res = run_tool("chat_with_llm.py", ["--prompt", report_prompt, "--memory-query", topic, "--no-history"])
+                    
+                    if llm_res and "content" in llm_res:
+                        report_content = llm_res["content"]
                         
-                        res = run_tool("list_memories.py", ["--limit", "5"])
-                        if res and res.get("status") == "success":
-                            memories = res.get("memories", [])
-                            if not memories:
-                                reply_text = "📭 No tengo recuerdos guardados aún."
-                            else:
-                                reply_text = "🧠 *Últimos recuerdos:*\n"
-                                for m in memories:
-                                    date = m.get("timestamp", "").replace("T", " ").split(".")[0]
-                                    content = m.get("content", "")
-                                    mem_id = m.get("id", "N/A")
-                                    reply_text += f"🆔 `{mem_id}`\n📅 {date}: {content}\n\n"
-                        else:
-                            reply_text = "❌ Error al consultar la memoria."
-
-                    elif msg.startswith("/olvidar") or msg.startswith("/forget"):
-                        mem_id = msg.split(" ", 1)[1] if " " in msg else ""
-                        if not mem_id:
-                            reply_text = "⚠️ Uso: /olvidar [ID]"
-                        else:
-                            print(f"   🗑️ Eliminando recuerdo: {mem_id}")
-                            res = run_tool("delete_memory.py", ["--id", mem_id])
-                            if res and res.get("status") == "success":
-                                reply_text = "✅ Recuerdo eliminado."
-                            else:
-                                reply_text = f"❌ Error al eliminar: {res.get('message', 'Desconocido')}"
-
-                    elif msg.startswith("/broadcast") or msg.startswith("/anuncio"):
-                        announcement = msg.split(" ", 1)[1] if " " in msg else ""
-                        if not announcement:
-                            reply_text = "⚠️ Uso: /broadcast [mensaje para todos]"
-                        else:
-                            if os.path.exists(USERS_FILE):
-                                with open(USERS_FILE, 'r') as f:
-                                    users = f.read().splitlines()
-                                count = 0
-                                for uid in users:
-                                    if uid.strip():
-                                        run_tool("telegram_tool.py", ["--action", "send", "--message", f"📢 *ANUNCIO:*\n{announcement}", "--chat-id", uid])
-                                        count += 1
-                                reply_text = f"✅ Mensaje enviado a {count} usuarios."
-                            else:
-                                reply_text = "⚠️ No tengo usuarios registrados aún."
-
-                    elif msg.startswith("/status"):
-                        print("   📊 Verificando estado del sistema...")
-                        run_tool("telegram_tool.py", ["--action", "send", "--message", "🔍 Escaneando sistema...", "--chat-id", sender_id])
+                        # 3. Guardar en docs/
+                        safe_topic = "".join([c if c.isalnum() else "_" for c in topic])[:30]
+                        filename = f"Reporte_Medico_{safe_topic}.md"
+                        # Construir ruta absoluta a docs/
+                        docs_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", filename)
                         
-                        res = run_tool("monitor_resources.py", [])
-                        # monitor_resources devuelve JSON incluso si hay alertas (exit code 1)
-                        if res:
-                            metrics = res.get("metrics", {})
-                            alerts = res.get("alerts", [])
+                        with open(docs_path, "w", encoding="utf-8") as f:
+                            f.write(report_content)
                             
-                            status_emoji = "✅" if not alerts else "⚠️"
-                            reply_text = (
-                                f"{status_emoji} *Estado del Servidor:*\n\n"
-                                f"💻 *CPU:* {metrics.get('cpu_percent', 0)}%\n"
-                                f"🧠 *RAM:* {metrics.get('memory_percent', 0)}% ({metrics.get('memory_used_gb', 0)}GB / {metrics.get('memory_total_gb', 0)}GB)\n"
-                                f"💾 *Disco:* {metrics.get('disk_percent', 0)}% (Libre: {metrics.get('disk_free_gb', 0)}GB)\n"
-                            )
-                            if alerts:
-                                reply_text += "\n🚨 *Alertas:*\n" + "\n".join([f"- {a}" for a in alerts])
-                        else:
-                            reply_text = "❌ Error al obtener métricas."
-
-                    elif msg.startswith("/usuarios") or msg.startswith("/users"):
-                        if os.path.exists(USERS_FILE):
-                            with open(USERS_FILE, 'r') as f:
-                                users = [line.strip() for line in f if line.strip()]
-                            last_users = users[-5:]
-                            if last_users:
-                                reply_text = f"👥 *Últimos {len(last_users)} usuarios registrados:*\n" + "\n".join([f"- `{u}`" for u in last_users])
-                            else:
-                                reply_text = "📭 No hay usuarios registrados."
-                        else:
-                            reply_text = "📭 No hay archivo de usuarios aún."
-
-                    elif msg.startswith("/modo"):
-                        mode = msg.split(" ", 1)[1].lower().strip() if " " in msg else ""
-                        if mode in PERSONAS:
-                            set_persona(mode)
-                            reply_text = f"🎭 *Modo cambiado a:* {mode.capitalize()}\n\n_{PERSONAS[mode]}_"
-                        else:
-                            opts = ", ".join([f"`{k}`" for k in PERSONAS.keys()])
-                            reply_text = (
-                                "⚠️ Modo no reconocido.\n"
-                                f"Opciones disponibles: {opts}\n"
-                                "Uso: `/modo [opcion]`"
-                            )
-
-                    elif msg.startswith("/reiniciar") or msg.startswith("/reset"):
-                        print("   🔄 Reiniciando sesión...")
-                        # 1. Borrar historial de chat
-                        run_tool("chat_with_llm.py", ["--prompt", "/clear"])
-                        
-                        # 2. Resetear personalidad
-                        set_persona("default")
+                        reply_text = f"✅ *Reporte Generado Exitosamente*\n\nHe guardado el informe detallado en:\n`docs/{filename}`\n\nAquí tienes un resumen:\n\n" + report_content[:400] + "...\n\n_(Lee el archivo completo en tu carpeta docs)_"
+                    else:
+                        reply_text = "❌ Error al redactar el reporte con el modelo."
                         
-                        reply_text = "🔄 *Sistema reiniciado.*\n\n- Historial de conversación borrado.\n- Personalidad restablecida a 'Default'."
-
-                    elif msg.startswith("/ayuda") or msg.startswith("/help"):
-                        reply_text = (
-                            "🤖 *Comandos Disponibles:*\n\n"
-                            "🔹 `/investigar [tema]`: Busca en internet y resume.\n"
-                            "🔹 `/reporte [tema]`: Genera un informe médico/técnico detallado en docs/.\n"
-                            "🔹 `/recordatorio [hora] [msg]`: Configura una alarma diaria.\n"
-                            "🔹 `/traducir [texto/archivo]`: Traduce al español.\n"
-                            "🔹 `/idioma [es/en]`: Cambia el idioma en el que te escucho.\n"
-                            "🔹 `/borrar_recordatorios`: Elimina todas tus alarmas.\n"
-                            "🔹 `/ayuda_medica`: Envía el manual de uso médico en PDF.\n"
-                            "🔹 `/resumir [url]`: Lee una web y te dice de qué trata.\n"
-                            "🔹 `/resumir_archivo [nombre]`: Lee un archivo de `docs/` y lo resume.\n"
-                            "🔹 `/recordar [dato]`: Guarda una nota en mi memoria.\n"
-                            "🔹 `/memorias`: Lista tus últimos recuerdos guardados.\n"
-                            "🔹 `/olvidar [ID]`: Borra un recuerdo específico.\n"
-                            "🔹 `/status`: Muestra CPU y RAM del servidor.\n"
-                            "🔹 `/usuarios`: Muestra los últimos 5 IDs registrados.\n"
-                            "🔹 `/modo [tipo]`: Cambia mi personalidad (serio, sarcastico, profesor...).\n"
-                            "🔹 `/reiniciar`: Borra historial y restablece personalidad.\n"
-                            "🔹 `/broadcast [msg]`: Envía un mensaje a todos (Admin).\n"
-                            "🔹 `/ayuda`: Muestra este menú.\n\n"
-                            "🔹 *Chat normal*: Háblame y te responderé."
-                        )
-                    
-                    elif msg.startswith("/py "):
-                        code_to_run = msg.split(" ", 1)[1].strip()
-                        print(f"   🐍 Ejecutando en Sandbox: {code_to_run}")
+                except ToolTimeout:
+                    raise
+                except Exception as e:
+                    reply_text = f"❌ Error procesando el reporte: {e}"
+            else:
+                reply_text = "❌ Error en la fase de investigación (Búsqueda)."
 
-                        res = run_tool("run_sandbox.py", ["--code", code_to_run])
+    elif msg.startswith("/recordatorio") or msg.startswith("/remind"):
+        try:
+            parts = msg.split(" ", 3)
+            # Recordatorio de una sola vez: /recordatorio YYYY-MM-DD HH:MM Mensaje
+            date_str = None
+            if len(parts) >= 2 and "-" in parts[1]:
+                date_str = parts.pop(1)
+            else:
+                parts = msg.split(" ", 2)
+            if len(parts) < 3:
+                reply_text = (
+                    "⚠️ Uso: /recordatorio HH:MM Mensaje\nEj: `/recordatorio 08:00 Tomar antibiótico`\n"
+                    "Una sola vez: `/recordatorio 2026-03-01 08:00 Cita médica`"
+                )
+            else:
+                time_str = parts[1]
+                note = parts[2]
+                tz_name = get_chat_timezone(sender_id)
+                # Valida el formato de hora/fecha (ValueError si es inválido)
+                get_reminder_scheduler().add(sender_id, time_str, note, tz=tz_name, date=date_str)
+                tz_note = f" ({tz_name})" if tz_name else ""
+                if date_str:
+                    reply_text = f"✅ Recordatorio configurado.\nTe avisaré el {date_str} a las {time_str}{tz_note}: '{note}'."
+                else:
+                    reply_text = f"✅ Recordatorio configurado.\nTe avisaré todos los días a las {time_str}{tz_note}: '{note}'."
+        except ValueError as e:
+            if "ya pasaron" in str(e):
+                reply_text = "❌ Esa fecha y hora ya pasaron."
+            else:
+                reply_text = "❌ Hora inválida. Usa formato 24h (HH:MM), ej: 14:30 (y fecha YYYY-MM-DD)."
 
-                        reply_text = "" # Resetear
-                        if res and res.get("status") == "success":
-                            stdout = res.get("stdout", "")
-                            stderr = res.get("stderr", "")
-                            
-                            # --- Manejo de Salida de Archivos ---
-                            sent_file = False
-                            clean_stdout_lines = []
-                            if stdout:
-                                for line in stdout.splitlines():
-                                    potential_path_in_container = line.strip()
-                                    if potential_path_in_container.startswith('/mnt/out/'):
-                                        filename = os.path.basename(potential_path_in_container)
-                                        local_path = os.path.join(".tmp", filename)
-                                        if os.path.exists(local_path):
-                                            print(f"   🖼️  Detectado archivo de salida: {local_path}. Enviando...")
-                                            run_tool("telegram_tool.py", ["--action", "send-photo", "--file-path", local_path, "--chat-id", sender_id, "--caption", "Archivo generado por el Sandbox."])
-                                            sent_file = True
-                                            continue # No añadir esta línea a la respuesta de texto
-                                    clean_stdout_lines.append(line)
-                            
-                            clean_stdout = "\n".join(clean_stdout_lines)
-
-                            # --- Manejo de Salida de Texto ---
-                            text_output_exists = clean_stdout or stderr
-                            if text_output_exists:
-                                reply_text = "📦 *Resultado del Sandbox:*\n\n"
-                                if clean_stdout:
-                                    reply_text += f"*Salida:*\n```\n{clean_stdout}\n```\n"
-                                if stderr:
-                                    reply_text += f"*Errores:*\n```\n{stderr}\n```\n"
-                            elif not sent_file: # No hay salida de texto Y no se envió archivo
-                                reply_text = "📦 *Resultado del Sandbox:*\n\n_El código se ejecutó sin producir salida._"
-                        else:
-                            reply_text = f"❌ *Error en Sandbox:*\n{res.get('message', 'Error desconocido.')}"
-
-                    elif msg.lower().strip() in ["hola", "hola!", "hi", "hello", "/start"]:
-                        reply_text = (
-                            "👋 ¡Hola! Soy un Agente de IA.\n\n"
-                            "-Soy una creación del prof. *César Rodríguez* junto con su asistente de código *Gemini Code Assist*.\n"
-                            "-Mi base de operaciones está en una PC con GNU/Linux en el hogar del profesor.\n"
-                            "-Poseo una memoria persistente local la cual uso para responder tus consultas.\n"
-                            "-Si no consigo la respuesta a tus consultas en mi memoria, lanzo la pregunta a varios LLMs externos mediante el uso de APIs.\n"
-                            "-Mi tarea principal para el cual estoy siendo diseñado tendrá fines educativos y de investigación apoyando al equipo *Tecnología Venezolana*.\n\n"
-                            "Usa /ayuda para ver qué puedo hacer."
-                        )
-
-                    elif msg.lower().strip() in ["gracias", "gracias!", "thanks", "thank you"]:
-                        reply_text = "¡De nada! Estoy aquí para ayudar. 🤖"
-
-                    # --- CHAT GENERAL (Capa 2: Orquestación) ---
-                    elif not reply_text: # Solo si no se ha generado respuesta por un comando anterior
-                        # Estrategia Directa con RAG:
-                        # Enviamos el mensaje al LLM. El script chat_with_llm.py se encarga de
-                        # buscar en la memoria e inyectar el contexto si es relevante.
-                        print("   🤔 Consultando al Agente (con memoria)...")
-                        current_sys = get_current_persona()
-                        
-                        # Inyectar fecha y hora actual para que el LLM lo sepa
-                        now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        current_sys += f"\n[Contexto Temporal: Fecha y Hora actual del servidor: {now_str}]"
+    elif msg.startswith("/borrar_recordatorios") or msg.startswith("/clear_reminders"):
+        if not get_reminder_scheduler().remove_chat(sender_id):
+            reply_text = "🤔 No tienes recordatorios configurados para borrar."
+        else:
+            reply_text = "✅ Todos tus recordatorios han sido eliminados."
 
-                        # Si la interacción fue por voz, instruir al LLM que responda en ese idioma
-                        if is_voice_interaction and voice_lang_short != "es":
-                            current_sys += f"\nIMPORTANT: The user is speaking in '{voice_lang_short}'. You MUST respond in '{voice_lang_short}', regardless of your default instructions."
+    elif msg.startswith("/zona_horaria") or msg.startswith("/timezone"):
+        tz_name = msg.split(" ", 1)[1].strip() if " " in msg else ""
+        if not tz_name:
+            current = get_chat_timezone(sender_id) or "la del servidor"
+            reply_text = f"🌍 Zona horaria actual: `{current}`\nUso: `/zona_horaria America/Caracas`"
+        elif not is_valid_tz(tz_name):
+            reply_text = f"❌ Zona horaria desconocida: `{tz_name}`. Usa el formato Area/Ciudad, ej: `America/Caracas`."
+        else:
+            state_store.get_store().set_chat_setting(sender_id, "timezone", tz_name)
+            reply_text = f"✅ Zona horaria cambiada a `{tz_name}`.\nSe usará en tus próximos recordatorios."
 
-                        llm_response = run_tool("chat_with_llm.py", ["--prompt", msg, "--system", current_sys])
+    elif msg.startswith("/traducir") or msg.startswith("/translate"):
+        content = msg.split(" ", 1)[1].strip() if " " in msg else ""
+        if not content:
+            reply_text = "⚠️ Uso: /traducir [texto | nombre_archivo]"
+        else:
+            # Verificar si es un archivo local (docs o .tmp)
+            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            docs_file = os.path.join(base_dir, "docs", content)
+            tmp_file = os.path.join(base_dir, ".tmp", content)
+            
+            target_file = None
+            if os.path.exists(docs_file): target_file = docs_file
+            elif os.path.exists(tmp_file): target_file = tmp_file
+            
+            if target_file:
+                print(f"   📄 Traduciendo archivo: {content}")
+                run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏳ Traduciendo `{content}` al español...", "--chat-id", sender_id])
+                
+                res = run_tool("translate_text.py", ["--file", target_file, "--lang", "Español"])
+                
+                if res and res.get("status") == "success":
+                    out_path = res.get("file_path")
+                    run_tool("telegram_tool.py", ["--action", "send-document", "--file-path", out_path, "--chat-id", sender_id, "--caption", "📄 Traducción al Español"])
+                    reply_text = "✅ Archivo traducido enviado."
+                else:
+                    err = res.get("message", "Error desconocido") if res else "Error en script"
+                    reply_text = f"❌ Error al traducir archivo: {err}"
+            else:
+                # Traducir texto plano
+                print(f"   🔤 Traduciendo texto...")
+                prompt = f"Traduce el siguiente texto al Español. Devuelve solo la traducción:\n\n{content}"
+                llm_res = run_tool("chat_with_llm.py", ["--prompt", prompt, "--no-history"])
+                if llm_res and "content" in llm_res:
+                    reply_text = f"🇪🇸 *Traducción:*\n\n{llm_res['content']}"
+                else:
+                    reply_text = "❌ Error al traducir texto."
+
+    elif msg.startswith("/idioma") or msg.startswith("/lang"):
+        parts = msg.split(" ")
+        if len(parts) < 2:
+            reply_text = "⚠️ Uso: /idioma [es/en]\nEj: `/idioma en` (para inglés)"
+        else:
+            lang_map = {"es": "es-ES", "en": "en-US", "fr": "fr-FR", "pt": "pt-BR"}
+            selection = parts[1].lower()
+            code = lang_map.get(selection, "es-ES")
+            state_store.get_store().set_setting("voice_lang", code)
+            reply_text = f"✅ Idioma de voz cambiado a: `{code}`.\nAhora te escucharé en ese idioma."
+
+    elif msg.startswith("/ayuda_medica"):
+        manual_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docs", "manual_medico.pdf")
+        if os.path.exists(manual_path):
+            print(f"   🏥 Enviando manual médico a {sender_id}...")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", "📘 Aquí tienes la guía de uso para tu recuperación.", "--chat-id", sender_id])
+            run_tool("telegram_tool.py", ["--action", "send-document", "--file-path", manual_path, "--chat-id", sender_id, "--caption", "Manual de Asistente Médico (IA)"])
+        else:
+            reply_text = "⚠️ El manual PDF no ha sido generado aún. Pide al administrador que ejecute `pdflatex`."
+
+    elif msg.startswith("/resumir_archivo") or msg.startswith("/summarize_file"):
+        filename = msg.split(" ", 1)[1].strip() if " " in msg else ""
+        if not filename:
+            reply_text = "⚠️ Uso: /resumir_archivo [nombre_del_archivo_en_docs]"
+        else:
+            print(f"   📄 Resumiendo archivo local: {filename}")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏳ Leyendo y resumiendo `{filename}`...", "--chat-id", sender_id])
+
+            # 1. Leer el archivo desde el Sandbox
+            path_in_container = f"/mnt/docs/{filename}"
+            
+            if filename.lower().endswith(".pdf"):
+                # Código para extraer texto de PDF usando pypdf
+                read_code = (
+                    f"from pypdf import PdfReader; "
+                    f"reader = PdfReader('{path_in_container}'); "
+                    f"print('\\n'.join([page.extract_text() for page in reader.pages]))"
+                )
+            else:
+                read_code = f"with open('{path_in_container}', 'r', encoding='utf-8') as f: print(f.read())"
+            
+            read_res = run_tool("run_sandbox.py", ["--code", read_code])
+
+            if read_res and read_res.get("status") == "success" and read_res.get("stdout"):
+                content = read_res.get("stdout")
+                
+                if len(content) > 10000:
+                    content = content[:10000] + "... (truncado)"
+                
+                # 2. Enviar a LLM para resumir
+                prompt = f"Resume el siguiente documento llamado '{filename}':\n\n{content}"
+                llm_res = run_tool("chat_with_llm.py", ["--prompt", prompt, "--no-history"])
+
+                if llm_res and "content" in llm_res:
+                    reply_text = llm_res["content"]
+                else:
+                    reply_text = "❌ Error generando el resumen."
+            else:
+                error_details = read_res.get("stderr") or read_res.get("message", "No se pudo leer el archivo.")
+                reply_text = f"❌ Error al leer el archivo `{filename}` desde el Sandbox:\n`{error_details}`"
+
+    elif msg.startswith("/resumir") or msg.startswith("/summarize"):
+        url = msg.split(" ", 1)[1] if " " in msg else ""
+        if not url:
+            reply_text = "⚠️ Uso: /resumir [url]"
+        else:
+            print(f"   🌐 Resumiendo URL: {url}")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", f"⏳ Leyendo {url}...", "--chat-id", sender_id])
+            
+            # 1. Scrape
+            scrape_res = run_tool("scrape_single_site.py", ["--url", url, "--output-file", f".tmp/web_content_{sender_id}.txt"])
+            
+            if scrape_res and scrape_res.get("status") == "success":
+                # 2. Summarize
+                try:
+                    with open(f".tmp/web_content_{sender_id}.txt", "r", encoding="utf-8") as f:
+                        content = f.read()
+                    
+                    # Truncar si es muy largo (ej. 10k caracteres) para no saturar CLI args
+                    if len(content) > 10000:
+                        content = content[:10000] + "... (truncado)"
                         
-                        if llm_response and "content" in llm_response:
-                            reply_text = llm_response["content"]
-                        else:
-                            error_msg = llm_response.get('error', 'Respuesta vacía') if llm_response else "Error desconocido"
-                            reply_text = f"⚠️ Error del Modelo: {error_msg}"
+                    prompt = f"Resume el siguiente contenido web para Telegram:\n\n{content}"
+                    llm_res = run_tool("chat_with_llm.py", ["--prompt", prompt, "--no-history"])
                     
-                    # 3. Enviar respuesta a Telegram
-                    if reply_text:
-                        print(f"   📤 Enviando respuesta: '{reply_text[:60]}...'")
-                        res = run_tool("telegram_tool.py", ["--action", "send", "--message", reply_text, "--chat-id", sender_id])
-                        if res and res.get("status") == "error":
-                            print(f"   ❌ Error al enviar mensaje: {res.get('message')}")
+                    if llm_res and "content" in llm_res:
+                        reply_text = llm_res["content"]
+                    elif llm_res and "error" in llm_res:
+                        reply_text = f"⚠️ Error del modelo: {llm_res['error']}"
+                    else:
+                        reply_text = "❌ Error generando resumen."
                         
-                        # 4. Si fue interacción por voz, enviar también audio
-                        if is_voice_interaction and reply_text:
-                            print("   🗣️ Generando respuesta de voz...")
-                            audio_path = os.path.join(".tmp", f"reply_{int(time.time())}.ogg")
-                            # Generar audio
-                            tts_res = run_tool("text_to_speech.py", ["--text", reply_text[:500], "--output", audio_path, "--lang", voice_lang_short]) # Limitamos a 500 chars para no hacerlo eterno
-                            if tts_res and tts_res.get("status") == "success":
-                                run_tool("telegram_tool.py", ["--action", "send-voice", "--file-path", audio_path, "--chat-id", sender_id])
+                except ToolTimeout:
+                    raise
+                except Exception as e:
+                    reply_text = f"❌ Error leyendo contenido: {e}"
+            else:
+                err = scrape_res.get("message") if scrape_res else "Error desconocido"
+                # Ayuda contextual si el usuario intenta usar /resumir con un archivo local
+                if "No scheme supplied" in str(err):
+                    filename = url.split('/')[-1]
+                    reply_text = f"🤔 El comando `/resumir` es para URLs (ej: `https://...`).\n\nSi querías resumir el archivo local `{filename}`, el comando correcto es:\n`/resumir_archivo {filename}`"
+                else:
+                    reply_text = f"❌ Error leyendo la web: {err}"
+
+    elif msg.startswith("/recordar") or msg.startswith("/remember"):
+        memory_text = msg.split(" ", 1)[1] if " " in msg else ""
+        if not memory_text:
+            reply_text = "⚠️ Uso: /recordar [dato a guardar]"
+        else:
+            print(f"   💾 Guardando en memoria: {memory_text}")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", "💾 Guardando nota...", "--chat-id", sender_id])
             
-            # --- TAREA DE FONDO: RECORDATORIOS ---
-            check_reminders()
-
-            # --- TAREA DE FONDO: MONITOREO PROACTIVO ---
-            if time.time() - last_health_check > HEALTH_CHECK_INTERVAL:
-                last_health_check = time.time()
-                # Solo el admin (CHAT_ID del .env) recibe alertas técnicas
-                admin_id = os.getenv("TELEGRAM_CHAT_ID")
-                if admin_id:
-                    res = run_tool("monitor_resources.py", [])
-                    if res and res.get("alerts"):
-                        alerts = res.get("alerts", [])
-                        alert_msg = "🚨 *ALERTA DEL SISTEMA:*\n\n" + "\n".join([f"- {a}" for a in alerts])
-                        print(f"   ⚠️ Detectada alerta de sistema. Notificando a {admin_id}...")
-                        run_tool("telegram_tool.py", ["--action", "send", "--message", alert_msg, "--chat-id", admin_id])
+            # Ejecutar herramienta de memoria (save_memory.py)
+            res = run_tool("save_memory.py", ["--text", memory_text, "--category", "telegram_note", "--chat-id", sender_id])
             
-            # Esperar un poco antes del siguiente chequeo para no saturar la CPU/API
-            time.sleep(2)
+            if res and res.get("status") == "success":
+                reply_text = "✅ Nota guardada en memoria a largo plazo."
+            else:
+                reply_text = "❌ Error al guardar. (Verifica que save_memory.py exista y funcione)."
+
+    elif msg.startswith("/memorias") or msg.startswith("/memories"):
+        print("   🧠 Consultando lista de recuerdos...")
+        run_tool("telegram_tool.py", ["--action", "send", "--message", "🧠 Consultando base de datos...", "--chat-id", sender_id])
+        
+        res = run_tool("list_memories.py", ["--limit", "5"])
+        if res and res.get("status") == "success":
+            memories = res.get("memories", [])
+            if not memories:
+                reply_text = "📭 No tengo recuerdos guardados aún."
+            else:
+                reply_text = "🧠 *Últimos recuerdos:*\n"
+                for m in memories:
+                    date = m.get("timestamp", "").replace("T", " ").split(".")[0]
+                    content = m.get("content", "")
+                    mem_id = m.get("id", "N/A")
+                    reply_text += f"🆔 `{mem_id}`\n📅 {date}: {content}\n\n"
+        else:
+            reply_text = "❌ Error al consultar la memoria."
+
+    elif msg.startswith("/olvidar") or msg.startswith("/forget"):
+        mem_id = msg.split(" ", 1)[1] if " " in msg else ""
+        if not mem_id:
+            reply_text = "⚠️ Uso: /olvidar [ID]"
+        else:
+            print(f"   🗑️ Eliminando recuerdo: {mem_id}")
+            res = run_tool("delete_memory.py", ["--id", mem_id])
+            if res and res.get("status") == "success":
+                reply_text = "✅ Recuerdo eliminado."
+            else:
+                reply_text = f"❌ Error al eliminar: {res.get('message', 'Desconocido')}"
+
+    elif msg.startswith("/broadcast") or msg.startswith("/anuncio"):
+        announcement = msg.split(" ", 1)[1] if " " in msg else ""
+        running = current_broadcast()
+        if running is None and announcement:
+            users = state_store.get_store().list_users()
+            if users:
+                broadcast = Broadcast(f"📢 *ANUNCIO:*\n{announcement}", users)
+                running = start_broadcast(broadcast, sender_id)
+                if running is None:
+                    reply_text = f"📢 Enviando anuncio a {len(broadcast.recipients)} usuarios en segundo plano. Te aviso al terminar."
+            else:
+                reply_text = "⚠️ No tengo usuarios registrados aún."
+        if running is not None:
+            reply_text = f"⏳ Ya hay un anuncio en curso.\n{format_broadcast_progress(running.progress())}"
+        elif not announcement:
+            reply_text = "⚠️ Uso: /broadcast [mensaje para todos]"
+
+    elif msg.startswith("/reanudar_broadcast"):
+        broadcast = Broadcast.resume()
+        if not broadcast or not broadcast.pending():
+            reply_text = "📭 No hay ningún anuncio pendiente de reanudar."
+        elif start_broadcast(broadcast, sender_id) is None:
+            reply_text = f"▶️ Reanudando anuncio: faltan {len(broadcast.pending())} de {len(broadcast.recipients)} usuarios."
+        else:
+            reply_text = "⏳ Ya hay un anuncio en curso."
+
+    elif msg.startswith("/cancelar_broadcast"):
+        current = current_broadcast()
+        if current is None:
+            reply_text = "📭 No hay ningún anuncio en curso."
+        else:
+            current.cancel()
+            reply_text = "⏸️ Deteniendo el anuncio... (se puede continuar con /reanudar_broadcast)"
+
+    elif msg.startswith("/status"):
+        print("   📊 Verificando estado del sistema...")
+        run_tool("telegram_tool.py", ["--action", "send", "--message", "🔍 Escaneando sistema...", "--chat-id", sender_id])
+        
+        res = run_tool("monitor_resources.py", [])
+        # monitor_resources devuelve JSON incluso si hay alertas (exit code 1)
+        if res:
+            metrics = res.get("metrics", {})
+            alerts = res.get("alerts", [])
+            
+            status_emoji = "✅" if not alerts else "⚠️"
+            reply_text = (
+                f"{status_emoji} *Estado del Servidor:*\n\n"
+                f"💻 *CPU:* {metrics.get('cpu_percent', 0)}%\n"
+                f"🧠 *RAM:* {metrics.get('memory_percent', 0)}% ({metrics.get('memory_used_gb', 0)}GB / {metrics.get('memory_total_gb', 0)}GB)\n"
+                f"💾 *Disco:* {metrics.get('disk_percent', 0)}% (Libre: {metrics.get('disk_free_gb', 0)}GB)\n"
+            )
+            if alerts:
+                reply_text += "\n🚨 *Alertas:*\n" + "\n".join([f"- {a}" for a in alerts])
+        else:
+            reply_text = "❌ Error al obtener métricas."
+
+    elif msg.startswith("/usuarios") or msg.startswith("/users"):
+        last_users = state_store.get_store().list_users()[-5:]
+        if last_users:
+            reply_text = f"👥 *Últimos {len(last_users)} usuarios registrados:*\n" + "\n".join([f"- `{u}`" for u in last_users])
+        else:
+            reply_text = "📭 No hay usuarios registrados."
+
+    elif msg.startswith("/modo"):
+        mode = msg.split(" ", 1)[1].lower().strip() if " " in msg else ""
+        if mode in PERSONAS:
+            set_persona(mode)
+            reply_text = f"🎭 *Modo cambiado a:* {mode.capitalize()}\n\n_{PERSONAS[mode]}_"
+        else:
+            opts = ", ".join([f"`{k}`" for k in PERSONAS.keys()])
+            reply_text = (
+                "⚠️ Modo no reconocido.\n"
+                f"Opciones disponibles: {opts}\n"
+                "Uso: `/modo [opcion]`"
+            )
+
+    elif msg.startswith("/reiniciar") or msg.startswith("/reset"):
+        print("   🔄 Reiniciando sesión...")
+        # 1. Borrar historial de chat
+        run_tool("chat_with_llm.py", ["--prompt", "/clear", "--session", get_session_id(sender_id)])
+        
+        # 2. Resetear personalidad
+        set_persona("default")
+        
+        reply_text = "🔄 *Sistema reiniciado.*\n\n- Historial de conversación borrado.\n- Personalidad restablecida a 'Default'."
+
+    elif msg.startswith("/ayuda") or msg.startswith("/help"):
+        reply_text = (
+            "🤖 *Comandos Disponibles:*\n\n"
+            "🔹 `/investigar [tema]`: Busca en internet y resume.\n"
+            "🔹 `/reporte [tema]`: Genera un informe médico/técnico detallado en docs/.\n"
+            "🔹 `/recordatorio [hora] [msg]`: Configura una alarma diaria.\n"
+            "🔹 `/traducir [texto/archivo]`: Traduce al español.\n"
+            "🔹 `/idioma [es/en]`: Cambia el idioma en el que te escucho.\n"
+            "🔹 `/borrar_recordatorios`: Elimina todas tus alarmas.\n"
+            "🔹 `/zona_horaria [Area/Ciudad]`: Zona horaria de tus recordatorios.\n"
+            "🔹 `/ayuda_medica`: Envía el manual de uso médico en PDF.\n"
+            "🔹 `/resumir [url]`: Lee una web y te dice de qué trata.\n"
+            "🔹 `/resumir_archivo [nombre]`: Lee un archivo de `docs/` y lo resume.\n"
+            "🔹 `/recordar [dato]`: Guarda una nota en mi memoria.\n"
+            "🔹 `/memorias`: Lista tus últimos recuerdos guardados.\n"
+            "🔹 `/olvidar [ID]`: Borra un recuerdo específico.\n"
+            "🔹 `/status`: Muestra CPU y RAM del servidor.\n"
+            "🔹 `/usuarios`: Muestra los últimos 5 IDs registrados.\n"
+            "🔹 `/modo [tipo]`: Cambia mi personalidad (serio, sarcastico, profesor...).\n"
+            "🔹 `/reiniciar`: Borra historial y restablece personalidad.\n"
+            "🔹 `/broadcast [msg]`: Envía un mensaje a todos en segundo plano (Admin).\n"
+            "🔹 `/cancelar_broadcast` / `/reanudar_broadcast`: Detiene o continúa un anuncio.\n"
+            "🔹 `/ayuda`: Muestra este menú.\n\n"
+            "🔹 *Chat normal*: Háblame y te responderé."
+        )
+    
+    elif msg.startswith("/py "):
+        code_to_run = msg.split(" ", 1)[1].strip()
+        print(f"   🐍 Ejecutando en Sandbox: {code_to_run}")
+
+        res = run_tool("run_sandbox.py", ["--code", code_to_run])
+
+        reply_text = "" # Resetear
+        if res and res.get("status") == "success":
+            stdout = res.get("stdout", "")
+            stderr = res.get("stderr", "")
+            
+            # --- Manejo de Salida de Archivos ---
+            sent_file = False
+            clean_stdout_lines = []
+            if stdout:
+                for line in stdout.splitlines():
+                    potential_path_in_container = line.strip()
+                    if potential_path_in_container.startswith('/mnt/out/'):
+                        filename = os.path.basename(potential_path_in_container)
+                        local_path = os.path.join(".tmp", filename)
+                        if os.path.exists(local_path):
+                            print(f"   🖼️  Detectado archivo de salida: {local_path}. Enviando...")
+                            run_tool("telegram_tool.py", ["--action", "send-photo", "--file-path", local_path, "--chat-id", sender_id, "--caption", "Archivo generado por el Sandbox."])
+                            sent_file = True
+                            continue # No añadir esta línea a la respuesta de texto
+                    clean_stdout_lines.append(line)
+            
+            clean_stdout = "\n".join(clean_stdout_lines)
+
+            # --- Manejo de Salida de Texto ---
+            text_output_exists = clean_stdout or stderr
+            if text_output_exists:
+                reply_text = "📦 *Resultado del Sandbox:*\n\n"
+                if clean_stdout:
+                    reply_text += f"*Salida:*\n```\n{clean_stdout}\n```\n"
+                if stderr:
+                    reply_text += f"*Errores:*\n```\n{stderr}\n```\n"
+            elif not sent_file: # No hay salida de texto Y no se envió archivo
+                reply_text = "📦 *Resultado del Sandbox:*\n\n_El código se ejecutó sin producir salida._"
+        else:
+            reply_text = f"❌ *Error en Sandbox:*\n{res.get('message', 'Error desconocido.')}"
+
+    elif msg.lower().strip() in GREETINGS:
+        reply_text = (
+            "👋 ¡Hola! Soy un Agente de IA.\n\n"
+            "-Soy una creación del prof. *César Rodríguez* junto con su asistente de código *Gemini Code Assist*.\n"
+            "-Mi base de operaciones está en una PC con GNU/Linux en el hogar del profesor.\n"
+            "-Poseo una memoria persistente local la cual uso para responder tus consultas.\n"
+            "-Si no consigo la respuesta a tus consultas en mi memoria, lanzo la pregunta a varios LLMs externos mediante el uso de APIs.\n"
+            "-Mi tarea principal para el cual estoy siendo diseñado tendrá fines educativos y de investigación apoyando al equipo *Tecnología Venezolana*.\n\n"
+            "Usa /ayuda para ver qué puedo hacer."
+        )
+
+    elif msg.lower().strip() in THANKS:
+        reply_text = "¡De nada! Estoy aquí para ayudar. 🤖"
+
+    # --- CHAT GENERAL (Capa 2: Orquestación) ---
+    elif not reply_text: # Solo si no se ha generado respuesta por un comando anterior
+        # Estrategia Directa con RAG:
+        # Enviamos el mensaje al LLM. El script chat_with_llm.py se encarga de
+        # buscar en la memoria e inyectar el contexto si es relevante.
+        print("   🤔 Consultando al Agente (con memoria)...")
+        current_sys = get_current_persona()
+        
+        # Inyectar fecha y hora actual para que el LLM lo sepa (al minuto: así la
+        # instrucción de sistema se repite y el modelo de Gemini cacheado se reutiliza)
+        now_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        current_sys += f"\n[Contexto Temporal: Fecha y Hora actual del servidor: {now_str}]"
+
+        # Si la interacción fue por voz, instruir al LLM que responda en ese idioma
+        if is_voice_interaction and voice_lang_short != "es":
+            current_sys += f"\nIMPORTANT: The user is speaking in '{voice_lang_short}'. You MUST respond in '{voice_lang_short}', regardless of your default instructions."
+
+        # La caché semántica se delimita por persona e idioma (current_sys cambia con la hora)
+        streamed = stream_chat_reply(sender_id, prompt=msg, system=current_sys, session=get_session_id(sender_id),
+                                     persona=get_current_persona(), language=voice_lang_short)
+        if streamed:
+            reply_message, llm_response = streamed
+            if llm_response and llm_response.get("status") == "timeout":
+                reply_message.finish(format_timeout_reply(ToolTimeout(llm_response)))
+                return
+        else:
+            llm_response = run_tool("chat_with_llm.py", ["--prompt", msg, "--system", current_sys,
+                                                         "--session", get_session_id(sender_id),
+                                                         "--persona", get_current_persona(), "--lang", voice_lang_short])
+        
+        if llm_response and "content" in llm_response:
+            reply_text = llm_response["content"]
+        elif llm_response and llm_response.get("error_type") == "deadline_exceeded":
+            reply_text = "⏱️ Los modelos no respondieron a tiempo. Inténtalo de nuevo en unos minutos."
+        else:
+            error_msg = llm_response.get('error', 'Respuesta vacía') if llm_response else "Error desconocido"
+            reply_text = f"⚠️ Error del Modelo: {error_msg}"
+    
+    # 3. Enviar respuesta a Telegram
+    if reply_text and reply_message:
+        # Respuesta en streaming: el mensaje provisional pasa a tener el texto definitivo
+        print(f"   📤 Completando respuesta: '{reply_text[:60]}...'")
+        reply_message.finish(reply_text)
+    elif reply_text:
+        print(f"   📤 Enviando respuesta: '{reply_text[:60]}...'")
+        res = run_tool("telegram_tool.py", ["--action", "send", "--message", reply_text, "--chat-id", sender_id])
+        if res and res.get("status") == "error":
+            print(f"   ❌ Error al enviar mensaje: {res.get('message')}")
+        
+        # 4. Si fue interacción por voz, enviar también audio
+        if is_voice_interaction and reply_text:
+            print("   🗣️ Generando respuesta de voz...")
+            audio_path = os.path.join(".tmp", f"reply_{sender_id}_{int(time.time())}.ogg")
+            # Generar audio
+            tts_res = run_tool("text_to_speech.py", ["--text", reply_text[:500], "--output", audio_path, "--lang", voice_lang_short]) # Limitamos a 500 chars para no hacerlo eterno
+            if tts_res and tts_res.get("status") == "success":
+                run_tool("telegram_tool.py", ["--action", "send-voice", "--file-path", audio_path, "--chat-id", sender_id])
+
+
+HEALTH_CHECK_INTERVAL = 300  # Verificar cada 5 minutos
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("TELEGRAM_MAX_CONCURRENCY", "4"))
+DEFAULT_FAST_WORKERS = int(os.getenv("TELEGRAM_FAST_WORKERS", "4"))
+
+
+def check_system_health():
+    """Envía alertas técnicas al admin (CHAT_ID del .env) si hay problemas de recursos."""
+    admin_id = os.getenv("TELEGRAM_CHAT_ID")
+    if admin_id:
+        res = run_tool("monitor_resources.py", [])
+        if res and res.get("alerts"):
+            alerts = res.get("alerts", [])
+            alert_msg = "🚨 *ALERTA DEL SISTEMA:*\n\n" + "\n".join([f"- {a}" for a in alerts])
+            print(f"   ⚠️ Detectada alerta de sistema. Notificando a {admin_id}...")
+            run_tool("telegram_tool.py", ["--action", "send", "--message", alert_msg, "--chat-id", admin_id])
+
+
+def get_chat_key(msg):
+    """Extrae el CHAT_ID de un mensaje "CHAT_ID|MENSAJE" (None si no lo tiene)."""
+    return msg.split("|", 1)[0] if "|" in msg else None
+
+
+def classify_message(msg):
+    """
+    Devuelve el carril ("fast" o "heavy") de un mensaje "CHAT_ID|MENSAJE".
+
+    fast: ayuda, estado, saludos, /modo, /idioma y otros comandos locales.
+    heavy: todo lo que llama a LLMs, búsquedas, el sandbox o procesa archivos/voz.
+    """
+    content = msg.split("|", 1)[1] if "|" in msg else msg
+    if content.startswith(("__PHOTO__:", "__DOCUMENT__:", "__VOICE__:")):
+        return "heavy"
+    if content.startswith(HEAVY_COMMANDS):
+        return "heavy"
+    if content.startswith(FAST_COMMANDS):
+        return "fast"
+    if content.lower().strip() in GREETINGS or content.lower().strip() in THANKS:
+        return "fast"
+    return "heavy"
+
+
+def is_barrier_command(msg):
+    """True si el mensaje cambia ajustes del chat que afectan a los mensajes siguientes."""
+    content = msg.split("|", 1)[1] if "|" in msg else msg
+    return content.split(" ", 1)[0] in BARRIER_COMMANDS
+
+
+class ChatDispatcher:
+    """
+    Despacha cada mensaje como una tarea asyncio.
+
+    - Límite de concurrencia: cuántos mensajes se procesan a la vez (el tamaño
+      del pool de hilos propio).
+    - Orden por chat: los mensajes de un mismo chat se procesan uno tras otro,
+      en el orden en que llegaron (asyncio.Lock atiende a sus esperas en FIFO).
+    """
+
+    def __init__(self, handler, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.handler = handler
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+        self._chat_locks = {}
+        self._pending = {}
+        self._tasks = set()
+
+    def dispatch(self, msg, after=None):
+        """Encola el mensaje; con `after` (tarea de otro carril), no empieza hasta que esta termine."""
+        chat_key = get_chat_key(msg)
+        lock = self._chat_locks.setdefault(chat_key, asyncio.Lock())
+        self._pending[chat_key] = self._pending.get(chat_key, 0) + 1
+        task = asyncio.create_task(self._process(chat_key, lock, msg, after))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _process(self, chat_key, lock, msg, after=None):
+        async with lock:
+            if after is not None:
+                # Se espera con el turno del chat tomado (los siguientes del carril van detrás)
+                # pero sin ocupar un hilo del pool
+                await asyncio.wait({after})
+            try:
+                # Las herramientas son bloqueantes: se ejecutan en el pool de hilos
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self._executor, self.handler, msg)
+            except Exception as e:
+                print(f"   ❌ Error procesando mensaje de {chat_key}: {e}")
+        # Liberar el lock del chat si no quedan mensajes pendientes de ese chat
+        self._pending[chat_key] -= 1
+        if not self._pending[chat_key]:
+            del self._pending[chat_key]
+            del self._chat_locks[chat_key]
+
+    async def drain(self):
+        """Espera a que terminen las tareas en curso."""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LaneScheduler:
+    """
+    Planificador con dos carriles, cada uno con su propia cola FIFO por chat y
+    su propio pool de hilos. Un carril "heavy" saturado no retrasa al "fast".
+
+    El orden por chat solo se garantiza dentro de cada carril, salvo para los
+    BARRIER_COMMANDS (/modo, /idioma, /zona_horaria): esperan a los mensajes pesados
+    anteriores del mismo chat, y los pesados posteriores esperan a que terminen, de
+    modo que un cambio de ajustes nunca adelanta ni se queda detrás de una consulta.
+    """
+
+    def __init__(self, handler, heavy_workers=DEFAULT_MAX_CONCURRENCY, fast_workers=DEFAULT_FAST_WORKERS):
+        self.lanes = {
+            "fast": ChatDispatcher(handler, fast_workers),
+            "heavy": ChatDispatcher(handler, heavy_workers),
+        }
+        # Última tarea pendiente por chat: la pesada y la del comando barrera
+        self._last_heavy = {}
+        self._last_barrier = {}
+
+    def dispatch(self, msg):
+        lane = classify_message(msg)
+        chat_key = get_chat_key(msg)
+        if lane == "heavy":
+            task = self.lanes["heavy"].dispatch(msg, after=self._last_barrier.get(chat_key))
+            self._track(self._last_heavy, chat_key, task)
+        elif is_barrier_command(msg):
+            task = self.lanes["fast"].dispatch(msg, after=self._last_heavy.get(chat_key))
+            self._track(self._last_barrier, chat_key, task)
+        else:
+            task = self.lanes["fast"].dispatch(msg)
+        return task
+
+    @staticmethod
+    def _track(last, chat_key, task):
+        last[chat_key] = task
+
+        def forget(done):
+            if last.get(chat_key) is done:
+                del last[chat_key]
+        task.add_done_callback(forget)
+
+    async def drain(self):
+        await asyncio.gather(*[lane.drain() for lane in self.lanes.values()])
+
+    def shutdown(self):
+        for lane in self.lanes.values():
+            lane.shutdown()
+
+
+async def _periodic(interval, func):
+    """Ejecuta func (bloqueante) en un hilo cada `interval` segundos."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(func)
+        except Exception as e:
+            print(f"   ⚠️ Error en tarea de fondo {func.__name__}: {e}")
+
+
+def poll_failed(response):
+    """
+    True si la consulta de updates no ha funcionado (error, timeout o salida no JSON).
+    Solo entonces se espera POLL_ERROR_BACKOFF: si getUpdates no llegó a bloquear, volver
+    a llamar en el acto dejaría el bucle girando al 100 % de CPU.
+    """
+    if isinstance(response, dict) and response.get("status") == "success":
+        return False
+    if isinstance(response, dict) and response.get("status") == "error":
+        print(f"⚠️ Error en Telegram: {response.get('message')}")
+    elif response is not None:
+        print(f"⚠️ Respuesta inesperada de telegram_tool.py: {response!r}")
+    return True
+
+
+async def _poll_updates(dispatcher):
+    """Fuente de updates por long polling (telegram_tool.py --action check)."""
+    while True:
+        try:
+            response = await asyncio.to_thread(run_tool, "telegram_tool.py", ["--action", "check"])
+        except ToolTimeout as e:
+            print(f"⚠️ Error en Telegram: {e}")
+            response = None
+
+        if poll_failed(response):
+            await asyncio.sleep(POLL_ERROR_BACKOFF)
+            continue
+        for msg in response.get("messages", []):
+            dispatcher.dispatch(msg)
+        # Sin pausa tras un éxito: el long polling ya espera hasta que llega un update
+
+
+async def _serve_webhook(dispatcher):
+    """Fuente de updates por webhook: cada POST de Telegram entra directo en la cola de despacho."""
+    loop = asyncio.get_running_loop()
+    server = telegram_webhook.WebhookServer(
+        lambda msg: loop.call_soon_threadsafe(dispatcher.dispatch, msg),
+        os.getenv("TELEGRAM_WEBHOOK_SECRET"),
+    ).start()
+    print(f"   🌐 Webhook escuchando en {telegram_webhook.WEBHOOK_HOST}:{server.port}{telegram_webhook.WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.stop()
+
+
+async def main_async(max_concurrency=DEFAULT_MAX_CONCURRENCY, fast_workers=DEFAULT_FAST_WORKERS, use_webhook=False):
+    """Bucle de eventos: la recepción de updates no espera a que terminen los mensajes anteriores."""
+    dispatcher = LaneScheduler(handle_message, max_concurrency, fast_workers)
+    background = [
+        asyncio.create_task(_periodic(HEALTH_CHECK_INTERVAL, check_system_health)),
+    ]
+    try:
+        if use_webhook:
+            await _serve_webhook(dispatcher)
+        else:
+            await _poll_updates(dispatcher)
+    finally:
+        for task in background:
+            task.cancel()
+        await dispatcher.drain()
+        dispatcher.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escucha y responde mensajes de Telegram.")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="Procesa los mensajes concurrentemente con asyncio (un chat lento no bloquea a los demás).")
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY,
+                        help="Máximo de mensajes pesados (LLM, búsquedas, sandbox...) procesados a la vez en modo --async (env: TELEGRAM_MAX_CONCURRENCY).")
+    parser.add_argument("--fast-workers", type=int, default=DEFAULT_FAST_WORKERS,
+                        help="Hilos del carril rápido (/ayuda, /status, saludos...) en modo --async (env: TELEGRAM_FAST_WORKERS).")
+    parser.add_argument("--webhook", action="store_true",
+                        help="Recibe los updates por webhook en lugar de polling (implica --async; requiere TELEGRAM_WEBHOOK_SECRET).")
+    args = parser.parse_args(argv)
+
+    print("📡 Escuchando Telegram... (Presiona Ctrl+C para detener)")
+    print("   El agente responderá a cualquier mensaje que le envíes.")
+
+    # Importar las herramientas una sola vez (evita un intérprete nuevo por llamada)
+    tool_runtime.preload()
+    # Abrir ya las conexiones a los proveedores LLM (en segundo plano)
+    threading.Thread(target=prewarm_llm_clients, name="llm-prewarm", daemon=True).start()
+
+    # --- TAREA DE FONDO: RECORDATORIOS ---
+    # Hilo propio que duerme hasta el próximo vencimiento (sin leer disco en cada vuelta)
+    reminders = get_reminder_scheduler().start()
+    print(f"   ⏰ {len(reminders)} recordatorios cargados.")
+
+    if args.webhook and not os.getenv("TELEGRAM_WEBHOOK_SECRET"):
+        print("❌ Falta TELEGRAM_WEBHOOK_SECRET en .env (necesario para validar los webhooks).")
+        sys.exit(1)
+
+    if args.async_mode or args.webhook:
+        print(f"   ⚡ Modo asíncrono activo (carril pesado: {args.max_concurrency} hilos, carril rápido: {args.fast_workers}).")
+        try:
+            asyncio.run(main_async(args.max_concurrency, args.fast_workers, args.webhook))
+        except KeyboardInterrupt:
+            print("\n🛑 Desconectando servicio de Telegram.")
+        return
+
+    last_health_check = time.time()
+
+    try:
+        while True:
+            failed = True
+            try:
+                # 1. Consultar nuevos mensajes
+                response = run_tool("telegram_tool.py", ["--action", "check"])
+                failed = poll_failed(response)
+                if not failed:
+                    messages = response.get("messages", [])
+                    for msg in messages:
+                        handle_message(msg)
+
+                # --- TAREA DE FONDO: MONITOREO PROACTIVO ---
+                if time.time() - last_health_check > HEALTH_CHECK_INTERVAL:
+                    last_health_check = time.time()
+                    check_system_health()
+            except ToolTimeout as e:
+                print(f"   ⏱️ {e}")
+            # Tras un éxito no hace falta pausa: el long polling de telegram_tool.py ya
+            # espera hasta que llega un update. Si falló, se espera para no saturar la CPU/API.
+            if failed:
+                time.sleep(POLL_ERROR_BACKOFF)
             
     except KeyboardInterrupt:
         print("\n🛑 Desconectando servicio de Telegram.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Caché exacta de respuestas LLM.
+
+`/traducir`, `/resumir <url>` o un `/investigar` repetido envían a menudo
+exactamente el mismo prompt. chat_with_llm.py consulta esta caché antes de
+llamar a ningún proveedor:
+  - Clave: hash SHA-256 de (proveedor, modelo, instrucción de sistema, mensajes).
+  - Persistente en el almacén de estado (tabla llm_cache de agent_state.db).
+  - Caducidad: LLM_CACHE_TTL segundos (1 día por defecto).
+  - Tamaño acotado: LLM_CACHE_MAX_ENTRIES respuestas; se descartan las usadas
+    hace más tiempo (LRU).
+  - Contadores de aciertos y fallos (tabla counters).
+
+Se desactiva por llamada con `--no-cache` o globalmente con LLM_CACHE=0.
+
+Uso:
+    python execution/llm_cache.py          # muestra tamaño y aciertos/fallos
+    python execution/llm_cache.py --clear  # vacía la caché y los contadores
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import state_store
+
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+HITS = "llm_cache.hits"
+MISSES = "llm_cache.misses"
+
+
+def cache_key(provider, model, system, messages):
+    payload = json.dumps([provider, model, system or "", messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self, store, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, clock=time.time):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+
+    def lookup(self, candidates, system, messages):
+        """
+        Busca una respuesta para cualquiera de los candidatos [(proveedor, modelo)],
+        en su orden de preferencia. Devuelve (proveedor, contenido) o None.
+        """
+        now = self._clock()
+        keys = [cache_key(provider, model, system, messages) for provider, model in candidates]
+        try:
+            hit = self.store.cache_lookup(keys, now - self.ttl, now)
+            self.store.incr_counter(HITS if hit else MISSES)
+        except Exception as e:
+            print(f"⚠️ [CACHE] Error leyendo la caché: {e}", file=sys.stderr)
+            return None
+        return hit
+
+    def put(self, provider, model, system, messages, content):
+        now = self._clock()
+        try:
+            self.store.cache_put(cache_key(provider, model, system, messages), provider, model, content,
+                                 self.max_entries, now - self.ttl, now)
+        except Exception as e:
+            print(f"⚠️ [CACHE] Error guardando en la caché: {e}", file=sys.stderr)
+
+    def stats(self):
+        hits = self.store.get_counter(HITS)
+        misses = self.store.get_counter(MISSES)
+        total = hits + misses
+        return {
+            "entries": self.store.cache_size(),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+        }
+
+    def clear(self):
+        self.store.clear_cache()
+        self.store.reset_counters("llm_cache.")
+
+
+def get_cache():
+    return ResponseCache(state_store.get_store())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caché de respuestas LLM (exacta).")
+    parser.add_argument("--clear", action="store_true", help="Vacía la caché y reinicia los contadores.")
+    args = parser.parse_args(argv)
+
+    cache = get_cache()
+    if args.clear:
+        cache.clear()
+        print(json.dumps({"status": "success", "message": "Caché vaciada."}))
+        return
+    print(json.dumps({"status": "success", "cache": cache.stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
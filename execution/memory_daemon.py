@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Daemon de memoria: ChromaDB y el modelo de embeddings residentes.
+
+Cada llamada a save_memory.py, query_memory.py, list_memories.py,
+delete_memory.py o al RAG de chat_with_llm.py abría un PersistentClient nuevo
+y volvía a cargar el modelo de embeddings (varios segundos). Este daemon abre
+la colección `agent_memory` una sola vez y atiende add/query/list/search/delete
+por un socket Unix (una línea JSON por petición y otra por respuesta):
+
+    {"op": "query", "db_path": "...", "args": {"query": "...", "n_results": 3}}
+    {"ok": true, "result": {...}}
+
+Los scripts usan call(): si el daemon no está en marcha (o sirve otra base de
+datos) la operación se ejecuta en modo directo, con un backend que también se
+conserva entre llamadas dentro del mismo proceso (ver tool_runtime.py).
+Ambos mantienen al día el índice secundario de memory_index.py.
+
+Uso:
+    python execution/memory_daemon.py            # arranca el daemon
+    python execution/memory_daemon.py --status   # comprueba si está en marcha
+
+Variables: AGENT_MEMORY_SOCKET (ruta del socket, .tmp/memory.sock por defecto),
+MEMORY_SEARCH_MODE (hybrid), MEMORY_MAX_DISTANCE (1.3) y MEMORY_LEXICAL_MIN_MATCH
+(0.6) para query.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import socketserver
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import memory_index
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(PROJECT_ROOT, ".tmp", "chroma_db")
+COLLECTION = "agent_memory"
+SOCKET_PATH = os.getenv("AGENT_MEMORY_SOCKET", os.path.join(PROJECT_ROOT, ".tmp", "memory.sock"))
+CONNECT_TIMEOUT = 0.5
+REQUEST_TIMEOUT = 30.0
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+INDEX_REBUILD_BATCH = 1000
+DELETE_BATCH = 500
+# Búsqueda: "vector" (solo ChromaDB), "lexical" (solo BM25) o "hybrid" (ambas fusionadas con RRF)
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+SEARCH_MODE = os.getenv("MEMORY_SEARCH_MODE", "hybrid")
+# Distancia máxima de un vecino para considerarlo relevante (0 = sin corte)
+MAX_DISTANCE = float(os.getenv("MEMORY_MAX_DISTANCE", "1.3"))
+# Fracción mínima de palabras de la consulta (sin palabras vacías) en un acierto solo léxico
+LEXICAL_MIN_MATCH = float(os.getenv("MEMORY_LEXICAL_MIN_MATCH", "0.6"))
+SEARCH_CANDIDATES = 20  # candidatos por etapa antes de fusionar
+RRF_K = 60
+
+
+class MemoryUnavailable(Exception):
+    """No se pudo abrir la base de memoria (ChromaDB instalado pero inaccesible)."""
+
+
+class MemoryServiceError(Exception):
+    """La operación de memoria falló (en el daemon o en modo directo)."""
+
+
+def _to_json(value):
+    """Convierte los tipos de numpy que devuelve ChromaDB a tipos JSON."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+class MemoryBackend:
+    """Operaciones sobre la colección `agent_memory`, comunes al daemon y al modo directo."""
+
+    OPS = ("ping", "add", "query", "list", "search", "delete", "count")
+
+    def __init__(self, collection, db_path=None, index=None):
+        self.collection = collection
+        self.db_path = os.path.abspath(db_path) if db_path else None
+        if index is None:
+            index = memory_index.MemoryIndex(
+                os.path.join(self.db_path, memory_index.INDEX_FILE) if self.db_path else ":memory:")
+        self.index = index
+        self._index_checked = False
+        self._lock = threading.RLock()
+
+    @classmethod
+    def open(cls, db_path=DB_PATH):
+        """Abre (o crea) la colección. ImportError si ChromaDB no está instalado."""
+        import chromadb  # pesado: solo al abrir el backend
+        try:
+            client = chromadb.PersistentClient(path=db_path)
+            collection = client.get_or_create_collection(name=COLLECTION)
+        except Exception as e:
+            raise MemoryUnavailable(str(e)) from e
+        return cls(collection, db_path)
+
+    def warm_up(self):
+        """Carga el modelo de embeddings ahora en lugar de en la primera consulta."""
+        try:
+            self.collection.query(query_texts=["warm-up"], n_results=1)
+        except Exception as e:
+            print(f"⚠️ [MEMORY] No se pudo precargar el modelo de embeddings: {e}", file=sys.stderr)
+
+    def sync_index(self):
+        """Reconstruye el índice secundario si no cuadra con la colección (p.ej. base anterior al índice)."""
+        if self.index.count() == self.collection.count():
+            return
+        print("🔄 [MEMORY] Reconstruyendo el índice de recuerdos...", file=sys.stderr)
+        batches, offset = [], 0
+        while True:
+            data = self.collection.get(limit=INDEX_REBUILD_BATCH, offset=offset, include=["documents", "metadatas"])
+            if not data["ids"]:
+                break
+            batches.append((data["ids"], data["documents"], data["metadatas"]))
+            offset += len(data["ids"])
+        self.index.rebuild(batches)
+
+    def handle(self, op, args):
+        if op not in self.OPS:
+            raise MemoryServiceError(f"Operación desconocida: {op}")
+        with self._lock:
+            if not self._index_checked:
+                self.sync_index()
+                self._index_checked = True
+            return getattr(self, f"op_{op}")(**args)
+
+    def op_ping(self):
+        return {"pid": os.getpid(), "db_path": self.db_path}
+
+    def op_add(self, documents, metadatas=None, ids=None, skip_existing=False):
+        """
+        Añade un lote (ChromaDB calcula los embeddings del lote de una vez).
+        Con skip_existing se omiten los IDs ya guardados: reimportar no repite trabajo.
+        """
+        if not ids or len(ids) != len(documents):
+            raise MemoryServiceError("Cada recuerdo necesita un ID.")
+        skipped = 0
+        if skip_existing:
+            existing = set(self.collection.get(ids=ids, include=[])["ids"])
+            if existing:
+                keep = [i for i, memory_id in enumerate(ids) if memory_id not in existing]
+                skipped = len(ids) - len(keep)
+                ids = [ids[i] for i in keep]
+                documents = [documents[i] for i in keep]
+                metadatas = [metadatas[i] for i in keep] if metadatas else None
+        if ids:
+            self.collection.add(documents=documents, metadatas=metadatas, ids=ids)
+            self.index.add(ids, documents, metadatas)
+        return {"ids": ids, "skipped": skipped}
+
+    def op_query(self, query, n_results=3, mode=None, max_distance=None, min_match=None):
+        """
+        Búsqueda híbrida: vecinos más cercanos en ChromaDB (descartando los que
+        superan max_distance) y BM25 en el índice de palabras, fusionados con
+        reciprocal rank fusion. mode = "vector", "lexical" o "hybrid".
+        Los aciertos solo léxicos que contienen menos de `min_match` (fracción)
+        de las palabras de la consulta se descartan tras la fusión: compartir
+        una palabra corriente no basta para inyectar un recuerdo.
+        Devuelve listas planas (ids, documents, metadatas, distances, scores,
+        matched_by) y la latencia de cada etapa en timings_ms.
+        """
+        mode = mode or SEARCH_MODE
+        if mode not in SEARCH_MODES:
+            raise MemoryServiceError(f"Modo de búsqueda desconocido: {mode} (usa {', '.join(SEARCH_MODES)})")
+        max_distance = MAX_DISTANCE if max_distance is None else max_distance
+        min_match = LEXICAL_MIN_MATCH if min_match is None else min_match
+        candidates = max(n_results, SEARCH_CANDIDATES) if mode == "hybrid" else n_results
+        found, rankings, timings = {}, [], {}
+
+        if mode in ("vector", "hybrid"):
+            started = time.perf_counter()
+            results = self.collection.query(query_texts=[query], n_results=candidates)
+            timings["vector"] = round((time.perf_counter() - started) * 1000, 1)
+            ranking = []
+            for memory_id, document, metadata, distance in zip(*((results.get(key) or [[]])[0] for key in (
+                    "ids", "documents", "metadatas", "distances"))):
+                if max_distance and distance > max_distance:
+                    continue  # demasiado lejos: mejor no inyectar nada
+                found[memory_id] = {"document": document, "metadata": metadata, "distance": distance,
+                                    "matched_by": ["vector"]}
+                ranking.append(memory_id)
+            rankings.append(ranking)
+
+        if mode in ("lexical", "hybrid"):
+            started = time.perf_counter()
+            hits = self.index.search_keywords(query, limit=candidates, match_all=False)
+            timings["lexical"] = round((time.perf_counter() - started) * 1000, 1)
+            for hit in hits:
+                entry = found.setdefault(hit["id"], {"document": hit["content"], "metadata": hit["metadata"],
+                                                     "distance": None, "matched_by": []})
+                entry["matched_by"].append("lexical")
+                entry["matched"] = hit["matched"]
+            rankings.append([hit["id"] for hit in hits])
+
+        started = time.perf_counter()
+        scores = reciprocal_rank_fusion(rankings)
+        ranked = sorted(scores, key=lambda memory_id: -scores[memory_id])
+        top = [memory_id for memory_id in ranked
+               if found[memory_id]["matched_by"] != ["lexical"] or found[memory_id]["matched"] >= min_match][:n_results]
+        timings["fusion"] = round((time.perf_counter() - started) * 1000, 3)
+        return {
+            "ids": top,
+            "documents": [found[memory_id]["document"] for memory_id in top],
+            "metadatas": [found[memory_id]["metadata"] for memory_id in top],
+            "distances": [found[memory_id]["distance"] for memory_id in top],
+            "scores": [round(scores[memory_id], 5) for memory_id in top],
+            "matched_by": [found[memory_id]["matched_by"] for memory_id in top],
+            "mode": mode,
+            "timings_ms": timings,
+        }
+
+    def op_list(self, limit=10, category=None, chat_id=None, cursor=None):
+        """Más recientes primero, desde el índice secundario (lee solo `limit` filas)."""
+        memories, next_cursor = self.index.list(limit, category=category, chat_id=chat_id, cursor=cursor)
+        return {"memories": memories, "next_cursor": next_cursor}
+
+    def op_search(self, text=None, keywords=None, limit=None):
+        """
+        Búsqueda en el índice de texto: subcadena (`text`), todas las palabras clave
+        (`keywords`) o, con ambos, los recuerdos que cumplen las dos condiciones.
+        """
+        if text and keywords:
+            by_keywords = {match["id"] for match in self.index.search_keywords(keywords)}
+            matches = [match for match in self.index.search_text(text) if match["id"] in by_keywords]
+            return matches[:limit] if limit else matches
+        if text:
+            return self.index.search_text(text, limit=limit)
+        if keywords:
+            return self.index.search_keywords(keywords, limit=limit)
+        raise MemoryServiceError("Indica text o keywords.")
+
+    def op_delete(self, ids=None, text=None, keywords=None, dry_run=False, batch_size=DELETE_BATCH):
+        """
+        Borra por IDs o los recuerdos que encuentra op_search. Con dry_run solo
+        devuelve las coincidencias. Devuelve los IDs borrados.
+        """
+        matches = None
+        if text or keywords:
+            matches = self.op_search(text=text, keywords=keywords)
+            ids = [match["id"] for match in matches]
+        if dry_run:
+            return {"deleted": [], "matches": matches if matches is not None else [{"id": i} for i in ids or []]}
+        ids = ids or []
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            self.collection.delete(ids=batch)
+            self.index.delete(batch)
+        return {"deleted": ids}
+
+    def op_count(self):
+        return self.collection.count()
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Puntuación RRF: suma de 1 / (k + posición) en cada ranking en que aparece cada id."""
+    scores = {}
+    for ranking in rankings:
+        for rank, memory_id in enumerate(ranking, start=1):
+            scores[memory_id] = scores.get(memory_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(db_path=DB_PATH):
+    """Backend de modo directo, uno por base de datos y proceso."""
+    key = os.path.abspath(db_path)
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = MemoryBackend.open(db_path)
+        return _backends[key]
+
+
+# --- Cliente -------------------------------------------------------------------
+
+def _send(payload, socket_path, timeout):
+    """Una petición por conexión. None si no hay daemon escuchando."""
+    if not os.path.exists(socket_path):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            # Socket huérfano de un daemon caído: modo directo
+            return None
+        sock.settimeout(timeout)
+        try:
+            sock.sendall(json.dumps(payload, default=_to_json).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as reader:
+                line = reader.readline(MAX_REQUEST_BYTES)
+        except OSError as e:
+            # La petición ya salió: repetirla en modo directo podría duplicarla
+            raise MemoryServiceError(f"El daemon de memoria no respondió: {e}") from e
+    if not line:
+        raise MemoryServiceError("El daemon de memoria cerró la conexión sin responder.")
+    return json.loads(line)
+
+
+def request(op, db_path=DB_PATH, socket_path=None, timeout=REQUEST_TIMEOUT, **args):
+    """
+    Envía una operación al daemon y devuelve su respuesta ({"ok": ..., ...}).
+    None si el daemon no está en marcha o sirve otra base de datos.
+    """
+    payload = {"op": op, "db_path": os.path.abspath(db_path), "args": args}
+    response = _send(payload, socket_path or SOCKET_PATH, timeout)
+    if response is None or response.get("wrong_db"):
+        return None
+    return response
+
+
+def call(op, db_path=DB_PATH, socket_path=None, **args):
+    """
+    Ejecuta una operación de memoria en el daemon o, si no está disponible, en
+    este proceso. Lanza ImportError si hace falta el modo directo y ChromaDB no
+    está instalado, MemoryUnavailable si no se puede abrir la base y
+    MemoryServiceError si la operación falla.
+    """
+    response = request(op, db_path=db_path, socket_path=socket_path, **args)
+    if response is not None:
+        if not response.get("ok"):
+            raise MemoryServiceError(response.get("error", "Error desconocido en el daemon de memoria."))
+        return response["result"]
+    backend = get_backend(db_path)
+    try:
+        return backend.handle(op, args)
+    except MemoryServiceError:
+        raise
+    except Exception as e:
+        raise MemoryServiceError(str(e)) from e
+
+
+# --- Servidor ------------------------------------------------------------------
+
+class MemoryDaemon:
+    """Servidor Unix (un hilo por conexión) sobre un MemoryBackend residente."""
+
+    def __init__(self, backend, socket_path=None):
+        self.backend = backend
+        self.socket_path = socket_path or SOCKET_PATH
+        if os.path.exists(self.socket_path):
+            try:
+                running = _send({"op": "ping"}, self.socket_path, CONNECT_TIMEOUT) is not None
+            except MemoryServiceError:
+                running = True  # acepta conexiones aunque no responda
+            if running:
+                raise RuntimeError(f"Ya hay un daemon de memoria escuchando en {self.socket_path}")
+            os.unlink(self.socket_path)  # socket de un daemon anterior que no se cerró bien
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, self._make_handler())
+        self._server.daemon_threads = True
+        os.chmod(self.socket_path, 0o600)
+        self._thread = None
+
+    def handle_request(self, payload):
+        db_path = payload.get("db_path")
+        if self.backend.db_path and db_path and os.path.abspath(db_path) != self.backend.db_path:
+            return {"ok": False, "wrong_db": True, "error": f"El daemon sirve {self.backend.db_path}"}
+        started = time.monotonic()
+        try:
+            result = self.backend.handle(payload.get("op"), payload.get("args") or {})
+        except Exception as e:
+            print(f"❌ [MEMORY] {payload.get('op')}: {e}", file=sys.stderr)
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "result": result, "elapsed_ms": round((time.monotonic() - started) * 1000, 1)}
+
+    def _make_handler(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline(MAX_REQUEST_BYTES)
+                if not line:
+                    return
+                try:
+                    payload = json.loads(line)
+                    if not isinstance(payload, dict):
+                        raise ValueError("se esperaba un objeto JSON")
+                except (ValueError, UnicodeDecodeError) as e:
+                    response = {"ok": False, "error": f"Petición inválida: {e}"}
+                else:
+                    response = daemon.handle_request(payload)
+                self.wfile.write(json.dumps(response, default=_to_json).encode("utf-8") + b"\n")
+
+        return Handler
+
+    def start(self):
+        """Arranca el servidor en un hilo de fondo."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name="memory-daemon", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Daemon de memoria (ChromaDB residente por socket Unix).")
+    parser.add_argument("--db-path", default=DB_PATH, help="Ruta a ChromaDB.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Ruta del socket Unix.")
+    parser.add_argument("--status", action="store_true", help="Comprueba si el daemon está en marcha.")
+    args = parser.parse_args(argv)
+
+    if args.status:
+        try:
+            response = request("ping", db_path=args.db_path, socket_path=args.socket, timeout=CONNECT_TIMEOUT)
+        except MemoryServiceError:
+            response = None
+        if response and response.get("ok"):
+            print(json.dumps({"status": "success", "running": True, **response["result"]}))
+        else:
+            print(json.dumps({"status": "success", "running": False}))
+        return
+
+    try:
+        backend = MemoryBackend.open(args.db_path)
+    except ImportError:
+        print(json.dumps({"status": "error", "message": "Falta la librería 'chromadb'."}))
+        sys.exit(10)
+    except MemoryUnavailable as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        sys.exit(2)
+
+    started = time.monotonic()
+    backend.warm_up()
+    print(f"🧠 [MEMORY] Modelo de embeddings cargado en {time.monotonic() - started:.1f}s.", file=sys.stderr)
+    try:
+        daemon = MemoryDaemon(backend, args.socket).start()
+    except RuntimeError as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        sys.exit(1)
+    print(f"📡 [MEMORY] Daemon escuchando en {args.socket}", file=sys.stderr)
+    try:
+        daemon._thread.join()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Índice secundario de la memoria en SQLite (<db_path>/memory_index.db).
+
+ChromaDB no ordena por metadatos: listar los últimos recuerdos obligaba a leer
+la colección entera y ordenarla en Python. Este índice guarda una fila por
+recuerdo (id, timestamp, categoría, chat, contenido y metadatos) con índices
+por (timestamp, id), de modo que `/memorias` lee solo `limit` filas sea cual
+sea el tamaño de la colección.
+
+- Lo mantiene memory_daemon.MemoryBackend en cada add/delete (daemon y modo
+  directo); si al abrirlo no cuadra con la colección, se reconstruye.
+- Paginación por cursor: cada página devuelve `next_cursor`, que se pasa tal
+  cual para pedir la siguiente (recuerdos más antiguos).
+- Filtros por categoría y por chat (metadato `chat_id`).
+- Búsqueda de texto con FTS5, sin recorrer la colección: por subcadena
+  (tokenizador trigram, como `texto in recuerdo` sin distinguir mayúsculas) y
+  por palabras clave (unicode61, sin distinguir acentos), ordenada por BM25.
+  Si el SQLite instalado no trae FTS5 se recurre a LIKE sobre la tabla.
+
+Es un índice derivado: si cambia SCHEMA_VERSION se borra y se reconstruye.
+"""
+import os
+import re
+import json
+import base64
+import sqlite3
+import threading
+import unicodedata
+
+INDEX_FILE = "memory_index.db"
+SCHEMA_VERSION = 2
+TRIGRAM_MIN_CHARS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    category TEXT,
+    chat_id TEXT,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_memories_time ON memories (timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_memories_category ON memories (category, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_memories_chat ON memories (chat_id, timestamp, id);
+"""
+
+# Tablas FTS5 de contenido externo (no duplican el texto), sincronizadas por triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS memories_text USING fts5(
+    content, content='memories', content_rowid='seq', tokenize='trigram');
+CREATE VIRTUAL TABLE IF NOT EXISTS memories_words USING fts5(
+    content, content='memories', content_rowid='seq', tokenize='unicode61 remove_diacritics 2');
+CREATE TRIGGER IF NOT EXISTS memories_ai AFTER INSERT ON memories BEGIN
+    INSERT INTO memories_text(rowid, content) VALUES (new.seq, new.content);
+    INSERT INTO memories_words(rowid, content) VALUES (new.seq, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_ad AFTER DELETE ON memories BEGIN
+    INSERT INTO memories_text(memories_text, rowid, content) VALUES ('delete', old.seq, old.content);
+    INSERT INTO memories_words(memories_words, rowid, content) VALUES ('delete', old.seq, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_au AFTER UPDATE OF content ON memories BEGIN
+    INSERT INTO memories_text(memories_text, rowid, content) VALUES ('delete', old.seq, old.content);
+    INSERT INTO memories_words(memories_words, rowid, content) VALUES ('delete', old.seq, old.content);
+    INSERT INTO memories_text(rowid, content) VALUES (new.seq, new.content);
+    INSERT INTO memories_words(rowid, content) VALUES (new.seq, new.content);
+END;
+"""
+
+UPSERT = """
+INSERT INTO memories (id, timestamp, category, chat_id, content, metadata) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET timestamp = excluded.timestamp, category = excluded.category,
+    chat_id = excluded.chat_id, content = excluded.content, metadata = excluded.metadata
+"""
+
+
+# Palabras vacías (español e inglés) que no aportan a la búsqueda léxica del RAG
+STOPWORDS = frozenset("""
+a al algo como con cual cuál cuando cuándo de del donde dónde el ella en era es esa ese eso esta está este
+fue ha hay la las le lo los me mi mis muy más no nos o para pero por que qué quien quién se si sí sin
+sobre son su sus te tu tú un una uno unos y ya yo
+an and are as at be by do does for from how i in is it me my of on or the to was what when where which
+who why with you your
+""".split())
+
+
+def fts_phrase(text):
+    """Texto como frase FTS5 literal (sin operadores)."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def keywords(text):
+    """Palabras de una consulta (letras y dígitos), en minúsculas."""
+    return re.findall(r"\w+", text.lower())
+
+
+def fold(word):
+    """Palabra sin acentos, como la indexa unicode61 con remove_diacritics."""
+    return "".join(c for c in unicodedata.normalize("NFKD", word) if not unicodedata.combining(c))
+
+
+def encode_cursor(timestamp, memory_id):
+    return base64.urlsafe_b64encode(json.dumps([timestamp, memory_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, memory_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError(f"Cursor inválido: {cursor}")
+    return timestamp, memory_id
+
+
+def _row(memory_id, document, metadata):
+    metadata = metadata or {}
+    chat_id = metadata.get("chat_id")
+    return (memory_id, metadata.get("timestamp", ""), metadata.get("category"),
+            str(chat_id) if chat_id is not None else None, document or "",
+            json.dumps(metadata, ensure_ascii=False))
+
+
+class MemoryIndex:
+    """Una conexión SQLite protegida por un lock (segura entre hilos del daemon)."""
+
+    def __init__(self, path):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # Esquema anterior: se descarta (MemoryBackend.sync_index lo vuelve a llenar)
+            self._conn.executescript("""
+                DROP TABLE IF EXISTS memories_text;
+                DROP TABLE IF EXISTS memories_words;
+                DROP TABLE IF EXISTS memories;
+            """)
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite sin FTS5 o sin tokenizador trigram (< 3.34)
+            self.has_fts = False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, statements):
+        """Ejecuta varias sentencias en una transacción."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    if params and isinstance(params, list):
+                        self._conn.executemany(sql, params)
+                    else:
+                        self._conn.execute(sql, params or ())
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def add(self, ids, documents, metadatas=None):
+        metadatas = metadatas or [None] * len(ids)
+        rows = [_row(*entry) for entry in zip(ids, documents, metadatas)]
+        if rows:
+            self._write([(UPSERT, rows)])
+
+    def delete(self, ids):
+        if ids:
+            self._write([("DELETE FROM memories WHERE id = ?", [(memory_id,) for memory_id in ids])])
+
+    def rebuild(self, batches):
+        """Sustituye el contenido por el de la colección: batches = [(ids, documents, metadatas)]."""
+        statements = [("DELETE FROM memories", None)]
+        for ids, documents, metadatas in batches:
+            rows = [_row(*entry) for entry in zip(ids, documents, metadatas or [None] * len(ids))]
+            if rows:
+                statements.append((UPSERT, rows))
+        self._write(statements)
+
+    def count(self):
+        return self._query("SELECT COUNT(*) FROM memories")[0][0]
+
+    def list(self, limit=10, category=None, chat_id=None, cursor=None):
+        """
+        Recuerdos más recientes primero. Devuelve (recuerdos, next_cursor);
+        next_cursor es None en la última página.
+        """
+        where, params = [], []
+        if category:
+            where.append("category = ?")
+            params.append(category)
+        if chat_id is not None:
+            where.append("chat_id = ?")
+            params.append(str(chat_id))
+        if cursor:
+            where.append("(timestamp, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        sql = "SELECT id, timestamp, content, metadata FROM memories"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+        rows = self._query(sql, (*params, limit + 1))
+        memories = [{"id": memory_id, "content": content, "metadata": json.loads(metadata), "timestamp": timestamp}
+                    for memory_id, timestamp, content, metadata in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit and memories:
+            next_cursor = encode_cursor(memories[-1]["timestamp"], memories[-1]["id"])
+        return memories, next_cursor
+
+    def search_text(self, text, limit=None):
+        """Recuerdos que contienen `text` (sin distinguir mayúsculas), más recientes primero."""
+        if not text:
+            return []
+        if self.has_fts and len(text) >= TRIGRAM_MIN_CHARS:
+            sql = ("SELECT m.id, m.timestamp, m.content FROM memories_text JOIN memories m ON m.seq = memories_text.rowid "
+                   "WHERE memories_text MATCH ? ORDER BY m.timestamp DESC")
+            params = [fts_phrase(text)]
+        else:
+            # Trigram necesita 3 caracteres: las subcadenas más cortas se buscan con LIKE
+            escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            sql = "SELECT id, timestamp, content FROM memories WHERE content LIKE ? ESCAPE '\\' ORDER BY timestamp DESC"
+            params = [f"%{escaped}%"]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [{"id": memory_id, "timestamp": timestamp, "content": content}
+                for memory_id, timestamp, content in self._query(sql, params)]
+
+    def search_keywords(self, query, limit=None, match_all=True):
+        """
+        Recuerdos que contienen las palabras de `query` (todas, o alguna con
+        match_all=False), sin distinguir mayúsculas ni acentos. Ordenados por
+        BM25: `score` más alto = más relevante. Con match_all=False (búsqueda
+        para el RAG) se ignoran las palabras vacías ("de", "la", "the"...).
+        `matched` es la fracción de palabras de la consulta que aparecen en el recuerdo.
+        """
+        words = keywords(query)
+        if not match_all:
+            words = [word for word in words if word not in STOPWORDS] or words
+        if not words:
+            return []
+        if not self.has_fts:
+            clauses = " AND " if match_all else " OR "
+            sql = (f"SELECT id, timestamp, content, metadata, 0.0 FROM memories WHERE "
+                   f"{clauses.join(['content LIKE ?'] * len(words))} ORDER BY timestamp DESC")
+            params = [f"%{word}%" for word in words]
+        else:
+            sql = ("SELECT m.id, m.timestamp, m.content, m.metadata, -bm25(memories_words) FROM memories_words "
+                   "JOIN memories m ON m.seq = memories_words.rowid WHERE memories_words MATCH ? "
+                   "ORDER BY bm25(memories_words)")
+            params = [(" AND " if match_all else " OR ").join(fts_phrase(word) for word in words)]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        terms = {fold(word) for word in words}
+        hits = []
+        for memory_id, timestamp, content, metadata, score in self._query(sql, params):
+            present = terms & {fold(word) for word in keywords(content)}
+            hits.append({"id": memory_id, "timestamp": timestamp, "content": content,
+                         "metadata": json.loads(metadata), "score": score,
+                         "matched": round(len(present) / len(terms), 3)})
+        return hits
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Estadísticas persistentes de los proveedores LLM (latencia, errores y 429).
+
+chat_with_llm.py registra cada llamada por proveedor y por modelo, y usa estas
+cifras para:
+  - Ordenar los proveedores (y los modelos de fallback de Gemini) por una
+    puntuación EWMA: latencia media penalizada por la tasa de error reciente.
+  - Circuit breaker: tras LLM_BREAKER_FAILURES fallos seguidos, el proveedor se
+    salta durante LLM_BREAKER_COOLDOWN segundos; después se le deja un intento
+    de prueba y, si acierta, vuelve a la rotación.
+
+Los datos viven en el almacén de estado (tabla provider_stats de agent_state.db).
+
+Uso:
+    python execution/provider_stats.py          # muestra las estadísticas
+    python execution/provider_stats.py --reset  # las borra
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import state_store
+
+EWMA_ALPHA = 0.2
+# Puntuación (segundos "equivalentes") de un proveedor/modelo sin historial:
+# mantiene el orden por defecto hasta que haya datos
+PRIOR_LATENCY = 5.0
+ERROR_PENALTY = 4.0
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "60"))
+ALL_MODELS = "*"  # fila agregada del proveedor
+
+
+def is_rate_limited(error):
+    """Detecta errores de cuota / 429 en el texto de error de un proveedor."""
+    text = str(error).lower()
+    return "429" in text or "rate limit" in text or "rate_limit" in text or "quota" in text or "resource_exhausted" in text
+
+
+class ProviderStats:
+
+    def __init__(self, store, clock=time.time):
+        self.store = store
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = store.load_provider_stats()
+
+    def _entry(self, provider, model):
+        return self._stats.setdefault((provider, model), {
+            "calls": 0, "errors": 0, "rate_limited": 0,
+            "ewma_latency": None, "ewma_error": 0.0,
+            "consecutive_failures": 0, "open_until": 0.0,
+        })
+
+    def record(self, provider, model=None, latency=None, ok=True, rate_limited=False, aggregate=True):
+        """
+        Registra una llamada en la fila agregada del proveedor y, si se indica, en la
+        del modelo concreto (aggregate=False: solo la del modelo, p.ej. los reintentos
+        internos de chat_gemini).
+        """
+        now = self._clock()
+        keys = ([(provider, ALL_MODELS)] if aggregate else []) + ([(provider, model)] if model and model != ALL_MODELS else [])
+        with self._lock:
+            for key in keys:
+                entry = self._entry(*key)
+                entry["calls"] += 1
+                entry["ewma_error"] = (1 - EWMA_ALPHA) * entry["ewma_error"] + EWMA_ALPHA * (0.0 if ok else 1.0)
+                if ok:
+                    if latency is not None:
+                        previous = entry["ewma_latency"]
+                        entry["ewma_latency"] = latency if previous is None else (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * latency
+                    entry["consecutive_failures"] = 0
+                    entry["open_until"] = 0.0
+                else:
+                    entry["errors"] += 1
+                    entry["rate_limited"] += 1 if rate_limited else 0
+                    entry["consecutive_failures"] += 1
+                    if entry["consecutive_failures"] >= BREAKER_FAILURES:
+                        entry["open_until"] = now + BREAKER_COOLDOWN
+                        if entry["consecutive_failures"] == BREAKER_FAILURES:
+                            print(f"🔌 [STATS] Circuito abierto para {key[0]}/{key[1]} durante {BREAKER_COOLDOWN:g} s.", file=sys.stderr)
+                entry["updated_at"] = now
+                data = dict(entry)
+                try:
+                    self.store.save_provider_stats(key[0], key[1], data)
+                except Exception as e:
+                    print(f"⚠️ [STATS] No se pudieron guardar las estadísticas: {e}", file=sys.stderr)
+
+    def score(self, provider, model=ALL_MODELS):
+        """Menor es mejor: latencia EWMA multiplicada por la penalización de errores."""
+        with self._lock:
+            entry = self._stats.get((provider, model))
+        if not entry:
+            return PRIOR_LATENCY
+        latency = entry["ewma_latency"] if entry["ewma_latency"] is not None else PRIOR_LATENCY
+        return latency * (1 + ERROR_PENALTY * entry["ewma_error"])
+
+    def is_open(self, provider, model=ALL_MODELS):
+        """True si el circuit breaker está abierto (hay que saltarse este proveedor/modelo)."""
+        with self._lock:
+            entry = self._stats.get((provider, model))
+        return bool(entry) and entry["open_until"] > self._clock()
+
+    def order(self, candidates, model_of=lambda c: ALL_MODELS, provider_of=lambda c: c):
+        """
+        Ordena los candidatos por puntuación (a igualdad, se respeta el orden dado) y
+        deja al final los que tienen el circuito abierto, para usarlos solo como último recurso.
+        """
+        ranked = sorted(enumerate(candidates),
+                        key=lambda ic: (self.is_open(provider_of(ic[1]), model_of(ic[1])),
+                                        self.score(provider_of(ic[1]), model_of(ic[1])), ic[0]))
+        return [c for _, c in ranked]
+
+    def order_models(self, provider, models):
+        return self.order(models, model_of=lambda m: m, provider_of=lambda m: provider)
+
+    def available(self, providers):
+        """Proveedores ordenados, sin los de circuito abierto (salvo que lo estén todos)."""
+        ordered = self.order(providers)
+        closed = [p for p in ordered if not self.is_open(p)]
+        return closed or ordered
+
+    def snapshot(self):
+        with self._lock:
+            return {f"{p}/{m}": dict(e) for (p, m), e in sorted(self._stats.items())}
+
+
+_instance = None
+_instance_lock = threading.Lock()
+
+
+def get_stats():
+    """Estadísticas compartidas del proceso (sobre el almacén de estado actual)."""
+    global _instance
+    store = state_store.get_store()
+    with _instance_lock:
+        if _instance is None or _instance.store is not store:
+            _instance = ProviderStats(store)
+        return _instance
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estadísticas de latencia y errores de los proveedores LLM.")
+    parser.add_argument("--reset", action="store_true", help="Borra las estadísticas acumuladas.")
+    args = parser.parse_args(argv)
+
+    if args.reset:
+        state_store.get_store().clear_provider_stats()
+        print(json.dumps({"status": "success", "message": "Estadísticas borradas."}))
+        return
+
+    stats = get_stats()
+    now = time.time()
+    result = {}
+    for key, entry in stats.snapshot().items():
+        provider, model = key.split("/", 1)
+        result[key] = {
+            "calls": entry["calls"],
+            "error_rate": round(entry["errors"] / entry["calls"], 3) if entry["calls"] else 0.0,
+            "rate_limited": entry["rate_limited"],
+            "ewma_latency": round(entry["ewma_latency"], 3) if entry["ewma_latency"] is not None else None,
+            "score": round(stats.score(provider, model), 3),
+            "circuit_open_for": max(0, round(entry["open_until"] - now)),
+        }
+    print(json.dumps({"status": "success", "stats": result}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
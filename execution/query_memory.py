@@ -1,58 +1,62 @@
 import argparse
 import json
+import os
 import sys
 from pathlib import Path
 
-try:
-    import chromadb
-except ImportError:
-    print("Error: Missing 'chromadb'.", file=sys.stderr)
-    sys.exit(10)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import memory_daemon
 
-def main():
+
+def main(argv=None):
     """
-    Queries the ChromaDB vector store for semantically similar memories.
+    Queries agent memory: semantic neighbours from ChromaDB, BM25 keyword matches
+    from the text index, or both fused with reciprocal rank fusion (default).
+    Uses the memory daemon when it is running and falls back to opening ChromaDB directly.
     """
     parser = argparse.ArgumentParser(description="Query agent memory.")
     parser.add_argument("--query", required=True, help="The question or topic to search for.")
     parser.add_argument("--n-results", type=int, default=3, help="Number of results to return.")
+    parser.add_argument("--mode", choices=memory_daemon.SEARCH_MODES, default=memory_daemon.SEARCH_MODE,
+                        help="vector (semantic), lexical (BM25 keywords) or hybrid (both, fused).")
+    parser.add_argument("--max-distance", type=float, default=memory_daemon.MAX_DISTANCE,
+                        help="Drop vector matches farther than this distance (0 = no cutoff).")
+    parser.add_argument("--min-match", type=float, default=memory_daemon.LEXICAL_MIN_MATCH,
+                        help="Drop keyword-only matches containing less than this fraction of the query terms.")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Path to ChromaDB.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
-    except Exception as e:
+        results = memory_daemon.call("query", db_path=args.db_path, query=args.query, n_results=args.n_results,
+                                     mode=args.mode, max_distance=args.max_distance, min_match=args.min_match)
+    except ImportError:
+        print("Error: Missing 'chromadb'.", file=sys.stderr)
+        sys.exit(10)
+    except memory_daemon.MemoryUnavailable as e:
         print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
         sys.exit(2)
-
-    try:
-        results = collection.query(
-            query_texts=[args.query],
-            n_results=args.n_results
-        )
-    except Exception as e:
+    except memory_daemon.MemoryServiceError as e:
         print(json.dumps({"status": "error", "message": str(e)}), file=sys.stderr)
         sys.exit(3)
 
     # Format results for easier reading by the LLM
     formatted_results = []
-    if results['documents']:
-        for i in range(len(results['documents'][0])):
-            doc = results['documents'][0][i]
-            meta = results['metadatas'][0][i] if results['metadatas'] else {}
-            dist = results['distances'][0][i] if results['distances'] else 0
-
-            formatted_results.append({
-                "content": doc,
-                "metadata": meta,
-                "relevance_distance": dist
-            })
+    for i, doc in enumerate(results['documents']):
+        formatted_results.append({
+            "id": results['ids'][i],
+            "content": doc,
+            "metadata": results['metadatas'][i] or {},
+            "relevance_distance": results['distances'][i],  # None for keyword-only matches
+            "score": results['scores'][i],
+            "matched_by": results['matched_by'][i]
+        })
 
     print(json.dumps({
         "status": "success",
         "query": args.query,
+        "mode": results['mode'],
+        "timings_ms": results['timings_ms'],
         "results": formatted_results
     }, indent=2))
 
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Planificador de recordatorios basado en un min-heap.
+
+Sustituye al escaneo del JSON de recordatorios en cada vuelta del listener:
+los recordatorios se cargan una sola vez, se ordenan por su próxima hora de
+disparo en un heap y un hilo de fondo duerme hasta el siguiente vencimiento.
+Solo se escribe cuando algo cambia (alta, baja o disparo), y solo la fila afectada.
+
+Formato de cada recordatorio (compatible con el antiguo telegram_reminders.json):
+    {"id": "...", "chat_id": "123", "message": "Tomar antibiótico",
+     "time": "08:00", "repeat": "daily" | "once", "date": "2026-03-01" (solo "once"),
+     "tz": "America/Caracas", "last_fired": 1767254400.0, "created_at": 1767250000.0}
+Los registros antiguos ({"time", "last_sent"}) se interpretan como diarios.
+"""
+import os
+import sys
+import time
+import uuid
+import heapq
+import datetime
+import threading
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+    ZoneInfoNotFoundError = Exception
+
+# Recordatorios cuya hora pasó mientras el bot estaba ocupado o apagado se envían
+# igualmente si no hace más de este tiempo (segundos). Los más antiguos se omiten.
+CATCH_UP_WINDOW = int(os.getenv("REMINDER_CATCH_UP_WINDOW", str(6 * 3600)))
+DEFAULT_TZ = os.getenv("TELEGRAM_TIMEZONE", "")
+
+
+def get_tz(name=None):
+    """Zona horaria por nombre IANA (p.ej. "America/Caracas"); la local del sistema si no hay."""
+    name = name or DEFAULT_TZ
+    if name and ZoneInfo:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            print(f"⚠️ [REMINDERS] Zona horaria desconocida '{name}'. Usando la local.", file=sys.stderr)
+    return datetime.datetime.now().astimezone().tzinfo
+
+
+def is_valid_tz(name):
+    if not ZoneInfo:
+        return False
+    try:
+        ZoneInfo(name)
+        return True
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+
+
+def _at(day, hhmm, tz):
+    hour, minute = [int(x) for x in hhmm.split(":")]
+    return datetime.datetime.combine(day, datetime.time(hour, minute), tzinfo=tz).timestamp()
+
+
+def next_occurrence(reminder, after):
+    """Primer instante (epoch) de disparo estrictamente posterior a `after`, o None si no hay más."""
+    tz = get_tz(reminder.get("tz"))
+    if reminder.get("repeat") == "once":
+        day = datetime.date.fromisoformat(reminder["date"])
+        fire = _at(day, reminder["time"], tz)
+        return fire if fire > after else None
+
+    day = datetime.datetime.fromtimestamp(after, tz).date()
+    fire = _at(day, reminder["time"], tz)
+    if fire <= after:
+        fire = _at(day + datetime.timedelta(days=1), reminder["time"], tz)
+    return fire
+
+
+def _anchor(reminder, now):
+    """Último instante ya cubierto: el último disparo, la creación o (por defecto) ahora."""
+    if reminder.get("last_fired"):
+        return float(reminder["last_fired"])
+    if reminder.get("last_sent"):
+        # Formato antiguo: fecha (YYYY-MM-DD) del último envío
+        try:
+            day = datetime.date.fromisoformat(reminder["last_sent"])
+            return _at(day, reminder["time"], get_tz(reminder.get("tz")))
+        except ValueError:
+            pass
+    if reminder.get("created_at"):
+        return float(reminder["created_at"])
+    return now
+
+
+class ReminderScheduler:
+    """
+    Heap de (próximo_disparo, secuencia, id). Las bajas se resuelven de forma perezosa:
+    una entrada del heap se descarta si su hora ya no coincide con self._next[id].
+
+    - load(): devuelve la lista de recordatorios guardados (se llama una sola vez).
+    - upsert(reminder): guarda un recordatorio nuevo o reprogramado.
+    - delete(reminder_id): borra un recordatorio.
+    - send(reminder): entrega el recordatorio (p.ej. vía telegram_tool.py).
+    """
+
+    def __init__(self, load, upsert, delete, send, clock=time.time, catch_up_window=CATCH_UP_WINDOW):
+        self._upsert = upsert
+        self._delete = delete
+        self._send = send
+        self._clock = clock
+        self.catch_up_window = catch_up_window
+        self._reminders = {}
+        self._next = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+        now = self._clock()
+        for reminder in load() or []:
+            if not reminder.get("id"):
+                reminder["id"] = uuid.uuid4().hex[:8]
+                self._upsert(reminder)
+            self._reminders[reminder["id"]] = reminder
+            if not self._schedule(reminder, now):
+                # Un "once" cuya hora ya pasó hace demasiado
+                del self._reminders[reminder["id"]]
+                self._delete(reminder["id"])
+
+    # --- Heap -------------------------------------------------------------
+
+    def _schedule(self, reminder, now):
+        """Calcula el próximo disparo (con recuperación de los perdidos). False si no hay más."""
+        after = max(_anchor(reminder, now), now - self.catch_up_window)
+        fire = next_occurrence(reminder, after)
+        if fire is None:
+            self._next.pop(reminder["id"], None)
+            return False
+        self._next[reminder["id"]] = fire
+        self._seq += 1
+        heapq.heappush(self._heap, (fire, self._seq, reminder["id"]))
+        return True
+
+    def next_fire_time(self):
+        """Hora (epoch) del próximo recordatorio vigente, o None."""
+        with self._cond:
+            while self._heap:
+                fire, _, rid = self._heap[0]
+                if self._next.get(rid) == fire:
+                    return fire
+                heapq.heappop(self._heap)
+            return None
+
+    # --- API pública ------------------------------------------------------
+
+    def add(self, chat_id, hhmm, message, tz=None, date=None):
+        """Añade un recordatorio diario (o de una sola vez si se indica `date`)."""
+        datetime.datetime.strptime(hhmm, "%H:%M")
+        if date:
+            datetime.date.fromisoformat(date)
+        now = self._clock()
+        reminder = {
+            "id": uuid.uuid4().hex[:8],
+            "chat_id": str(chat_id),
+            "time": hhmm,
+            "message": message,
+            "repeat": "once" if date else "daily",
+            "tz": tz or DEFAULT_TZ,
+            "created_at": now,
+            "last_fired": None,
+        }
+        if date:
+            reminder["date"] = date
+        with self._cond:
+            self._reminders[reminder["id"]] = reminder
+            if not self._schedule(reminder, now):
+                del self._reminders[reminder["id"]]
+                raise ValueError("La fecha y hora indicadas ya pasaron.")
+            self._upsert(reminder)
+            self._cond.notify()
+        return reminder
+
+    def remove_chat(self, chat_id):
+        """Elimina todos los recordatorios de un chat. Devuelve cuántos se borraron."""
+        with self._cond:
+            ids = [rid for rid, r in self._reminders.items() if r.get("chat_id") == str(chat_id)]
+            for rid in ids:
+                del self._reminders[rid]
+                self._next.pop(rid, None)
+                self._delete(rid)
+            if ids:
+                self._cond.notify()
+        return len(ids)
+
+    def list_chat(self, chat_id):
+        with self._cond:
+            return [dict(r, next_fire=self._next.get(rid)) for rid, r in self._reminders.items()
+                    if r.get("chat_id") == str(chat_id)]
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def run_due(self, now=None):
+        """Dispara todos los recordatorios vencidos. Devuelve la lista de disparados."""
+        now = self._clock() if now is None else now
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                fire, _, rid = heapq.heappop(self._heap)
+                if self._next.get(rid) != fire:
+                    continue  # entrada obsoleta (borrado o reprogramado)
+                reminder = self._reminders[rid]
+                reminder["last_fired"] = fire
+                reminder.pop("last_sent", None)
+                if self._schedule(reminder, now):
+                    self._upsert(reminder)
+                else:
+                    del self._reminders[rid]
+                    self._delete(rid)
+                due.append(dict(reminder))
+
+        for reminder in due:
+            try:
+                self._send(reminder)
+            except Exception as e:
+                print(f"❌ [REMINDERS] Error enviando recordatorio {reminder['id']}: {e}", file=sys.stderr)
+        return due
+
+    # --- Hilo de fondo ----------------------------------------------------
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                fire = self.next_fire_time()
+                delay = None if fire is None else max(0.0, fire - self._clock())
+                if delay is None or delay > 0:
+                    # Despertar como mucho cada minuto por si cambia la hora del sistema
+                    self._cond.wait(min(delay, 60) if delay is not None else 60)
+                    continue
+            self.run_due()
+
+    def start(self):
+        """Arranca el hilo que duerme hasta el próximo vencimiento."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="reminder-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
@@ -28,7 +28,7 @@ def print_error(message: str, details: str, exit_code: int):
     sys.exit(exit_code)
 
 
-def main():
+def main(argv=None):
     """
     Main function to research a topic using DuckDuckGo.
     Saves titles, URLs, and snippets to a text file.
@@ -39,7 +39,7 @@ def main():
     parser.add_argument("--query", required=True, help="The search query.")
     parser.add_argument("--output-file", required=True, help="Path to save the research results.")
     parser.add_argument("--max-results", type=int, default=10, help="Maximum number of results to fetch.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     query = args.query
     output_file = Path(args.output_file)
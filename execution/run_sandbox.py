@@ -3,6 +3,7 @@ import argparse
 import json
 import sys
 import os
+import signal
 
 try:
     import docker
@@ -77,7 +78,13 @@ def run_in_sandbox(code_to_run):
         if container:
             container.remove(force=True)
 
+def _exit_on_sigterm(signum, frame):
+    # Convertir SIGTERM (plazo vencido en el listener) en SystemExit para que el
+    # bloque finally de run_in_sandbox() elimine el contenedor.
+    sys.exit(124)
+
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
     parser = argparse.ArgumentParser(description="Ejecutar código Python en un sandbox de Docker.")
     parser.add_argument("--code", required=True, help="El código Python a ejecutar.")
     args = parser.parse_args()
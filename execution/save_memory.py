@@ -1,18 +1,20 @@
 import argparse
 import json
+import os
 import sys
+import time
 import uuid
 import datetime
 from pathlib import Path
 
-try:
-    import chromadb
-except ImportError:
-    print(
-        "Error: Missing required library 'chromadb'. Please install it with 'pip install chromadb'",
-        file=sys.stderr
-    )
-    sys.exit(10)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import memory_daemon
+
+MISSING_CHROMADB = "Error: Missing required library 'chromadb'. Please install it with 'pip install chromadb'"
+DEFAULT_BATCH_SIZE = 256
+# Namespace for deterministic bulk-import IDs (same category + text -> same ID)
+BULK_ID_NAMESPACE = uuid.UUID("5b0f4a8e-3c1d-4f6a-9e2b-7d8c1a0e4f53")
 
 
 def print_error(message: str, details: str, exit_code: int):
@@ -25,22 +27,110 @@ def print_error(message: str, details: str, exit_code: int):
     sys.exit(exit_code)
 
 
-def main():
+def bulk_memory_id(category: str, text: str) -> str:
+    return str(uuid.uuid5(BULK_ID_NAMESPACE, f"{category}\n{text}"))
+
+
+def iter_records(stream, default_category: str, errors: list):
+    """
+    Yields (id, text, metadata) for each JSONL line: {"text": ..., "category"?, "id"?,
+    "timestamp"?, "chat_id"?, "metadata"?: {...}}. Invalid lines are appended to
+    `errors` as (line_number, reason) and skipped.
+    """
+    now = datetime.datetime.now().isoformat()
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"text": record}
+            text = record.get("text") if isinstance(record, dict) else None
+            if not isinstance(text, str) or not text.strip():
+                raise ValueError("missing 'text'")
+        except ValueError as e:
+            errors.append((line_number, str(e)))
+            continue
+        category = str(record.get("category") or default_category)
+        extra = record.get("metadata")
+        metadata = {key: value for key, value in (extra if isinstance(extra, dict) else {}).items()
+                    if isinstance(value, (str, int, float, bool))}
+        metadata.update({"category": category, "timestamp": str(record.get("timestamp") or now),
+                         "source": "bulk_import"})
+        if record.get("chat_id") is not None:
+            metadata["chat_id"] = str(record["chat_id"])
+        yield str(record.get("id") or bulk_memory_id(category, text)), text, metadata
+
+
+def ingest(records, db_path: str, batch_size: int = DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Adds records in batches (one embedding call per batch), skipping IDs that are
+    already stored so re-running an import is idempotent. Returns the counters.
+    """
+    stats = {"ingested": 0, "skipped": 0, "batches": 0}
+    started = time.monotonic()
+
+    def flush(batch):
+        result = memory_daemon.call(
+            "add",
+            db_path=db_path,
+            ids=list(batch),
+            documents=[text for text, _ in batch.values()],
+            metadatas=[metadata for _, metadata in batch.values()],
+            skip_existing=True
+        )
+        stats["ingested"] += len(result["ids"])
+        stats["skipped"] += result["skipped"]
+        stats["batches"] += 1
+        if progress:
+            progress(stats, time.monotonic() - started)
+
+    batch = {}
+    for memory_id, text, metadata in records:
+        if memory_id in batch:
+            stats["skipped"] += 1  # same note twice in the same batch
+            continue
+        batch[memory_id] = (text, metadata)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = {}
+    if batch:
+        flush(batch)
+
+    elapsed = time.monotonic() - started
+    stats["elapsed_seconds"] = round(elapsed, 2)
+    stats["notes_per_second"] = round(stats["ingested"] / elapsed, 1) if elapsed > 0 else 0.0
+    return stats
+
+
+def print_progress(stats, elapsed):
+    rate = stats["ingested"] / elapsed if elapsed > 0 else 0.0
+    print(f"📥 [MEMORY] Batch {stats['batches']}: {stats['ingested']} saved, {stats['skipped']} already present "
+          f"({rate:.0f} notes/s)", file=sys.stderr)
+
+
+def main(argv=None):
     """
     Saves a text snippet to the local ChromaDB vector store.
-    Generates a unique ID and timestamps the entry.
+    Generates a unique ID and timestamps the entry. Uses the memory daemon
+    when it is running and falls back to opening ChromaDB directly.
+
+    With --file (a JSONL path, or '-' for stdin) it bulk-imports one note per
+    line in batches, with deterministic IDs so the import can be re-run safely.
     """
     parser = argparse.ArgumentParser(description="Save a memory to ChromaDB.")
-    parser.add_argument("--text", required=True, help="The content to remember.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--text", help="The content to remember.")
+    source.add_argument("--file", help="JSONL file to import ('-' for stdin), one {\"text\": ...} per line.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Notes per batch with --file.")
     parser.add_argument("--category", default="general", help="Category tag (e.g., error_fix, preference).")
+    parser.add_argument("--chat-id", help="Chat the memory was saved from (list_memories.py --chat-id).")
     parser.add_argument("--db-path", default=".tmp/chroma_db", help="Path to ChromaDB.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    try:
-        client = chromadb.PersistentClient(path=args.db_path)
-        collection = client.get_or_create_collection(name="agent_memory")
-    except Exception as e:
-        print_error("Database Error: Failed to connect to ChromaDB.", str(e), 2)
+    if args.file:
+        bulk_import(args)
+        return
 
     # Generate unique ID and metadata
     memory_id = str(uuid.uuid4())
@@ -51,14 +141,24 @@ def main():
         "timestamp": timestamp,
         "source": "user_input"
     }
+    if args.chat_id:
+        metadata["chat_id"] = args.chat_id
 
     try:
-        collection.add(
+        # Via the memory daemon when it is running (embedding model already loaded)
+        memory_daemon.call(
+            "add",
+            db_path=args.db_path,
             documents=[args.text],
             metadatas=[metadata],
             ids=[memory_id]
         )
-    except Exception as e:
+    except ImportError:
+        print(MISSING_CHROMADB, file=sys.stderr)
+        sys.exit(10)
+    except memory_daemon.MemoryUnavailable as e:
+        print_error("Database Error: Failed to connect to ChromaDB.", str(e), 2)
+    except memory_daemon.MemoryServiceError as e:
         print_error("Storage Error: Failed to save memory.", str(e), 3)
 
     output_data = {
@@ -71,5 +171,37 @@ def main():
     sys.exit(0)
 
 
+def bulk_import(args):
+    errors = []
+    if args.file == "-":
+        stream = sys.stdin
+    else:
+        try:
+            stream = open(args.file, encoding="utf-8")
+        except OSError as e:
+            print_error("Input Error: Failed to open the JSONL file.", str(e), 1)
+
+    try:
+        records = iter_records(stream, args.category, errors)
+        if args.chat_id:
+            records = ((memory_id, text, {"chat_id": args.chat_id, **metadata})
+                       for memory_id, text, metadata in records)
+        stats = ingest(records, args.db_path, max(1, args.batch_size), progress=print_progress)
+    except ImportError:
+        print(MISSING_CHROMADB, file=sys.stderr)
+        sys.exit(10)
+    except memory_daemon.MemoryUnavailable as e:
+        print_error("Database Error: Failed to connect to ChromaDB.", str(e), 2)
+    except memory_daemon.MemoryServiceError as e:
+        print_error("Storage Error: Failed to save memories.", str(e), 3)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+    for line_number, reason in errors[:10]:
+        print(f"⚠️ [MEMORY] Line {line_number} skipped: {reason}", file=sys.stderr)
+    print(json.dumps({"status": "success", **stats, "invalid_lines": len(errors)}, indent=2))
+
+
 if __name__ == "__main__":
     main()
@@ -5,11 +5,11 @@ import sys
 import requests
 from bs4 import BeautifulSoup
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Scrape text from a website.")
     parser.add_argument("--url", required=True, help="URL to scrape.")
     parser.add_argument("--output-file", required=True, help="Output file path.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     try:
         headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
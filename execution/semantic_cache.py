@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Caché semántica de respuestas LLM (opcional).
+
+Muchos alumnos preguntan lo mismo con otras palabras. Con LLM_SEMANTIC_CACHE=1
+(o `--semantic-cache`) chat_with_llm.py busca la pregunta entre las ya
+respondidas, en la colección ChromaDB `llm_semantic_cache` (junto a
+`agent_memory`), y si la similitud coseno supera LLM_SEMANTIC_CACHE_THRESHOLD
+devuelve la respuesta guardada sin llamar al LLM.
+
+- Ámbito: cada entrada pertenece a una persona y un idioma; una respuesta en
+  inglés o con otra personalidad nunca se reutiliza fuera de su ámbito.
+- Invalidación: cada entrada guarda los IDs y un hash del contenido de los
+  recuerdos que se inyectaron al generarla. Si alguno se ha borrado o cambiado,
+  la entrada se descarta al consultarla.
+- Caducidad: la misma que la caché exacta (LLM_CACHE_TTL).
+- Los prompts de menos de LLM_SEMANTIC_CACHE_MIN_CHARS caracteres ("¿por qué?",
+  "sigue") dependen de la conversación y no se cachean. Por lo mismo,
+  chat_with_llm.py no la consulta cuando la sesión ya tiene historial.
+
+Uso:
+    python execution/semantic_cache.py          # muestra tamaño y aciertos/fallos
+    python execution/semantic_cache.py --clear  # vacía la colección
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import state_store
+import llm_cache
+
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "chroma_db")
+COLLECTION = "llm_semantic_cache"
+MEMORY_COLLECTION = "agent_memory"
+SEMANTIC_CACHE_ENABLED = os.getenv("LLM_SEMANTIC_CACHE", "0") == "1"
+THRESHOLD = float(os.getenv("LLM_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+MIN_CHARS = int(os.getenv("LLM_SEMANTIC_CACHE_MIN_CHARS", "20"))
+HITS = "semantic_cache.hits"
+MISSES = "semantic_cache.misses"
+
+
+def scope_key(persona, language):
+    """Ámbito de una entrada: hash de la persona + idioma ('es', 'en'...)."""
+    persona_hash = hashlib.sha256((persona or "").encode("utf-8")).hexdigest()[:16]
+    return f"{persona_hash}:{(language or 'es').lower()}"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class SemanticCache:
+
+    def __init__(self, collection, memory_collection=None, store=None, threshold=THRESHOLD,
+                 ttl=llm_cache.CACHE_TTL, min_chars=MIN_CHARS, clock=time.time):
+        self.collection = collection
+        self.memory_collection = memory_collection
+        self.store = store
+        self.threshold = threshold
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self._clock = clock
+
+    def _count(self, name):
+        if self.store:
+            try:
+                self.store.incr_counter(name)
+            except Exception:
+                pass
+
+    def _sources_valid(self, metadata):
+        sources = json.loads(metadata.get("sources") or "[]")
+        if not sources:
+            return True
+        if self.memory_collection is None:
+            return False
+        found = self.memory_collection.get(ids=[memory_id for memory_id, _ in sources], include=["documents"])
+        current = dict(zip(found["ids"], found["documents"]))
+        return all(memory_id in current and content_hash(current[memory_id]) == digest
+                   for memory_id, digest in sources)
+
+    def lookup(self, prompt, scope):
+        """Respuesta guardada para una pregunta equivalente del mismo ámbito, o None."""
+        if len(prompt.strip()) < self.min_chars:
+            return None
+        try:
+            results = self.collection.query(query_texts=[prompt], n_results=1, where={"scope": scope},
+                                            include=["metadatas", "distances"])
+            ids = results["ids"][0]
+            if not ids:
+                self._count(MISSES)
+                return None
+            entry_id, metadata = ids[0], results["metadatas"][0][0]
+            similarity = 1.0 - results["distances"][0][0]
+            if metadata.get("created_at", 0) < self._clock() - self.ttl:
+                self.collection.delete(ids=[entry_id])
+                self._count(MISSES)
+                return None
+            if similarity < self.threshold:
+                self._count(MISSES)
+                return None
+            if not self._sources_valid(metadata):
+                print("🔄 [SEMANTIC] Los recuerdos de la respuesta guardada han cambiado; se descarta.", file=sys.stderr)
+                self.collection.delete(ids=[entry_id])
+                self._count(MISSES)
+                return None
+        except Exception as e:
+            print(f"⚠️ [SEMANTIC] Error consultando la caché semántica: {e}", file=sys.stderr)
+            return None
+        self._count(HITS)
+        print(f"⚡ [SEMANTIC] Pregunta equivalente ya respondida (similitud {similarity:.2f}).", file=sys.stderr)
+        return metadata["answer"]
+
+    def put(self, prompt, scope, answer, sources=()):
+        """Guarda la respuesta; sources = [(id_recuerdo, contenido)] de la memoria inyectada."""
+        if len(prompt.strip()) < self.min_chars:
+            return
+        entry_id = hashlib.sha256(f"{scope}\n{prompt}".encode("utf-8")).hexdigest()
+        metadata = {
+            "scope": scope,
+            "answer": answer,
+            "sources": json.dumps([[memory_id, content_hash(text)] for memory_id, text in sources]),
+            "created_at": self._clock(),
+        }
+        try:
+            self.collection.upsert(ids=[entry_id], documents=[prompt], metadatas=[metadata])
+        except Exception as e:
+            print(f"⚠️ [SEMANTIC] Error guardando en la caché semántica: {e}", file=sys.stderr)
+
+    def stats(self):
+        result = {"entries": self.collection.count(), "threshold": self.threshold}
+        if self.store:
+            hits, misses = self.store.get_counter(HITS), self.store.get_counter(MISSES)
+            result.update({"hits": hits, "misses": misses,
+                           "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0})
+        return result
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_semantic_cache(db_path=DB_PATH):
+    """
+    Caché semántica sobre la base ChromaDB de la memoria (None si ChromaDB no está
+    disponible). El cliente y las colecciones (con su modelo de embeddings) se abren
+    una vez por proceso y base de datos, no en cada consulta.
+    """
+    key = os.path.abspath(db_path)
+    with _caches_lock:
+        if _caches.get(key) is None:
+            _caches[key] = _open_semantic_cache(db_path)
+        return _caches[key]
+
+
+def _open_semantic_cache(db_path):
+    try:
+        import chromadb  # pesado: solo se importa si la caché semántica está activa
+    except ImportError:
+        return None
+    try:
+        client = chromadb.PersistentClient(path=db_path)
+        collection = client.get_or_create_collection(name=COLLECTION, metadata={"hnsw:space": "cosine"})
+        memory = client.get_or_create_collection(name=MEMORY_COLLECTION)
+    except Exception as e:
+        print(f"⚠️ [SEMANTIC] No se pudo abrir ChromaDB: {e}", file=sys.stderr)
+        return None
+    return SemanticCache(collection, memory, store=state_store.get_store())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caché semántica de respuestas LLM.")
+    parser.add_argument("--clear", action="store_true", help="Vacía la colección y reinicia los contadores.")
+    args = parser.parse_args(argv)
+
+    cache = get_semantic_cache()
+    if not cache:
+        print(json.dumps({"status": "error", "message": "ChromaDB no disponible."}))
+        sys.exit(1)
+    if args.clear:
+        ids = cache.collection.get(include=[])["ids"]
+        if ids:
+            cache.collection.delete(ids=ids)
+        state_store.get_store().reset_counters("semantic_cache.")
+        print(json.dumps({"status": "success", "message": "Caché semántica vaciada."}))
+        return
+    print(json.dumps({"status": "success", "cache": cache.stats()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Almacén de estado del agente en SQLite (.tmp/agent_state.db).
+
+Sustituye a los archivos sueltos de .tmp/ que se releían y reescribían en cada
+mensaje (telegram_users.txt, telegram_reminders.json, telegram_config.json,
+telegram_persona.txt, telegram_offset.txt y chat_history.json).
+
+- Modo WAL: lectores y escritor no se bloquean entre sí (el listener, las
+  herramientas en subproceso y telegram_broadcast.py pueden abrirlo a la vez).
+- Caché en memoria de usuarios y ajustes: las lecturas por mensaje (persona,
+  idioma, ¿usuario ya registrado?) no tocan el disco. La caché es por proceso;
+  el proceso que escribe (el listener) siempre la mantiene al día.
+- Índices por chat para recordatorios, ajustes por chat e historial.
+
+La primera vez que se abre importa los archivos antiguos y los renombra a
+`<nombre>.migrated`.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+TMP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp")
+DB_PATH = os.getenv("AGENT_STATE_DB", os.path.join(TMP_DIR, "agent_state.db"))
+DEFAULT_SESSION = "default"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    chat_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chat_settings (
+    chat_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chat_id, key)
+);
+CREATE TABLE IF NOT EXISTS reminders (
+    id TEXT PRIMARY KEY,
+    chat_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reminders_chat ON reminders (chat_id);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_session ON history (session, id);
+CREATE TABLE IF NOT EXISTS history_summaries (
+    session TEXT PRIMARY KEY,
+    upto_id INTEGER NOT NULL,
+    summary TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS provider_stats (
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (provider, model)
+);
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache (created_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# Archivos antiguos que se migran una sola vez
+LEGACY_FILES = {
+    "users": "telegram_users.txt",
+    "reminders": "telegram_reminders.json",
+    "config": "telegram_config.json",
+    "persona": "telegram_persona.txt",
+    "offset": "telegram_offset.txt",
+    "history": "chat_history.json",
+}
+
+
+class StateStore:
+    """Acceso al estado con una sola conexión protegida por un lock (segura entre hilos)."""
+
+    def __init__(self, path=DB_PATH, legacy_dir=TMP_DIR):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._users = None
+        self._settings = None
+        self._chat_settings = {}
+        if legacy_dir:
+            self._migrate(legacy_dir)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _write(self, statements):
+        """Ejecuta varias sentencias en una transacción."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    if params and isinstance(params, list):
+                        self._conn.executemany(sql, params)
+                    else:
+                        self._conn.execute(sql, params or ())
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- Usuarios ---------------------------------------------------------
+
+    def _load_users(self):
+        if self._users is None:
+            rows = self._conn.execute("SELECT chat_id FROM users ORDER BY rowid").fetchall()
+            self._users = {row[0]: None for row in rows}  # dict: conserva el orden de registro
+        return self._users
+
+    def add_user(self, chat_id):
+        """Registra un chat para los broadcasts. Devuelve True si es nuevo."""
+        chat_id = str(chat_id)
+        with self._lock:
+            if chat_id in self._load_users():
+                return False
+            self._write([("INSERT OR IGNORE INTO users (chat_id, created_at) VALUES (?, ?)", (chat_id, time.time()))])
+            self._users[chat_id] = None
+            return True
+
+    def list_users(self):
+        with self._lock:
+            return list(self._load_users())
+
+    # --- Ajustes globales y por chat --------------------------------------
+
+    def _load_settings(self):
+        if self._settings is None:
+            rows = self._conn.execute("SELECT key, value FROM settings").fetchall()
+            self._settings = {key: json.loads(value) for key, value in rows}
+        return self._settings
+
+    def get_setting(self, key, default=None):
+        with self._lock:
+            return self._load_settings().get(key, default)
+
+    def set_setting(self, key, value):
+        with self._lock:
+            self._write([("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value)))])
+            self._load_settings()[key] = value
+
+    def _load_chat_settings(self, chat_id):
+        if chat_id not in self._chat_settings:
+            rows = self._conn.execute("SELECT key, value FROM chat_settings WHERE chat_id = ?", (chat_id,)).fetchall()
+            self._chat_settings[chat_id] = {key: json.loads(value) for key, value in rows}
+        return self._chat_settings[chat_id]
+
+    def get_chat_setting(self, chat_id, key, default=None):
+        with self._lock:
+            return self._load_chat_settings(str(chat_id)).get(key, default)
+
+    def set_chat_setting(self, chat_id, key, value):
+        chat_id = str(chat_id)
+        with self._lock:
+            self._write([("INSERT OR REPLACE INTO chat_settings (chat_id, key, value) VALUES (?, ?, ?)",
+                          (chat_id, key, json.dumps(value)))])
+            self._load_chat_settings(chat_id)[key] = value
+
+    # --- Recordatorios ----------------------------------------------------
+
+    def load_reminders(self, chat_id=None):
+        with self._lock:
+            if chat_id is None:
+                rows = self._conn.execute("SELECT data FROM reminders ORDER BY rowid").fetchall()
+            else:
+                rows = self._conn.execute("SELECT data FROM reminders WHERE chat_id = ? ORDER BY rowid",
+                                          (str(chat_id),)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def upsert_reminder(self, reminder):
+        """Guarda (o actualiza) un solo recordatorio."""
+        # ON CONFLICT en vez de REPLACE: la fila conserva su rowid (y su orden en load_reminders)
+        self._write([("INSERT INTO reminders (id, chat_id, data) VALUES (?, ?, ?) "
+                      "ON CONFLICT (id) DO UPDATE SET chat_id = excluded.chat_id, data = excluded.data",
+                      (reminder["id"], str(reminder.get("chat_id", "")), json.dumps(reminder, ensure_ascii=False)))])
+
+    def delete_reminder(self, reminder_id):
+        self._write([("DELETE FROM reminders WHERE id = ?", (reminder_id,))])
+
+    def save_reminders(self, reminders):
+        """
+        Reemplaza la lista completa (importaciones y migraciones puntuales). En el día a
+        día ReminderScheduler solo escribe la fila que cambia (upsert_reminder/delete_reminder).
+        """
+        rows = [(r["id"], str(r.get("chat_id", "")), json.dumps(r, ensure_ascii=False)) for r in reminders]
+        statements = [("DELETE FROM reminders", None)]
+        if rows:
+            statements.append(("INSERT INTO reminders (id, chat_id, data) VALUES (?, ?, ?)", rows))
+        self._write(statements)
+
+    # --- Historial de conversación ----------------------------------------
+
+    def history_tail(self, session=DEFAULT_SESSION, limit=10):
+        """Últimos `limit` mensajes de la sesión, en orden cronológico."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM history WHERE session = ? ORDER BY id DESC LIMIT ?",
+                (session, limit)).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def history_since(self, session=DEFAULT_SESSION, after_id=0, limit=200):
+        """Mensajes posteriores a after_id (los `limit` más recientes), con su id, en orden cronológico."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, role, content FROM history WHERE session = ? AND id > ? ORDER BY id DESC LIMIT ?",
+                (session, after_id, limit)).fetchall()
+        return [{"id": row_id, "role": role, "content": content} for row_id, role, content in reversed(rows)]
+
+    def history_before(self, session=DEFAULT_SESSION, after_id=0, before_id=None, limit=200):
+        """Mensajes con after_id < id < before_id (los `limit` más antiguos), con su id, en orden cronológico."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, role, content FROM history WHERE session = ? AND id > ? AND id < ? ORDER BY id LIMIT ?",
+                (session, after_id, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+        return [{"id": row_id, "role": role, "content": content} for row_id, role, content in rows]
+
+    def get_history_summary(self, session=DEFAULT_SESSION):
+        """(último id resumido, resumen) de la sesión; (0, "") si aún no hay resumen."""
+        with self._lock:
+            row = self._conn.execute("SELECT upto_id, summary FROM history_summaries WHERE session = ?",
+                                     (session,)).fetchone()
+        return (row[0], row[1]) if row else (0, "")
+
+    def set_history_summary(self, session, upto_id, summary):
+        self._write([("INSERT OR REPLACE INTO history_summaries (session, upto_id, summary, updated_at) "
+                      "VALUES (?, ?, ?, ?)", (session, upto_id, summary, time.time()))])
+
+    def append_history(self, messages, session=DEFAULT_SESSION):
+        now = time.time()
+        rows = [(session, m["role"], m["content"], now) for m in messages]
+        if rows:
+            self._write([("INSERT INTO history (session, role, content, created_at) VALUES (?, ?, ?, ?)", rows)])
+
+    def clear_history(self, session=DEFAULT_SESSION):
+        self._write([("DELETE FROM history WHERE session = ?", (session,)),
+                     ("DELETE FROM history_summaries WHERE session = ?", (session,))])
+
+    # --- Estadísticas de proveedores LLM (ver provider_stats.py) ------------
+
+    def load_provider_stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT provider, model, data FROM provider_stats").fetchall()
+        return {(provider, model): json.loads(data) for provider, model, data in rows}
+
+    def save_provider_stats(self, provider, model, data):
+        self._write([("INSERT OR REPLACE INTO provider_stats (provider, model, data) VALUES (?, ?, ?)",
+                      (provider, model, json.dumps(data)))])
+
+    def clear_provider_stats(self):
+        self._write([("DELETE FROM provider_stats", None)])
+
+    # --- Caché de respuestas LLM (ver llm_cache.py) -------------------------
+
+    def cache_lookup(self, keys, not_before, now=None):
+        """Primera clave de `keys` (en ese orden) con respuesta creada después de not_before; marca su uso."""
+        if not keys:
+            return None
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, provider, content FROM llm_cache WHERE key IN ({placeholders}) AND created_at >= ?",
+                (*keys, not_before)).fetchall()
+        found = {key: (provider, content) for key, provider, content in rows}
+        for key in keys:
+            if key in found:
+                self._write([("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now or time.time(), key))])
+                return found[key]
+        return None
+
+    def cache_put(self, key, provider, model, content, max_entries, not_before, now=None):
+        """Guarda una respuesta, purga las caducadas y recorta a las max_entries usadas más recientemente."""
+        now = now or time.time()
+        self._write([
+            ("INSERT OR REPLACE INTO llm_cache (key, provider, model, content, created_at, last_used) "
+             "VALUES (?, ?, ?, ?, ?, ?)", (key, provider, model, content, now, now)),
+            ("DELETE FROM llm_cache WHERE created_at < ?", (not_before,)),
+            ("DELETE FROM llm_cache WHERE key IN "
+             "(SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (max_entries,)),
+        ])
+
+    def cache_size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def clear_cache(self):
+        self._write([("DELETE FROM llm_cache", None)])
+
+    # --- Contadores -------------------------------------------------------
+
+    def incr_counter(self, name, amount=1):
+        self._write([("INSERT INTO counters (name, value) VALUES (?, ?) "
+                      "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, amount))])
+
+    def get_counter(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def reset_counters(self, prefix):
+        self._write([("DELETE FROM counters WHERE name LIKE ?", (prefix + "%",))])
+
+    # --- Migración --------------------------------------------------------
+
+    def _migrate(self, legacy_dir):
+        """Importa (una sola vez) los archivos antiguos de .tmp/ y los renombra a *.migrated."""
+        paths = {kind: os.path.join(legacy_dir, name) for kind, name in LEGACY_FILES.items()}
+        present = {kind: path for kind, path in paths.items() if os.path.exists(path)}
+        if not present:
+            return
+
+        statements = []
+        try:
+            if "users" in present:
+                with open(present["users"], 'r') as f:
+                    users = [line.strip() for line in f if line.strip()]
+                now = time.time()
+                statements.append(("INSERT OR IGNORE INTO users (chat_id, created_at) VALUES (?, ?)",
+                                   [(u, now + i * 1e-6) for i, u in enumerate(dict.fromkeys(users))]))
+            settings = {}
+            chat_settings = []
+            if "config" in present:
+                with open(present["config"], 'r') as f:
+                    config = json.load(f)
+                for chat_id, tz_name in (config.pop("timezones", None) or {}).items():
+                    chat_settings.append((str(chat_id), "timezone", json.dumps(tz_name)))
+                settings.update(config)
+            if "persona" in present:
+                with open(present["persona"], 'r') as f:
+                    settings["persona"] = f.read().strip()
+            if "offset" in present:
+                with open(present["offset"], 'r') as f:
+                    settings["telegram_offset"] = int(f.read().strip() or 0)
+            if settings:
+                statements.append(("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                   [(k, json.dumps(v)) for k, v in settings.items()]))
+            if chat_settings:
+                statements.append(("INSERT OR REPLACE INTO chat_settings (chat_id, key, value) VALUES (?, ?, ?)",
+                                   chat_settings))
+            if "reminders" in present:
+                with open(present["reminders"], 'r') as f:
+                    reminders = json.load(f)
+                rows = []
+                for r in reminders:
+                    r.setdefault("id", uuid.uuid4().hex[:8])
+                    rows.append((r["id"], str(r.get("chat_id", "")), json.dumps(r, ensure_ascii=False)))
+                if rows:
+                    statements.append(("INSERT OR REPLACE INTO reminders (id, chat_id, data) VALUES (?, ?, ?)", rows))
+            if "history" in present:
+                with open(present["history"], 'r', encoding='utf-8') as f:
+                    history = json.load(f)
+                now = time.time()
+                rows = [(DEFAULT_SESSION, m["role"], m["content"], now) for m in history
+                        if isinstance(m, dict) and "role" in m and "content" in m]
+                if rows:
+                    statements.append(("INSERT INTO history (session, role, content, created_at) VALUES (?, ?, ?, ?)", rows))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"⚠️ [STATE] No se pudieron migrar los archivos antiguos: {e}", file=sys.stderr)
+            return
+
+        self._write([s for s in statements if s[1]])
+        for path in present.values():
+            try:
+                os.replace(path, path + ".migrated")
+            except OSError:
+                pass  # otro proceso ya lo migró
+        print(f"📦 [STATE] Migrados a SQLite: {', '.join(os.path.basename(p) for p in present.values())}", file=sys.stderr)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path=None):
+    """Instancia compartida por proceso (una por ruta de base de datos)."""
+    path = path or DB_PATH
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = StateStore(path)
+        return _stores[path]
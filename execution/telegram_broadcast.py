@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Motor de difusión (/broadcast) con límite de velocidad.
+
+Envía un mismo mensaje a muchos chats desde varios hilos que comparten la sesión
+keep-alive de telegram_tool.py, respetando los límites de Telegram:
+  - Global: ~30 mensajes por segundo (TELEGRAM_BROADCAST_RATE).
+  - Por chat: 1 mensaje por segundo en privados y ~20 por minuto en grupos.
+  - 429 Too Many Requests: se pausa todo el envío durante `retry_after` y se reintenta.
+
+El progreso se guarda en un checkpoint (.tmp/telegram_broadcast.json). Si el
+proceso se detiene a mitad, Broadcast.resume() continúa con los chats pendientes.
+La entrega es "al menos una vez": tras una caída pueden repetirse los últimos
+CHECKPOINT_EVERY envíos no guardados aún.
+
+Uso:
+    python execution/telegram_broadcast.py --message "Mañana no hay clase"
+    python execution/telegram_broadcast.py --resume
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import argparse
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import state_store
+import telegram_tool
+from telegram_tool import TelegramAPIError
+
+TMP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp")
+CHECKPOINT_FILE = os.path.join(TMP_DIR, "telegram_broadcast.json")
+
+GLOBAL_RATE = float(os.getenv("TELEGRAM_BROADCAST_RATE", "30"))
+WORKERS = int(os.getenv("TELEGRAM_BROADCAST_WORKERS", "8"))
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0  # ~20 mensajes por minuto
+MAX_ATTEMPTS = 3           # errores de red / 5xx antes de dar un chat por fallido
+MAX_RATE_LIMITED = 10      # 429 seguidos en un mismo chat antes de darlo por fallido
+CHECKPOINT_EVERY = 20
+PROGRESS_INTERVAL = 15.0
+
+
+class RateLimiter:
+    """Reparte turnos espaciados 1/rate segundos entre todos los hilos; pause() retrasa todos los turnos."""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate
+        self._clock = clock
+        self._sleep = sleep
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self._clock()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            self._sleep(slot - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next = max(self._next, self._clock() + seconds)
+
+
+def chat_interval(chat_id):
+    """Separación mínima entre mensajes a un mismo chat (los grupos tienen id negativo)."""
+    return GROUP_CHAT_INTERVAL if str(chat_id).startswith("-") else PRIVATE_CHAT_INTERVAL
+
+
+def load_users(path=None):
+    """Usuarios registrados en el almacén de estado, o los de un archivo (un chat ID por línea)."""
+    if not path:
+        return state_store.get_store().list_users()
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class Broadcast:
+    """
+    Una difusión: texto + destinatarios + resultados por chat.
+
+    - send(chat_id, text): entrega un mensaje; lanza TelegramAPIError si Telegram lo rechaza.
+    - on_progress(progress): se llama como mucho cada PROGRESS_INTERVAL segundos.
+    - notify(chat_id, text): avisos al administrador dentro del mismo límite de velocidad.
+    """
+
+    def __init__(self, text, recipients, send=None, rate=GLOBAL_RATE, workers=WORKERS,
+                 checkpoint_path=CHECKPOINT_FILE, on_progress=None, progress_interval=PROGRESS_INTERVAL,
+                 results=None, broadcast_id=None, started_at=None):
+        self.id = broadcast_id or uuid.uuid4().hex[:8]
+        self.text = text
+        # Sin duplicados y en el orden de registro
+        self.recipients = list(dict.fromkeys(str(r) for r in recipients if str(r).strip()))
+        self.results = dict(results or {})
+        self.started_at = started_at or time.time()
+        self.workers = max(1, workers)
+        self.checkpoint_path = checkpoint_path
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.limiter = RateLimiter(rate)
+        self.rate_limited = 0
+        self._send = send or telegram_tool.deliver_message
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._chat_next = {}
+        self._unsaved = 0
+        self._last_progress = time.monotonic()
+        self._elapsed = 0.0
+
+    @classmethod
+    def resume(cls, checkpoint_path=CHECKPOINT_FILE, **kwargs):
+        """Reconstruye la difusión interrumpida del checkpoint (None si no hay ninguna pendiente)."""
+        if not os.path.exists(checkpoint_path):
+            return None
+        try:
+            with open(checkpoint_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(state["text"], state["recipients"], checkpoint_path=checkpoint_path,
+                   results=state.get("results"), broadcast_id=state.get("id"),
+                   started_at=state.get("started_at"), **kwargs)
+
+    # --- Estado -----------------------------------------------------------
+
+    def pending(self):
+        return [uid for uid in self.recipients if uid not in self.results]
+
+    def progress(self):
+        with self._lock:
+            sent = sum(1 for r in self.results.values() if r == "sent")
+            return {
+                "id": self.id,
+                "total": len(self.recipients),
+                "done": len(self.results),
+                "sent": sent,
+                "failed": len(self.results) - sent,
+                "rate_limited": self.rate_limited,
+            }
+
+    def summary(self):
+        result = self.progress()
+        failures = {uid: r for uid, r in self.results.items() if r != "sent"}
+        result.update({
+            "status": "cancelled" if self._cancelled.is_set() else "completed",
+            "pending": result["total"] - result["done"],
+            "elapsed": round(self._elapsed, 2),
+            "per_second": round(result["done"] / self._elapsed, 1) if self._elapsed else 0.0,
+            "failures": dict(list(failures.items())[:20]),
+        })
+        return result
+
+    def save_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        with self._lock:
+            state = {"id": self.id, "text": self.text, "recipients": self.recipients,
+                     "results": dict(self.results), "started_at": self.started_at}
+            self._unsaved = 0
+        os.makedirs(os.path.dirname(self.checkpoint_path), exist_ok=True)
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _record(self, chat_id, result):
+        with self._lock:
+            self.results[chat_id] = result
+            self._unsaved += 1
+            flush = self._unsaved >= CHECKPOINT_EVERY
+            report = self.on_progress and time.monotonic() - self._last_progress >= self.progress_interval
+            if report:
+                self._last_progress = time.monotonic()
+        if flush:
+            self.save_checkpoint()
+        if report:
+            try:
+                self.on_progress(self.progress())
+            except Exception as e:
+                print(f"⚠️ [BROADCAST] Error notificando progreso: {e}", file=sys.stderr)
+
+    # --- Envío ------------------------------------------------------------
+
+    def _wait_for_chat(self, chat_id):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._chat_next.get(chat_id, 0.0))
+            self._chat_next[chat_id] = slot + chat_interval(chat_id)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _deliver(self, chat_id):
+        errors = 0
+        throttled = 0
+        while not self._cancelled.is_set():
+            self._wait_for_chat(chat_id)
+            self.limiter.acquire()
+            if self._cancelled.is_set():
+                return
+            try:
+                self._send(chat_id, self.text)
+                self._record(chat_id, "sent")
+                return
+            except TelegramAPIError as e:
+                if e.retry_after:
+                    # 429: Telegram indica cuánto esperar; frenamos a todos los hilos
+                    throttled += 1
+                    with self._lock:
+                        self.rate_limited += 1
+                    print(f"⏳ [BROADCAST] 429, esperando {e.retry_after} s.", file=sys.stderr)
+                    self.limiter.pause(e.retry_after)
+                    if throttled < MAX_RATE_LIMITED:
+                        continue
+                elif e.error_code and e.error_code < 500:
+                    # 400/403: chat inexistente, bot bloqueado... no tiene sentido reintentar
+                    self._record(chat_id, f"error {e.error_code}: {e}")
+                    return
+                errors += 1
+                error = f"error {e.error_code}: {e}"
+            except Exception as e:
+                errors += 1
+                error = str(e)
+            if errors >= MAX_ATTEMPTS or throttled >= MAX_RATE_LIMITED:
+                self._record(chat_id, error if errors else "error 429: demasiados reintentos")
+                return
+            time.sleep(min(2 ** errors, 10))
+
+    def notify(self, chat_id, text):
+        """
+        Mensaje fuera de la difusión (progreso, resumen) con los mismos límites global y
+        por chat que los envíos del anuncio. Lanza TelegramAPIError si Telegram lo rechaza.
+        """
+        self._wait_for_chat(chat_id)
+        self.limiter.acquire()
+        try:
+            return self._send(chat_id, text)
+        except TelegramAPIError as e:
+            if e.retry_after:
+                self.limiter.pause(e.retry_after)
+            raise
+
+    def _worker(self, pending):
+        while not self._cancelled.is_set():
+            try:
+                chat_id = pending.get_nowait()
+            except queue.Empty:
+                return
+            self._deliver(chat_id)
+
+    def run(self):
+        """Envía a todos los chats pendientes (bloqueante) y devuelve el resumen."""
+        pending = queue.Queue()
+        for chat_id in self.pending():
+            pending.put(chat_id)
+        self.save_checkpoint()
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=self._worker, args=(pending,), name=f"broadcast-{i}", daemon=True)
+                   for i in range(min(self.workers, pending.qsize()))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self._elapsed = time.monotonic() - start
+
+        if self.pending():
+            self.save_checkpoint()
+        elif self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        return self.summary()
+
+    def cancel(self):
+        """Detiene el envío tras los mensajes en curso; el checkpoint permite reanudarlo."""
+        self._cancelled.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Difunde un mensaje a todos los usuarios registrados del bot.")
+    parser.add_argument("--message", help="Texto del anuncio.")
+    parser.add_argument("--resume", action="store_true", help="Reanuda la difusión interrumpida del checkpoint.")
+    parser.add_argument("--users-file", help="Archivo con un chat ID por línea (por defecto, los usuarios registrados del bot).")
+    parser.add_argument("--rate", type=float, default=GLOBAL_RATE, help="Mensajes por segundo (global).")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Hilos de envío concurrentes.")
+    args = parser.parse_args(argv)
+
+    def on_progress(p):
+        print(f"📢 [BROADCAST] {p['done']}/{p['total']} (✅ {p['sent']} · ❌ {p['failed']})", file=sys.stderr)
+
+    options = {"rate": args.rate, "workers": args.workers, "on_progress": on_progress}
+    if args.resume:
+        broadcast = Broadcast.resume(**options)
+        if not broadcast:
+            print(json.dumps({"status": "error", "message": "No hay ninguna difusión pendiente."}))
+            sys.exit(1)
+    elif args.message:
+        broadcast = Broadcast(args.message, load_users(args.users_file), **options)
+    else:
+        print(json.dumps({"status": "error", "message": "Falta --message (o --resume)."}))
+        sys.exit(1)
+
+    print(json.dumps(broadcast.run(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
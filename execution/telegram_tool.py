@@ -7,13 +7,104 @@ import requests
 import time
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import state_store
+
 # Cargar entorno para obtener credenciales
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 ALLOWED_USERS = os.getenv("TELEGRAM_ALLOWED_USERS", CHAT_ID or "").strip()
-OFFSET_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".tmp", "telegram_offset.txt")
+API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+# El offset de getUpdates se guarda en el almacén de estado (antes .tmp/telegram_offset.txt)
+OFFSET_KEY = "telegram_offset"
+
+# Long polling: Telegram mantiene la petición abierta hasta que llega un update (o vence el timeout)
+POLL_TIMEOUT = int(os.getenv("TELEGRAM_POLL_TIMEOUT", "50"))
+POLL_LIMIT = 100
+ALLOWED_UPDATES = ["message"]
+
+
+def _build_session():
+    """Sesión HTTP persistente (keep-alive) compartida por todas las llamadas a la Bot API."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    return session
+
+
+# Se reutiliza entre llamadas cuando el módulo se ejecuta en proceso (ver tool_runtime.py)
+SESSION = _build_session()
+
+
+class TelegramAPIError(Exception):
+    """Error devuelto por la Bot API (ok=false). En los 429 incluye retry_after (segundos)."""
+
+    def __init__(self, description, error_code=None, retry_after=None):
+        super().__init__(description)
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+
+def api_call(method, payload, timeout=10):
+    """
+    Llama a un método de la Bot API y devuelve su `result`, sin imprimir ni salir.
+    Pensado para el uso en proceso (p.ej. telegram_broadcast.py). Lanza TelegramAPIError.
+    """
+    if not TOKEN:
+        raise TelegramAPIError("Falta TELEGRAM_BOT_TOKEN en .env")
+    response = SESSION.post(f"{API_BASE}/bot{TOKEN}/{method}", json=payload, timeout=timeout)
+    try:
+        data = response.json()
+    except ValueError:
+        raise TelegramAPIError(f"Respuesta no válida de Telegram (HTTP {response.status_code})", response.status_code)
+    if not data.get("ok"):
+        parameters = data.get("parameters") or {}
+        raise TelegramAPIError(data.get("description", "Error desconocido"),
+                               data.get("error_code", response.status_code),
+                               parameters.get("retry_after"))
+    return data.get("result")
+
+
+def deliver_message(chat_id, text):
+    """Como send_message() pero devuelve el mensaje enviado (o lanza TelegramAPIError)."""
+    payload = {"chat_id": chat_id, "text": text, "parse_mode": "Markdown"}
+    try:
+        return api_call("sendMessage", payload)
+    except TelegramAPIError as e:
+        # Error de sintaxis Markdown: reintentar como texto plano
+        if e.error_code != 400 or "parse" not in str(e).lower():
+            raise
+        payload.pop("parse_mode")
+        return api_call("sendMessage", payload)
+
+
+def edit_message_text(chat_id, message_id, text, parse_mode="Markdown"):
+    """
+    Reemplaza el texto de un mensaje ya enviado (respuestas en streaming).
+    Con parse_mode=None se envía como texto plano. Lanza TelegramAPIError.
+    """
+    payload = {"chat_id": chat_id, "message_id": message_id, "text": text}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    try:
+        return api_call("editMessageText", payload)
+    except TelegramAPIError as e:
+        if e.error_code == 400 and "not modified" in str(e).lower():
+            return None  # mismo texto que ya tenía: no es un error
+        if not parse_mode or e.error_code != 400 or "parse" not in str(e).lower():
+            raise
+        payload.pop("parse_mode")
+        return api_call("editMessageText", payload)
+
+def _message_id(response):
+    """ID del mensaje enviado (None si la respuesta no lo trae)."""
+    try:
+        return (response.json().get("result") or {}).get("message_id")
+    except (ValueError, AttributeError):
+        return None
 
 def send_message(text, target_chat_id=None):
     """Envía un mensaje al chat configurado."""
@@ -22,20 +113,22 @@ def send_message(text, target_chat_id=None):
         print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
         sys.exit(1)
     
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
+    url = f"{API_BASE}/bot{TOKEN}/sendMessage"
     payload = {"chat_id": dest_id, "text": text, "parse_mode": "Markdown"}
     
     try:
-        response = requests.post(url, json=payload, timeout=10)
+        response = SESSION.post(url, json=payload, timeout=10)
         response.raise_for_status()
-        print(json.dumps({"status": "success", "message": "Mensaje enviado."}))
+        message_id = _message_id(response)
+        print(json.dumps({"status": "success", "message": "Mensaje enviado.", "message_id": message_id}))
     except Exception:
         # Si falla (común por errores de sintaxis Markdown), reintentar como texto plano
         try:
             payload.pop("parse_mode", None)
-            response = requests.post(url, json=payload, timeout=10)
+            response = SESSION.post(url, json=payload, timeout=10)
             response.raise_for_status()
-            print(json.dumps({"status": "success", "message": "Mensaje enviado (texto plano por error de formato)."}))
+            message_id = _message_id(response)
+            print(json.dumps({"status": "success", "message": "Mensaje enviado (texto plano por error de formato).", "message_id": message_id}))
         except Exception as e:
             print(json.dumps({"status": "error", "message": str(e)}))
             sys.exit(1)
@@ -47,14 +140,14 @@ def send_photo(file_path, target_chat_id=None, caption=""):
         print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
         sys.exit(1)
     
-    url = f"https://api.telegram.org/bot{TOKEN}/sendPhoto"
+    url = f"{API_BASE}/bot{TOKEN}/sendPhoto"
     
     try:
         # El archivo se abre en modo binario 'rb'
         with open(file_path, 'rb') as photo_file:
             files = {'photo': photo_file}
             data = {'chat_id': dest_id, 'caption': caption}
-            response = requests.post(url, files=files, data=data, timeout=30) # Timeout aumentado para subidas
+            response = SESSION.post(url, files=files, data=data, timeout=30) # Timeout aumentado para subidas
             response.raise_for_status()
             print(json.dumps({"status": "success", "message": "Foto enviada."}))
     except Exception as e:
@@ -68,14 +161,14 @@ def send_document(file_path, target_chat_id=None, caption=""):
         print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
         sys.exit(1)
     
-    url = f"https://api.telegram.org/bot{TOKEN}/sendDocument"
+    url = f"{API_BASE}/bot{TOKEN}/sendDocument"
     
     try:
         # El archivo se abre en modo binario 'rb'
         with open(file_path, 'rb') as doc_file:
             files = {'document': doc_file}
             data = {'chat_id': dest_id, 'caption': caption}
-            response = requests.post(url, files=files, data=data, timeout=60) # Timeout mayor para docs
+            response = SESSION.post(url, files=files, data=data, timeout=60) # Timeout mayor para docs
             response.raise_for_status()
             print(json.dumps({"status": "success", "message": "Documento enviado."}))
     except Exception as e:
@@ -89,38 +182,97 @@ def send_voice(file_path, target_chat_id=None):
         print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
         sys.exit(1)
     
-    url = f"https://api.telegram.org/bot{TOKEN}/sendVoice"
+    url = f"{API_BASE}/bot{TOKEN}/sendVoice"
     
     try:
         with open(file_path, 'rb') as voice_file:
             files = {'voice': voice_file}
             data = {'chat_id': dest_id}
-            response = requests.post(url, files=files, data=data, timeout=40)
+            response = SESSION.post(url, files=files, data=data, timeout=40)
             response.raise_for_status()
             print(json.dumps({"status": "success", "message": "Nota de voz enviada."}))
     except Exception as e:
         print(json.dumps({"status": "error", "message": str(e)}))
         sys.exit(1)
 
-def check_messages():
-    """Consulta nuevos mensajes (polling) manteniendo el estado del offset."""
+def edit_message(message_id, text, target_chat_id=None):
+    """Edita un mensaje enviado antes (acción --action edit)."""
+    dest_id = target_chat_id or CHAT_ID
+    if not TOKEN or not dest_id:
+        print(json.dumps({"status": "error", "message": "Faltan credenciales o Chat ID destino."}))
+        sys.exit(1)
+
+    try:
+        edit_message_text(dest_id, message_id, text)
+        print(json.dumps({"status": "success", "message": "Mensaje editado.", "message_id": message_id}))
+    except Exception as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        sys.exit(1)
+
+def parse_update(update):
+    """
+    Convierte un update de la Bot API al formato del listener ("CHAT_ID|MENSAJE").
+    Devuelve None si el update no es un mensaje soportado o el chat no está autorizado.
+    Lo usan tanto el polling (check_messages) como el modo webhook.
+    """
+    # Seguridad: Filtrar por CHAT_ID si está definido para ignorar extraños
+    msg_chat_id = str(update.get("message", {}).get("chat", {}).get("id", ""))
+    
+    # Si ALLOWED_USERS es "*", permite a todos. Si no, verifica la lista.
+    if ALLOWED_USERS != "*":
+        allowed_list = [u.strip() for u in ALLOWED_USERS.split(",") if u.strip()]
+        if msg_chat_id not in allowed_list:
+            print(f"⚠️ Ignorando mensaje de {msg_chat_id} (No autorizado. Permitidos: '{ALLOWED_USERS}')", file=sys.stderr)
+            return None
+        
+    message = update.get("message", {})
+    text = message.get("text", "")
+    photo = message.get("photo")
+    
+    if text:
+        return f"{msg_chat_id}|{text}"
+    elif photo:
+        # Telegram envía varias resoluciones, la última es la mejor
+        file_id = photo[-1]["file_id"]
+        caption = message.get("caption", "") or ""
+        # Usamos un prefijo especial para identificar fotos en el listener
+        return f"{msg_chat_id}|__PHOTO__:{file_id}|||{caption}"
+    elif message.get("document"):
+        doc = message["document"]
+        file_id = doc["file_id"]
+        file_name = doc.get("file_name", "unknown.pdf")
+        mime_type = doc.get("mime_type", "")
+        caption = message.get("caption", "") or ""
+        
+        # Solo procesamos PDFs por ahora
+        if "pdf" in mime_type or file_name.lower().endswith(".pdf"):
+            return f"{msg_chat_id}|__DOCUMENT__:{file_id}|||{file_name}|||{caption}"
+    elif message.get("voice"):
+        voice = message["voice"]
+        file_id = voice["file_id"]
+        return f"{msg_chat_id}|__VOICE__:{file_id}"
+    return None
+
+def check_messages(poll_timeout=POLL_TIMEOUT):
+    """Consulta nuevos mensajes (long polling) manteniendo el estado del offset."""
     if not TOKEN:
         print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}))
         sys.exit(1)
         
-    offset = 0
-    if os.path.exists(OFFSET_FILE):
-        with open(OFFSET_FILE, 'r') as f:
-            try:
-                offset = int(f.read().strip())
-            except:
-                offset = 0
+    store = state_store.get_store()
+    offset = int(store.get_setting(OFFSET_KEY, 0) or 0)
     
-    url = f"https://api.telegram.org/bot{TOKEN}/getUpdates"
-    params = {"offset": offset, "limit": 10, "timeout": 5}
+    url = f"{API_BASE}/bot{TOKEN}/getUpdates"
+    params = {
+        "offset": offset,
+        "limit": POLL_LIMIT,
+        "timeout": poll_timeout,
+        "allowed_updates": json.dumps(ALLOWED_UPDATES),
+    }
     
     try:
-        response = requests.get(url, params=params, timeout=20)
+        # El timeout HTTP debe superar al del long polling para no cortar la espera
+        response = SESSION.get(url, params=params, timeout=poll_timeout + 10)
         response.raise_for_status()
         data = response.json()
         
@@ -133,48 +285,13 @@ def check_messages():
             if update_id >= offset:
                 max_update_id = max(max_update_id, update_id + 1)
                 
-                # Seguridad: Filtrar por CHAT_ID si está definido para ignorar extraños
-                msg_chat_id = str(result.get("message", {}).get("chat", {}).get("id", ""))
-                
-                # Si ALLOWED_USERS es "*", permite a todos. Si no, verifica la lista.
-                if ALLOWED_USERS != "*":
-                    allowed_list = [u.strip() for u in ALLOWED_USERS.split(",") if u.strip()]
-                    if msg_chat_id not in allowed_list:
-                        print(f"⚠️ Ignorando mensaje de {msg_chat_id} (No autorizado. Permitidos: '{ALLOWED_USERS}')", file=sys.stderr)
-                        continue
-                    
-                message = result.get("message", {})
-                text = message.get("text", "")
-                photo = message.get("photo")
-                
-                if text:
-                    messages.append(f"{msg_chat_id}|{text}")
-                elif photo:
-                    # Telegram envía varias resoluciones, la última es la mejor
-                    file_id = photo[-1]["file_id"]
-                    caption = message.get("caption", "") or ""
-                    # Usamos un prefijo especial para identificar fotos en el listener
-                    messages.append(f"{msg_chat_id}|__PHOTO__:{file_id}|||{caption}")
-                elif message.get("document"):
-                    doc = message["document"]
-                    file_id = doc["file_id"]
-                    file_name = doc.get("file_name", "unknown.pdf")
-                    mime_type = doc.get("mime_type", "")
-                    caption = message.get("caption", "") or ""
-                    
-                    # Solo procesamos PDFs por ahora
-                    if "pdf" in mime_type or file_name.lower().endswith(".pdf"):
-                        messages.append(f"{msg_chat_id}|__DOCUMENT__:{file_id}|||{file_name}|||{caption}")
-                elif message.get("voice"):
-                    voice = message["voice"]
-                    file_id = voice["file_id"]
-                    messages.append(f"{msg_chat_id}|__VOICE__:{file_id}")
+                message = parse_update(result)
+                if message:
+                    messages.append(message)
         
         # Guardar nuevo offset para no repetir mensajes
         if max_update_id > offset:
-            os.makedirs(os.path.dirname(OFFSET_FILE), exist_ok=True)
-            with open(OFFSET_FILE, 'w') as f:
-                f.write(str(max_update_id))
+            store.set_setting(OFFSET_KEY, max_update_id)
                 
         print(json.dumps({"status": "success", "messages": messages}))
         
@@ -192,12 +309,12 @@ def get_chat_id():
         print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}))
         sys.exit(1)
         
-    url = f"https://api.telegram.org/bot{TOKEN}/getUpdates"
+    url = f"{API_BASE}/bot{TOKEN}/getUpdates"
     
     # Intentar varias veces (polling) para dar tiempo al usuario
     for _ in range(5):
         try:
-            response = requests.get(url, timeout=10)
+            response = SESSION.get(url, timeout=10)
             response.raise_for_status()
             data = response.json()
             
@@ -235,14 +352,14 @@ def download_file(file_id, dest_path):
         
     try:
         # 1. Obtener la ruta del archivo
-        info_url = f"https://api.telegram.org/bot{TOKEN}/getFile"
-        res = requests.get(info_url, params={"file_id": file_id}, timeout=10)
+        info_url = f"{API_BASE}/bot{TOKEN}/getFile"
+        res = SESSION.get(info_url, params={"file_id": file_id}, timeout=10)
         res.raise_for_status()
         file_path_remote = res.json()["result"]["file_path"]
         
         # 2. Descargar el contenido
-        download_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path_remote}"
-        img_data = requests.get(download_url, timeout=20).content
+        download_url = f"{API_BASE}/file/bot{TOKEN}/{file_path_remote}"
+        img_data = SESSION.get(download_url, timeout=20).content
         
         with open(dest_path, 'wb') as f:
             f.write(img_data)
@@ -252,20 +369,61 @@ def download_file(file_id, dest_path):
         print(json.dumps({"status": "error", "message": str(e)}))
         sys.exit(1)
 
-def main():
+def set_webhook(webhook_url, secret=None):
+    """Registra la URL pública (HTTPS) a la que Telegram enviará los updates."""
+    if not TOKEN:
+        print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}))
+        sys.exit(1)
+
+    payload = {"url": webhook_url, "allowed_updates": ALLOWED_UPDATES}
+    if secret:
+        # Telegram lo reenvía en la cabecera X-Telegram-Bot-Api-Secret-Token de cada POST
+        payload["secret_token"] = secret
+
+    try:
+        response = SESSION.post(f"{API_BASE}/bot{TOKEN}/setWebhook", json=payload, timeout=10)
+        response.raise_for_status()
+        print(json.dumps({"status": "success", "message": f"Webhook registrado en {webhook_url}."}))
+    except Exception as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        sys.exit(1)
+
+def delete_webhook():
+    """Elimina el webhook para volver al modo polling (getUpdates)."""
+    if not TOKEN:
+        print(json.dumps({"status": "error", "message": "Falta TELEGRAM_BOT_TOKEN en .env"}))
+        sys.exit(1)
+
+    try:
+        response = SESSION.post(f"{API_BASE}/bot{TOKEN}/deleteWebhook", timeout=10)
+        response.raise_for_status()
+        print(json.dumps({"status": "success", "message": "Webhook eliminado. Vuelve a usarse polling."}))
+    except Exception as e:
+        print(json.dumps({"status": "error", "message": str(e)}))
+        sys.exit(1)
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Herramienta de integración con Telegram.")
-    parser.add_argument("--action", choices=["send", "check", "get-id", "download", "send-photo", "send-document", "send-voice"], required=True, help="Acción a realizar.")
+    parser.add_argument("--action", choices=["send", "edit", "check", "get-id", "download", "send-photo", "send-document", "send-voice", "set-webhook", "delete-webhook"], required=True, help="Acción a realizar.")
     parser.add_argument("--message", help="Mensaje a enviar (requerido para --action send).")
     parser.add_argument("--chat-id", help="ID del chat destino (opcional, por defecto usa el del .env).")
+    parser.add_argument("--message-id", type=int, help="ID del mensaje a editar (para --action edit).")
     parser.add_argument("--file-id", help="ID del archivo a descargar (para --action download).")
     parser.add_argument("--dest", help="Ruta destino (para --action download).")
     parser.add_argument("--file-path", help="Ruta del archivo local a enviar (para --action send-photo).")
     parser.add_argument("--caption", help="Texto para la foto (para --action send-photo).")
+    parser.add_argument("--url", help="URL pública HTTPS del webhook (para --action set-webhook).")
+    parser.add_argument("--poll-timeout", type=int, default=POLL_TIMEOUT, help="Segundos de espera del long polling (para --action check).")
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     if args.action == "send":
         send_message(args.message or "Notificación vacía", args.chat_id)
+    elif args.action == "edit":
+        if not args.message_id or not args.message:
+            print(json.dumps({"status": "error", "message": "Faltan argumentos --message-id o --message"}))
+            sys.exit(1)
+        edit_message(args.message_id, args.message, args.chat_id)
     elif args.action == "send-photo":
         if not args.file_path:
             print(json.dumps({"status": "error", "message": "Falta argumento --file-path"}))
@@ -282,7 +440,14 @@ def main():
             sys.exit(1)
         send_voice(args.file_path, args.chat_id)
     elif args.action == "check":
-        check_messages()
+        check_messages(args.poll_timeout)
+    elif args.action == "set-webhook":
+        if not args.url:
+            print(json.dumps({"status": "error", "message": "Falta argumento --url"}))
+            sys.exit(1)
+        set_webhook(args.url, os.getenv("TELEGRAM_WEBHOOK_SECRET"))
+    elif args.action == "delete-webhook":
+        delete_webhook()
     elif args.action == "get-id":
         get_chat_id()
     elif args.action == "download":
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Receptor de webhooks de Telegram (alternativa al polling de telegram_tool.py --action check).
+
+Servidor HTTP local que acepta los POST de updates que envía Telegram, valida la
+cabecera X-Telegram-Bot-Api-Secret-Token y entrega cada mensaje, ya convertido al
+formato "CHAT_ID|MENSAJE", a un callback (la cola de despacho del listener).
+
+Telegram exige HTTPS público: normalmente este servidor escucha en 127.0.0.1 detrás
+de un proxy inverso o túnel, y la URL pública se registra con:
+    python execution/telegram_tool.py --action set-webhook --url https://mi-dominio/telegram
+"""
+import os
+import sys
+import json
+import hmac
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import telegram_tool
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+WEBHOOK_HOST = os.getenv("TELEGRAM_WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram")
+MAX_BODY_BYTES = 1024 * 1024
+# Telegram reintenta si no recibe 200 a tiempo: recordamos los últimos update_id para no duplicar
+RECENT_UPDATES = 1000
+
+
+class WebhookServer:
+    """Servidor HTTP (un hilo por petición) que entrega los mensajes a `on_message(msg)`."""
+
+    def __init__(self, on_message, secret, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH):
+        if not secret:
+            raise ValueError("Se requiere un secret token (TELEGRAM_WEBHOOK_SECRET) para el modo webhook.")
+        self.on_message = on_message
+        self.secret = secret
+        self.path = path
+        self._recent = OrderedDict()
+        self._recent_lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def _is_duplicate(self, update_id):
+        with self._recent_lock:
+            if update_id in self._recent:
+                return True
+            self._recent[update_id] = True
+            if len(self._recent) > RECENT_UPDATES:
+                self._recent.popitem(last=False)
+            return False
+
+    def handle_update(self, update):
+        """Procesa un update ya decodificado. Devuelve el mensaje entregado (o None)."""
+        update_id = update.get("update_id")
+        if update_id is not None and self._is_duplicate(update_id):
+            return None
+        message = telegram_tool.parse_update(update)
+        if message:
+            self.on_message(message)
+        return message
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, code, body=b""):
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(body)
+
+            def do_POST(self):
+                if self.path.split("?", 1)[0] != server.path:
+                    return self._reply(404)
+
+                token = self.headers.get(SECRET_HEADER, "")
+                if not hmac.compare_digest(token.encode(), server.secret.encode()):
+                    print("⚠️ [WEBHOOK] Petición rechazada: secret token inválido.", file=sys.stderr)
+                    return self._reply(403)
+
+                length = int(self.headers.get("Content-Length") or 0)
+                if length <= 0 or length > MAX_BODY_BYTES:
+                    return self._reply(400)
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except (ValueError, UnicodeDecodeError):
+                    return self._reply(400)
+                if not isinstance(update, dict):
+                    return self._reply(400)
+
+                try:
+                    server.handle_update(update)
+                except Exception as e:
+                    # Respondemos 200 igualmente: si no, Telegram reintenta el mismo update
+                    print(f"❌ [WEBHOOK] Error entregando update: {e}", file=sys.stderr)
+                self._reply(200, b'{"ok":true}')
+
+        return Handler
+
+    def start(self):
+        """Arranca el servidor en un hilo de fondo."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="telegram-webhook", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Receptor de webhooks de Telegram (imprime cada mensaje como JSON).")
+    parser.add_argument("--host", default=WEBHOOK_HOST, help="Interfaz en la que escuchar.")
+    parser.add_argument("--port", type=int, default=WEBHOOK_PORT, help="Puerto en el que escuchar.")
+    parser.add_argument("--path", default=WEBHOOK_PATH, help="Ruta del webhook.")
+    args = parser.parse_args(argv)
+
+    secret = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+    if not secret:
+        print(json.dumps({"status": "error", "message": "Falta TELEGRAM_WEBHOOK_SECRET en .env"}))
+        sys.exit(1)
+
+    def on_message(msg):
+        print(json.dumps({"status": "success", "messages": [msg]}), flush=True)
+
+    server = WebhookServer(on_message, secret, args.host, args.port, args.path).start()
+    print(f"📡 Webhook escuchando en http://{args.host}:{server.port}{args.path}", file=sys.stderr)
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
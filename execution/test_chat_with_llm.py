@@ -0,0 +1,563 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chat_with_llm
+from state_store import StateStore
+
+
+class ChatTestCase(unittest.TestCase):
+    """Base: almacén de estado temporal, sin memoria RAG y con Groq simulado."""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = StateStore(os.path.join(self.tmp, "state.db"), legacy_dir=None)
+        self.calls = []
+        self.patches = [
+            patch.object(chat_with_llm.state_store, "get_store", return_value=self.store),
+            patch.object(chat_with_llm, "get_memory_context", return_value=None),
+            patch.object(chat_with_llm, "chat_groq", side_effect=self.fake_groq),
+            patch.dict(os.environ, {"GROQ_API_KEY": "test", "GOOGLE_API_KEY": "", "OPENAI_API_KEY": "",
+                                    "ANTHROPIC_API_KEY": ""}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        self.store.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def fake_groq(self, messages, model=None, system_instruction=None):
+        self.calls.append([dict(m) for m in messages])
+        return {"content": f"respuesta a '{messages[-1]['content']}'"}
+
+    def chat(self, *argv):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            chat_with_llm.main(list(argv))
+        return json.loads(out.getvalue())
+
+
+class TestSessions(ChatTestCase):
+
+    def test_sessions_do_not_share_history(self):
+        self.chat("--prompt", "me llamo Ana", "--session", "telegram:1")
+        self.chat("--prompt", "me llamo Luis", "--session", "telegram:2")
+        self.chat("--prompt", "¿cómo me llamo?", "--session", "telegram:1")
+
+        contents = [m["content"] for m in self.calls[-1]]
+        self.assertIn("me llamo Ana", contents)
+        self.assertNotIn("me llamo Luis", contents)
+        self.assertEqual(len(self.store.history_tail("telegram:2")), 2)
+
+    def test_short_history_fits_whole(self):
+        for i in range(8):
+            self.chat("--prompt", f"mensaje {i}", "--session", "s")
+        # Mensajes cortos: caben los 14 previos + el nuevo, sin resumen
+        self.assertEqual(len(self.calls[-1]), 15)
+        self.assertEqual(self.calls[-1][0]["content"], "mensaje 0")
+
+    def test_no_history_prompt_is_not_stored(self):
+        self.chat("--prompt", "hola", "--session", "s")
+        self.chat("--prompt", "Traduce esto", "--session", "s", "--no-history")
+        self.assertEqual(len(self.calls[-1]), 1)
+        self.assertEqual(len(self.store.history_tail("s")), 2)
+
+    def test_clear_only_affects_its_session(self):
+        self.chat("--prompt", "hola", "--session", "a")
+        self.chat("--prompt", "hola", "--session", "b")
+        self.chat("--prompt", "/clear", "--session", "a")
+        self.assertEqual(self.store.history_tail("a"), [])
+        self.assertEqual(len(self.store.history_tail("b")), 2)
+
+
+class TestHistoryBudget(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.summaries = []
+        budget = patch.object(chat_with_llm, "HISTORY_TOKEN_BUDGET", 300)
+        budget.start()
+        self.addCleanup(budget.stop)
+
+    def fake_groq(self, messages, model=None, system_instruction=None):
+        if system_instruction == chat_with_llm.SUMMARY_SYSTEM:
+            self.summaries.append(messages[-1]["content"])
+            return {"content": f"resumen {len(self.summaries)}"}
+        self.calls.append([dict(m) for m in messages])
+        return {"content": "ok"}
+
+    def test_long_history_is_folded_into_cached_summary(self):
+        pasted = "texto pegado " * 10  # ~40 tokens
+        for i in range(12):
+            self.chat("--prompt", f"{i} {pasted}", "--session", "s")
+
+        sent = self.calls[-1]
+        tokens = sum(chat_with_llm.count_tokens(m["content"], ["groq"]) for m in sent)
+        self.assertLessEqual(tokens, 300)
+        self.assertEqual(sent[-1]["content"], f"11 {pasted}")
+        # Lo antiguo no se pierde: va en el resumen guardado, que se reutiliza
+        upto_id, summary = self.store.get_history_summary("s")
+        self.assertEqual(sent[0]["content"], chat_with_llm.SUMMARY_PREFIX + summary)
+        self.assertGreater(upto_id, 0)
+        # Se resume por bloques (no en cada mensaje) y cada resumen parte del anterior
+        self.assertTrue(1 < len(self.summaries) <= 3)
+        self.assertIn("resumen 1", self.summaries[1])
+
+    def test_messages_beyond_fetch_limit_are_summarized(self):
+        self.store.append_history([{"role": "user" if i % 2 == 0 else "assistant", "content": f"m{i}"}
+                                   for i in range(25)], session="s")
+        with patch.object(chat_with_llm, "HISTORY_FETCH_LIMIT", 10):
+            messages = chat_with_llm.build_history("s", "nuevo", ["groq"])
+
+        # Cada mensaje acaba en un resumen o en la ventana: ninguno se pierde
+        summarized = "\n".join(self.summaries)
+        window = [m["content"] for m in messages]
+        missing = [f"m{i}" for i in range(25) if f": m{i}\n" not in summarized + "\n" and f"m{i}" not in window]
+        self.assertEqual(missing, [])
+        self.assertEqual(window[-1], "nuevo")
+        self.assertIn("resumen 1", self.summaries[1])
+
+    def test_clear_removes_summary(self):
+        for i in range(4):
+            self.chat("--prompt", "texto pegado " * 40, "--session", "s")
+        self.chat("--prompt", "/clear", "--session", "s")
+        self.assertEqual(self.store.get_history_summary("s"), (0, ""))
+
+    def test_estimate_depends_on_provider(self):
+        text = "x" * 400
+        self.assertGreater(chat_with_llm.estimate_tokens(text, "anthropic"), chat_with_llm.estimate_tokens(text, "gemini"))
+        self.assertEqual(chat_with_llm.count_tokens(text, ["gemini", "anthropic"]),
+                         chat_with_llm.estimate_tokens(text, "anthropic", chat_with_llm.model_for("anthropic")))
+
+
+class FakeStreamResponse:
+    """Respuesta HTTP en streaming (SSE) grabada."""
+
+    def __init__(self, lines, status_code=200):
+        self.lines = lines
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = ""
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def openai_sse(*deltas):
+    lines = [f'data: {json.dumps({"choices": [{"delta": {"content": d}}]})}' for d in deltas]
+    return [": keep-alive", ""] + lines + ["data: [DONE]"]
+
+
+class TestStreaming(ChatTestCase):
+
+    def test_groq_sse_deltas(self):
+        with patch.object(chat_with_llm, "http_post", return_value=FakeStreamResponse(openai_sse("Ho", "la", "!"))) as post:
+            deltas = list(chat_with_llm.stream_groq([{"role": "user", "content": "hola"}]))
+        self.assertEqual(deltas, ["Ho", "la", "!"])
+        self.assertTrue(post.call_args.kwargs["json"]["stream"])
+        self.assertTrue(post.call_args.kwargs["stream"])
+
+    def test_anthropic_sse_deltas(self):
+        events = [
+            {"type": "message_start"},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Buen"}},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "os días"}},
+            {"type": "message_stop"},
+        ]
+        lines = []
+        for e in events:
+            lines += [f"event: {e['type']}", f"data: {json.dumps(e)}", ""]
+        with patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test"}), \
+                patch.object(chat_with_llm, "http_post", return_value=FakeStreamResponse(lines)):
+            deltas = list(chat_with_llm.stream_anthropic([{"role": "user", "content": "hola"}]))
+        self.assertEqual("".join(deltas), "Buenos días")
+
+    def test_chat_streams_and_falls_back_mid_stream(self):
+        def broken(messages, system_instruction=None):
+            yield "Respuesta a me"
+            raise ConnectionError("conexión perdida")
+
+        def good(messages, system_instruction=None):
+            yield "Hola"
+            yield ", Ana"
+
+        seen = []
+        with patch.dict(os.environ, {"GOOGLE_API_KEY": "test"}), \
+                patch.object(chat_with_llm, "stream_groq", side_effect=broken), \
+                patch.object(chat_with_llm, "stream_gemini", side_effect=good):
+            result = chat_with_llm.chat("hola", session="s", on_delta=seen.append)
+
+        self.assertEqual(result, {"content": "Hola, Ana"})
+        self.assertEqual(seen, ["Respuesta a me", "Hola", "Hola, Ana"])
+        self.assertEqual(self.store.history_tail("s")[-1]["content"], "Hola, Ana")
+
+
+class FakeGenAI:
+    def __init__(self):
+        self.configured = []
+        self.built = []
+
+    def configure(self, api_key):
+        self.configured.append(api_key)
+
+    def GenerativeModel(self, model_name, system_instruction=None):
+        self.built.append((model_name, system_instruction))
+        return object()
+
+
+class TestProviderClients(unittest.TestCase):
+
+    def setUp(self):
+        chat_with_llm._gemini_models.clear()
+        chat_with_llm._gemini_api_key = None
+
+    def test_one_keepalive_session_per_endpoint(self):
+        a = chat_with_llm.get_session("https://api.groq.com/openai/v1/chat/completions")
+        b = chat_with_llm.get_session("https://api.groq.com/otra/ruta")
+        c = chat_with_llm.get_session("https://api.openai.com/v1/chat/completions")
+        self.assertIs(a, b)
+        self.assertIsNot(a, c)
+
+    def test_gemini_models_cached_per_model_and_system(self):
+        genai = FakeGenAI()
+        first = chat_with_llm.get_gemini_model(genai, "k", "gemini-pro", "Eres un pirata")
+        again = chat_with_llm.get_gemini_model(genai, "k", "gemini-pro", "Eres un pirata")
+        other = chat_with_llm.get_gemini_model(genai, "k", "gemini-pro", "Eres un robot")
+        self.assertIs(first, again)
+        self.assertIsNot(first, other)
+        self.assertEqual(genai.configured, ["k"])
+        self.assertEqual(len(genai.built), 2)
+
+    def test_gemini_cache_is_bounded(self):
+        genai = FakeGenAI()
+        with patch.object(chat_with_llm, "GEMINI_MODEL_CACHE_SIZE", 2):
+            for system in ("a", "b", "c"):
+                chat_with_llm.get_gemini_model(genai, "k", "gemini-pro", system)
+        self.assertEqual(list(chat_with_llm._gemini_models), [("gemini-pro", "b"), ("gemini-pro", "c")])
+
+    def test_prewarm_opens_connections(self):
+        heads = []
+
+        class FakeSession:
+            def head(self, url, timeout=None):
+                heads.append(url)
+
+        with patch.object(chat_with_llm, "get_session", return_value=FakeSession()):
+            result = chat_with_llm.prewarm(["groq", "openai"])
+        self.assertEqual(sorted(heads), ["https://api.groq.com", "https://api.openai.com"])
+        self.assertEqual(set(result), {"groq", "openai"})
+
+
+class TestBatch(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        chat_with_llm._limiters.clear()
+        self.addCleanup(chat_with_llm._limiters.clear)
+        limits = patch.dict(chat_with_llm.PROVIDER_RATE_LIMITS, {"groq": 1000.0, "gemini": 1000.0})
+        limits.start()
+        self.addCleanup(limits.stop)
+
+    def fake_groq(self, messages, model=None, system_instruction=None):
+        prompt = messages[-1]["content"]
+        if prompt == "falla":
+            raise RuntimeError("boom")
+        time.sleep(0.2)
+        return {"content": prompt.upper()}
+
+    def test_results_in_input_order_with_per_item_errors(self):
+        start = time.monotonic()
+        results = chat_with_llm.chat_batch(batch=["a", {"prompt": "b"}, "falla", "d"], concurrency=4)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual([r.get("content") for r in results], ["A", "B", None, "D"])
+        self.assertIn("boom", results[2]["error"])
+        self.assertLess(elapsed, 0.6)  # en paralelo, no 4 x 0.2 s
+        self.assertEqual(self.store.history_tail(), [])  # sin historial por defecto
+
+    def test_rate_limit_spreads_load_across_providers(self):
+        used = []
+
+        def fake_gemini(messages, model=None, system_instruction=None):
+            used.append("gemini")
+            return {"content": "gemini"}
+
+        with patch.dict(chat_with_llm.PROVIDER_RATE_LIMITS, {"groq": 2.0}), \
+                patch.dict(chat_with_llm._limiters, clear=True), \
+                patch.dict(os.environ, {"GOOGLE_API_KEY": "test"}), \
+                patch.object(chat_with_llm, "chat_gemini", side_effect=fake_gemini):
+            results = chat_with_llm.chat_batch(batch=[f"p{i}" for i in range(4)], concurrency=4)
+
+        self.assertTrue(all("content" in r for r in results))
+        self.assertGreaterEqual(len(used), 2)
+
+    def test_limiter_spaces_calls(self):
+        now = [0.0]
+        waits = []
+        limiter = chat_with_llm.ProviderRateLimiter(2.0, clock=lambda: now[0], sleep=waits.append)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(waits, [0.5, 1.0])
+        self.assertEqual(limiter.delay(), 1.5)
+
+    def test_bad_rate_limit_entries_are_skipped(self):
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            limits = chat_with_llm.parse_rate_limits("groq=, openai=fast,=2, anthropic=2", {"groq": 0.5})
+        self.assertEqual(limits, {"groq": 0.5, "anthropic": 2.0})
+        self.assertEqual(err.getvalue().count("LLM_RATE_LIMITS"), 3)
+
+    def test_bad_rate_limits_do_not_break_import(self):
+        env = dict(os.environ, LLM_RATE_LIMITS="groq=fast")
+        proc = subprocess.run([sys.executable, "-c", "import chat_with_llm; print(chat_with_llm.PROVIDER_RATE_LIMITS['groq'])"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout.strip(), "0.5")
+
+    def test_cli_batch_from_file(self):
+        path = os.path.join(self.tmp, "batch.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('"hola"\n{"prompt": "adiós", "system": "Eres breve"}\n')
+        output = self.chat("--batch", path, "--concurrency", "2")
+        self.assertEqual([r["content"] for r in output["results"]], ["HOLA", "ADIÓS"])
+
+
+class TestDeadline(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        env = patch.dict(os.environ, {"GOOGLE_API_KEY": "test"})
+        env.start()
+        self.addCleanup(env.stop)
+        self.budgets = []
+
+    def hanging(self, name):
+        """Proveedor que no responde: agota el plazo de su intento, como un timeout de requests."""
+        def call(messages, model=None, system_instruction=None):
+            remaining = chat_with_llm.remaining_time()
+            self.budgets.append((name, remaining))
+            time.sleep(max(0.0, remaining))
+            return {"error": "Read timed out"}
+        return call
+
+    def test_budget_is_split_across_fallbacks(self):
+        with patch.object(chat_with_llm, "DEADLINE_MIN_ATTEMPT", 0.0), \
+                patch.object(chat_with_llm, "chat_groq", side_effect=self.hanging("groq")), \
+                patch.object(chat_with_llm, "chat_gemini", side_effect=self.hanging("gemini")):
+            start = time.monotonic()
+            result = chat_with_llm.chat("hola", no_history=True, deadline_ms=400)
+            elapsed = time.monotonic() - start
+
+        self.assertEqual(result["error_type"], chat_with_llm.DEADLINE_ERROR_TYPE)
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual([name for name, _ in self.budgets], ["groq", "gemini"])
+        self.assertAlmostEqual(self.budgets[0][1], 0.2, delta=0.05)
+
+    def test_deadline_does_not_count_as_provider_failure(self):
+        with patch.object(chat_with_llm, "DEADLINE_MIN_ATTEMPT", 0.0), \
+                patch.object(chat_with_llm, "chat_groq", side_effect=self.hanging("groq")), \
+                patch.object(chat_with_llm, "chat_gemini", side_effect=self.hanging("gemini")):
+            for _ in range(chat_with_llm.provider_stats.BREAKER_FAILURES):
+                chat_with_llm.chat("hola", no_history=True, deadline_ms=100)
+
+        stats = chat_with_llm.provider_stats.get_stats()
+        self.assertFalse(stats.is_open("groq"))
+        self.assertNotIn("groq/*", {k for k, e in stats.snapshot().items() if e["errors"]})
+
+    def test_partial_stream_is_returned_on_deadline(self):
+        def trickle(messages, system_instruction=None):
+            yield "Hola, "
+            yield "la respuesta es"
+            time.sleep(0.4)
+            chat_with_llm.check_deadline()
+            yield " larguísima"
+
+        with patch.object(chat_with_llm, "stream_groq", side_effect=trickle), \
+                patch.object(chat_with_llm, "stream_gemini", side_effect=trickle):
+            result = chat_with_llm.chat("hola", no_history=True, on_delta=lambda text: None, deadline_ms=300)
+        self.assertEqual(result, {"content": "Hola, la respuesta es", "partial": True})
+
+    def test_http_timeout_is_capped_by_deadline(self):
+        sent = []
+
+        class FakeSession:
+            def post(self, url, **kwargs):
+                sent.append(kwargs["timeout"])
+
+        with patch.object(chat_with_llm, "get_session", return_value=FakeSession()):
+            chat_with_llm._deadline_state.at = time.monotonic() + 1.0
+            try:
+                chat_with_llm.http_post("https://api.groq.com/x", json={}, timeout=30)
+                chat_with_llm._deadline_state.at = time.monotonic() - 0.1
+                with self.assertRaises(chat_with_llm.DeadlineExceeded):
+                    chat_with_llm.http_post("https://api.groq.com/x", json={}, timeout=30)
+            finally:
+                chat_with_llm._deadline_state.at = None
+        self.assertLessEqual(sent[0], 1.0)
+        self.assertEqual(len(sent), 1)
+
+
+def slow_stream(first_after, *deltas, closed=None):
+    def stream(messages, system_instruction=None):
+        try:
+            time.sleep(first_after)
+            for d in deltas:
+                yield d
+        finally:
+            if closed is not None:
+                closed.set()
+    return stream
+
+
+class TestHedging(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.env = patch.dict(os.environ, {"GOOGLE_API_KEY": "test", "OPENAI_API_KEY": "test"})
+        self.env.start()
+        chat_with_llm._latencies.clear()
+
+    def tearDown(self):
+        self.env.stop()
+        super().tearDown()
+
+    def test_slow_primary_is_hedged_and_cancelled(self):
+        closed = threading.Event()
+        with patch.object(chat_with_llm, "HEDGE_DEFAULT_DELAY", 0.1), \
+                patch.object(chat_with_llm, "stream_groq", side_effect=slow_stream(0.6, "lento", closed=closed)), \
+                patch.object(chat_with_llm, "stream_gemini", side_effect=slow_stream(0.0, "rá", "pido")):
+            start = time.monotonic()
+            result = chat_with_llm.chat("hola", no_history=True, hedge=True)
+            elapsed = time.monotonic() - start
+            self.assertTrue(closed.wait(2))  # el perdedor cierra su stream
+
+        self.assertEqual(result, {"content": "rápido"})
+        self.assertLess(elapsed, 0.5)
+
+    def test_fast_primary_launches_no_hedge(self):
+        launched = []
+
+        def tracked(name, first_after):
+            stream = slow_stream(first_after, name)
+
+            def wrapper(messages, system_instruction=None):
+                launched.append(name)
+                return stream(messages, system_instruction)
+            return wrapper
+
+        with patch.object(chat_with_llm, "HEDGE_DEFAULT_DELAY", 0.3), \
+                patch.object(chat_with_llm, "stream_groq", side_effect=tracked("groq", 0.0)), \
+                patch.object(chat_with_llm, "stream_gemini", side_effect=tracked("gemini", 0.0)):
+            result = chat_with_llm.chat("hola", no_history=True, hedge=True)
+        self.assertEqual(result, {"content": "groq"})
+        self.assertEqual(launched, ["groq"])
+
+    def test_hedge_budget_caps_parallel_requests(self):
+        launched = []
+
+        def tracked(name):
+            def stream(messages, system_instruction=None):
+                launched.append(name)
+                time.sleep(0.3)
+                yield name
+            return stream
+
+        with patch.object(chat_with_llm, "HEDGE_DEFAULT_DELAY", 0.05), \
+                patch.object(chat_with_llm, "stream_groq", side_effect=tracked("groq")), \
+                patch.object(chat_with_llm, "stream_gemini", side_effect=tracked("gemini")), \
+                patch.object(chat_with_llm, "stream_openai", side_effect=tracked("openai")):
+            result = chat_with_llm._hedged_chat(["groq", "gemini", "openai"], [{"role": "user", "content": "x"}],
+                                                None, max_hedges=1)
+        self.assertIn(result["content"], ("groq", "gemini"))
+        self.assertEqual(launched, ["groq", "gemini"])
+
+    def test_failed_primary_falls_back(self):
+        def failing(messages, system_instruction=None):
+            raise ConnectionError("caído")
+            yield
+
+        with patch.object(chat_with_llm, "stream_groq", side_effect=failing), \
+                patch.object(chat_with_llm, "stream_gemini", side_effect=slow_stream(0.0, "ok")):
+            result = chat_with_llm.chat("hola", no_history=True, hedge=True)
+        self.assertEqual(result, {"content": "ok"})
+
+    def test_only_time_to_first_token_feeds_hedge_delay(self):
+        with patch.object(chat_with_llm, "chat_groq", side_effect=lambda *a, **k: time.sleep(0.2) or {"content": "ok"}):
+            chat_with_llm.chat("hola", no_history=True, provider="groq")
+        self.assertNotIn("groq", chat_with_llm._latencies)
+
+        with patch.object(chat_with_llm, "stream_groq", side_effect=slow_stream(0.0, "a", "b")):
+            chat_with_llm.chat("hola", no_history=True, provider="groq", on_delta=lambda text: None, no_cache=True)
+        self.assertEqual(len(chat_with_llm._latencies["groq"]), 1)
+        self.assertLess(chat_with_llm._latencies["groq"][0], 0.1)
+        # La puntuación usa el tiempo total de las dos llamadas, no el primer fragmento
+        ewma = chat_with_llm.provider_stats.get_stats().snapshot()["groq/*"]["ewma_latency"]
+        self.assertGreater(ewma, 0.1)
+
+    def test_delay_uses_p95(self):
+        for latency in [0.8] * 19 + [5.0]:
+            chat_with_llm.record_latency("groq", latency)
+        self.assertAlmostEqual(chat_with_llm.hedge_delay("groq"), 0.8)
+        self.assertEqual(chat_with_llm.hedge_delay("anthropic"), chat_with_llm.HEDGE_DEFAULT_DELAY)
+
+
+COLD_START_SCRIPT = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {execution_dir!r})
+import chat_with_llm
+chat_with_llm.MEMORY_DB_PATH = {missing!r}
+chat_with_llm.chat_groq = lambda messages, model=None, system_instruction=None: {{"content": "ok"}}
+chat_with_llm.main(["--prompt", "hola", "--provider", "groq", "--no-cache"])
+heavy = [m for m in ("chromadb", "google.generativeai") if m in sys.modules]
+print(json.dumps({{"elapsed": time.perf_counter() - start, "heavy": heavy}}))
+"""
+
+
+class TestColdStart(unittest.TestCase):
+    """Regresión: `--prompt` con Groq y sin memoria no debe cargar los SDK pesados."""
+
+    MAX_COLD_START = 1.0  # segundos; con chromadb importado al inicio superaba este límite
+
+    def test_groq_prompt_cold_start(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        script = COLD_START_SCRIPT.format(execution_dir=os.path.dirname(os.path.abspath(__file__)),
+                                          missing=os.path.join(tmp, "no_chroma"))
+        env = dict(os.environ, AGENT_STATE_DB=os.path.join(tmp, "state.db"), GROQ_API_KEY="test")
+        proc = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, env=env, timeout=60)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        lines = proc.stdout.strip().splitlines()
+        self.assertEqual(json.loads(lines[0]), {"content": "ok"})
+        report = json.loads(lines[-1])
+        self.assertEqual(report["heavy"], [])
+        self.assertLess(report["elapsed"], self.MAX_COLD_START)
+
+    def test_lazy_import_caches_missing_modules(self):
+        self.assertIsNone(chat_with_llm.lazy_import("modulo_que_no_existe_xyz"))
+        self.assertIn("modulo_que_no_existe_xyz", chat_with_llm._lazy_modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import listen_telegram
+
+
+class TestChatDispatcher(unittest.TestCase):
+
+    def test_slow_chat_does_not_block_other_chats(self):
+        done = []
+
+        def handler(msg):
+            chat, text = msg.split("|", 1)
+            if text == "/reporte":
+                time.sleep(0.5)
+            done.append((chat, text, time.monotonic()))
+
+        async def scenario():
+            dispatcher = listen_telegram.ChatDispatcher(handler, max_concurrency=4)
+            start = time.monotonic()
+            dispatcher.dispatch("1|/reporte")
+            dispatcher.dispatch("2|/ayuda")
+            await dispatcher.drain()
+            return start
+
+        start = asyncio.run(scenario())
+        finished = {text: t - start for _, text, t in done}
+        self.assertLess(finished["/ayuda"], 0.3)
+        self.assertGreaterEqual(finished["/reporte"], 0.5)
+
+    def test_messages_of_same_chat_keep_order(self):
+        done = []
+        lock = threading.Lock()
+
+        def handler(msg):
+            _, text = msg.split("|", 1)
+            # Los primeros mensajes tardan más: si no hubiera orden por chat, terminarían después
+            time.sleep(0.05 * (5 - int(text)))
+            with lock:
+                done.append(text)
+
+        async def scenario():
+            dispatcher = listen_telegram.ChatDispatcher(handler, max_concurrency=5)
+            for i in range(5):
+                dispatcher.dispatch(f"42|{i}")
+            await dispatcher.drain()
+
+        asyncio.run(scenario())
+        self.assertEqual(done, ["0", "1", "2", "3", "4"])
+
+    def test_global_concurrency_limit(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def handler(msg):
+            with lock:
+                active.append(msg)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(msg)
+
+        async def scenario():
+            dispatcher = listen_telegram.ChatDispatcher(handler, max_concurrency=2)
+            for i in range(6):
+                dispatcher.dispatch(f"{i}|hola")
+            await dispatcher.drain()
+
+        asyncio.run(scenario())
+        self.assertLessEqual(max(peak), 2)
+
+
+class TestLaneScheduler(unittest.TestCase):
+
+    def test_classify_message(self):
+        self.assertEqual(listen_telegram.classify_message("1|/ayuda"), "fast")
+        self.assertEqual(listen_telegram.classify_message("1|/status"), "fast")
+        self.assertEqual(listen_telegram.classify_message("1|Hola"), "fast")
+        self.assertEqual(listen_telegram.classify_message("1|/modo pirata"), "fast")
+        self.assertEqual(listen_telegram.classify_message("1|/idioma en"), "fast")
+        self.assertEqual(listen_telegram.classify_message("1|/ayuda_medica"), "heavy")
+        self.assertEqual(listen_telegram.classify_message("1|/reporte gripe"), "heavy")
+        self.assertEqual(listen_telegram.classify_message("1|/investigar IA"), "heavy")
+        self.assertEqual(listen_telegram.classify_message("1|/py print(1)"), "heavy")
+        self.assertEqual(listen_telegram.classify_message("1|__VOICE__:abc"), "heavy")
+        self.assertEqual(listen_telegram.classify_message("1|__DOCUMENT__:abc|||a.pdf|||"), "heavy")
+
+    def test_fast_lane_answers_while_heavy_lane_is_saturated(self):
+        finished = {}
+
+        def handler(msg):
+            chat, text = msg.split("|", 1)
+            if text.startswith("/reporte"):
+                time.sleep(0.5)
+            finished[(chat, text)] = time.monotonic()
+
+        async def scenario():
+            scheduler = listen_telegram.LaneScheduler(handler, heavy_workers=1, fast_workers=1)
+            start = time.monotonic()
+            scheduler.dispatch("1|/reporte a")
+            scheduler.dispatch("2|/reporte b")
+            # Mismo chat que el reporte en curso: el carril rápido no espera al pesado
+            scheduler.dispatch("1|/ayuda")
+            await scheduler.drain()
+            scheduler.shutdown()
+            return start
+
+        start = asyncio.run(scenario())
+        self.assertLess(finished[("1", "/ayuda")] - start, 0.3)
+        self.assertGreaterEqual(finished[("2", "/reporte b")] - start, 1.0)
+
+
+    def test_settings_commands_keep_order_with_heavy_lane(self):
+        order = []
+
+        def handler(msg):
+            chat, text = msg.split("|", 1)
+            if text.startswith("/reporte"):
+                time.sleep(0.3)
+            order.append((chat, text))
+
+        async def scenario():
+            scheduler = listen_telegram.LaneScheduler(handler, heavy_workers=2, fast_workers=2)
+            scheduler.dispatch("1|/reporte a")
+            scheduler.dispatch("1|/idioma en")
+            scheduler.dispatch("1|/reporte b")
+            scheduler.dispatch("2|/idioma es")
+            await scheduler.drain()
+            scheduler.shutdown()
+
+        asyncio.run(scenario())
+        chat_1 = [text for chat, text in order if chat == "1"]
+        self.assertEqual(chat_1, ["/reporte a", "/idioma en", "/reporte b"])
+        # Otro chat no espera a los reportes del primero
+        self.assertEqual(order[0], ("2", "/idioma es"))
+
+    def test_is_barrier_command(self):
+        self.assertTrue(listen_telegram.is_barrier_command("1|/modo pirata"))
+        self.assertTrue(listen_telegram.is_barrier_command("1|/zona_horaria Europe/Madrid"))
+        self.assertFalse(listen_telegram.is_barrier_command("1|/modos"))
+        self.assertFalse(listen_telegram.is_barrier_command("1|/ayuda"))
+
+
+class TestToolTimeouts(unittest.TestCase):
+
+    def test_user_gets_structured_reply_when_tool_times_out(self):
+        sent = []
+
+        def fake_run_tool(script, args, timeout=None):
+            if script == "research_topic.py":
+                return {"status": "timeout", "tool": script, "timeout": 45,
+                        "message": "research_topic.py no respondió en 45 s y se canceló."}
+            if "--message" in args:
+                sent.append(args[args.index("--message") + 1])
+            return {"status": "success"}
+
+        with patch.object(listen_telegram.tool_runtime, "run_tool", side_effect=fake_run_tool), \
+                patch.object(listen_telegram, "save_user"):
+            listen_telegram.handle_message("7|/investigar agujeros negros")
+
+        self.assertIn("tardó demasiado", sent[-1])
+        self.assertIn("research_topic", sent[-1])
+
+    def test_llm_calls_get_deadline_below_runtime_timeout(self):
+        calls = []
+
+        def fake_run_tool(script, args, timeout=None):
+            calls.append((script, list(args)))
+            return {"content": "ok"}
+
+        with patch.object(listen_telegram.tool_runtime, "run_tool", side_effect=fake_run_tool), \
+                patch.object(listen_telegram.tool_runtime, "get_timeout", return_value=60):
+            listen_telegram.run_tool("chat_with_llm.py", ["--prompt", "hola"])
+            listen_telegram.run_tool("chat_with_llm.py", ["--prompt", "hola", "--deadline-ms", "1000"])
+
+        self.assertEqual(calls[0][1][-2:], ["--deadline-ms", str((60 - listen_telegram.LLM_DEADLINE_MARGIN) * 1000)])
+        self.assertEqual(calls[1][1].count("--deadline-ms"), 1)
+
+
+class TestPolling(unittest.TestCase):
+
+    def poll(self, responses):
+        """Llamadas a la consulta de updates y pausas hasta agotar `responses`."""
+        calls, pauses = [], []
+
+        def fake_run_tool(script, args):
+            calls.append(args)
+            if not responses:
+                raise KeyboardInterrupt
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        with patch.object(listen_telegram, "run_tool", side_effect=fake_run_tool), \
+                patch.object(listen_telegram, "handle_message"), \
+                patch.object(listen_telegram, "check_system_health"), \
+                patch.object(listen_telegram.tool_runtime, "preload"), \
+                patch.object(listen_telegram, "prewarm_llm_clients"), \
+                patch.object(listen_telegram, "get_reminder_scheduler"), \
+                patch.object(listen_telegram.time, "sleep", side_effect=pauses.append):
+            listen_telegram.main([])
+        return calls, pauses
+
+    def test_failed_polls_back_off(self):
+        timeout = listen_telegram.ToolTimeout({"tool": "telegram_tool.py", "timeout": 90})
+        calls, pauses = self.poll([None, {"status": "error", "message": "x"}, timeout, "no es un dict"])
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(pauses, [listen_telegram.POLL_ERROR_BACKOFF] * 4)
+
+    def test_successful_poll_does_not_sleep(self):
+        calls, pauses = self.poll([{"status": "success", "messages": ["1|hola"]}])
+        self.assertEqual(pauses, [])
+
+    def test_async_poll_backs_off_on_invalid_response(self):
+        calls = []
+
+        def fake_run_tool(script, args):
+            calls.append(args)
+            return None
+
+        async def scenario():
+            task = asyncio.create_task(listen_telegram._poll_updates(None))
+            await asyncio.sleep(0.3)
+            task.cancel()
+
+        with patch.object(listen_telegram, "run_tool", side_effect=fake_run_tool), \
+                patch.object(listen_telegram, "POLL_ERROR_BACKOFF", 0.1):
+            asyncio.run(scenario())
+        self.assertLessEqual(len(calls), 4)
+
+
+class TestBroadcastCommand(unittest.TestCase):
+
+    def test_failed_summary_does_not_escape_the_thread(self):
+        sent = []
+
+        def telegram(chat_id, text):
+            sent.append(chat_id)
+            if chat_id == "admin":
+                raise listen_telegram.telegram_tool.TelegramAPIError("Bad Gateway", 502)
+
+        broadcast = listen_telegram.Broadcast("hola", ["1", "2"], send=telegram, rate=1000, checkpoint_path=None)
+        listen_telegram._broadcast = broadcast
+        listen_telegram._run_broadcast(broadcast, "admin")  # no debe lanzar la excepción del resumen
+        self.assertEqual(sorted(sent), ["1", "2", "admin"])
+        self.assertIsNone(listen_telegram._broadcast)
+
+    def test_second_broadcast_reports_the_running_one(self):
+        running = listen_telegram.Broadcast("hola", ["1", "2", "3"], send=lambda chat_id, text: None,
+                                            rate=1000, checkpoint_path=None)
+        listen_telegram._broadcast = running
+        self.addCleanup(setattr, listen_telegram, "_broadcast", None)
+        other = listen_telegram.Broadcast("otro", ["1"], send=lambda chat_id, text: None, checkpoint_path=None)
+        self.assertIs(listen_telegram.start_broadcast(other, "admin"), running)
+
+        sent = []
+
+        def fake_run_tool(script, args, timeout=None):
+            if "--message" in args:
+                sent.append(args[args.index("--message") + 1])
+            return {"status": "success"}
+
+        with patch.object(listen_telegram.tool_runtime, "run_tool", side_effect=fake_run_tool), \
+                patch.object(listen_telegram, "save_user"):
+            listen_telegram.handle_message("7|/broadcast otro anuncio")
+        self.assertIn("Ya hay un anuncio en curso", sent[-1])
+        self.assertIn("0/3", sent[-1])
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestStreamingReply(unittest.TestCase):
+
+    def setUp(self):
+        self.edits = []
+        self.sent = []
+        self.clock = FakeClock()
+        self.patches = [
+            patch.object(listen_telegram.telegram_tool, "deliver_message", return_value={"message_id": 9}),
+            patch.object(listen_telegram.telegram_tool, "edit_message_text",
+                         side_effect=lambda chat, mid, text, parse_mode=None: self.edits.append((text, parse_mode))),
+            patch.object(listen_telegram.tool_runtime, "run_tool",
+                         side_effect=lambda script, args, timeout=None: self.sent.append(args[args.index("--message") + 1])),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+
+    def test_edits_are_throttled(self):
+        reply = listen_telegram.StreamingReply("7", interval=1.0, clock=self.clock)
+        self.assertTrue(reply.start())
+        text = ""
+        for word in ["Hola", " ,", " esto", " es", " una", " respuesta"]:
+            text += word
+            reply.update(text)
+            self.clock.now += 0.4
+        reply.finish("*Hola*, esto es una respuesta")
+
+        partial = [t for t, mode in self.edits if mode is None]
+        # 6 fragmentos en 2.4 s con 1 edición/s como máximo
+        self.assertLessEqual(len(partial), 2)
+        self.assertTrue(all(t.endswith("▌") for t in partial))
+        self.assertEqual(self.edits[-1], ("*Hola*, esto es una respuesta", "Markdown"))
+        self.assertEqual(self.sent, [])
+
+    def test_long_reply_is_split(self):
+        reply = listen_telegram.StreamingReply("7", clock=self.clock)
+        reply.start()
+        text = "\n".join(["x" * 100] * 60)  # ~6000 caracteres
+        reply.finish(text)
+        self.assertLessEqual(len(self.edits[-1][0]), listen_telegram.TELEGRAM_MAX_LENGTH)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(len(self.edits[-1][0]) + len(self.sent[0]) + 1, len(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
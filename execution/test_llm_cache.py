@@ -0,0 +1,78 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chat_with_llm
+from llm_cache import ResponseCache
+from test_chat_with_llm import ChatTestCase
+from test_provider_stats import FakeClock
+
+MESSAGES = [{"role": "user", "content": "Traduce: hola"}]
+
+
+class TestResponseCache(ChatTestCase):
+
+    def test_repeated_prompt_is_served_from_cache(self):
+        first = self.chat("--prompt", "Traduce: hola", "--no-history")
+        second = self.chat("--prompt", "Traduce: hola", "--no-history")
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 1)
+
+        stats = ResponseCache(self.store).stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_system_instruction_is_part_of_the_key(self):
+        self.chat("--prompt", "hola", "--no-history", "--system", "Eres un pirata")
+        self.chat("--prompt", "hola", "--no-history", "--system", "Eres un robot")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_no_cache_bypasses_lookup_and_store(self):
+        self.chat("--prompt", "hola", "--no-history", "--no-cache")
+        self.chat("--prompt", "hola", "--no-history", "--no-cache")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(ResponseCache(self.store).stats()["entries"], 0)
+
+    def test_streaming_hit_emits_full_text(self):
+        self.chat("--prompt", "hola", "--no-history")
+        seen = []
+        with patch.object(chat_with_llm, "stream_groq", side_effect=AssertionError("no debería llamarse")):
+            result = chat_with_llm.chat("hola", no_history=True, on_delta=seen.append)
+        self.assertEqual(seen, [result["content"]])
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = ResponseCache(self.store, ttl=60, clock=clock)
+        cache.put("groq", "m", None, MESSAGES, "hola")
+        self.assertEqual(cache.lookup([("groq", "m")], None, MESSAGES), ("groq", "hola"))
+        clock.now += 61
+        self.assertIsNone(cache.lookup([("groq", "m")], None, MESSAGES))
+
+    def test_lru_eviction(self):
+        clock = FakeClock()
+        cache = ResponseCache(self.store, max_entries=2, clock=clock)
+        prompts = [[{"role": "user", "content": str(i)}] for i in range(3)]
+        cache.put("groq", "m", None, prompts[0], "0")
+        clock.now += 1
+        cache.put("groq", "m", None, prompts[1], "1")
+        clock.now += 1
+        cache.lookup([("groq", "m")], None, prompts[0])  # 0 pasa a ser el más reciente
+        clock.now += 1
+        cache.put("groq", "m", None, prompts[2], "2")
+
+        self.assertEqual(cache.stats()["entries"], 2)
+        self.assertIsNone(cache.lookup([("groq", "m")], None, prompts[1]))
+        self.assertEqual(cache.lookup([("groq", "m")], None, prompts[0]), ("groq", "0"))
+
+    def test_lookup_prefers_candidate_order(self):
+        cache = ResponseCache(self.store)
+        cache.put("groq", "a", None, MESSAGES, "de groq")
+        cache.put("gemini", "b", None, MESSAGES, "de gemini")
+        self.assertEqual(cache.lookup([("gemini", "b"), ("groq", "a")], None, MESSAGES), ("gemini", "de gemini"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import uuid
+from contextlib import redirect_stderr, redirect_stdout
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import chromadb
+except ImportError:
+    chromadb = None
+
+import chat_with_llm
+import delete_memory
+import list_memories
+import memory_daemon
+import query_memory
+import save_memory
+from memory_daemon import MemoryBackend, MemoryDaemon
+from test_semantic_cache import BagOfWords
+
+
+@unittest.skipIf(chromadb is None, "chromadb no instalado")
+class TestMemoryDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, "chroma_db")
+        os.makedirs(self.db_path)
+        self.socket_path = os.path.join(self.tmp, "memory.sock")
+        self.client = chromadb.EphemeralClient()
+        self.collection = self.client.get_or_create_collection(f"memory_{uuid.uuid4().hex[:8]}",
+                                                               embedding_function=BagOfWords())
+        self.backend = MemoryBackend(self.collection, self.db_path)
+        self.daemon = None
+        patcher = patch.object(memory_daemon, "SOCKET_PATH", self.socket_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        if self.daemon:
+            self.daemon.stop()
+        self.client.delete_collection(self.collection.name)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def start_daemon(self):
+        self.daemon = MemoryDaemon(self.backend, self.socket_path).start()
+        return self.daemon
+
+    def run_cli(self, module, *argv):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            try:
+                module.main([*argv, "--db-path", self.db_path])
+            except SystemExit as e:
+                self.assertEqual(e.code, 0)
+        return json.loads(out.getvalue())
+
+    def test_clis_are_served_by_the_daemon(self):
+        self.start_daemon()
+        with patch.object(memory_daemon, "get_backend", side_effect=AssertionError("no debería abrir ChromaDB")):
+            saved = self.run_cli(save_memory, "--text", "La capital de Francia es París")
+            self.run_cli(save_memory, "--text", "El agua hierve a cien grados", "--category", "ciencia")
+            found = self.run_cli(query_memory, "--query", "capital de Francia", "--n-results", "1")
+            listed = self.run_cli(list_memories, "--limit", "5")
+            deleted = self.run_cli(delete_memory, "--text", "AGUA")
+
+        self.assertEqual(found["results"][0]["content"], "La capital de Francia es París")
+        self.assertEqual([m["metadata"].get("category") for m in listed["memories"]], ["ciencia", "general"])
+        self.assertEqual(listed["memories"][1]["id"], saved["memory_id"])
+        self.assertIn("1 recuerdos", deleted["message"])
+        self.assertEqual(self.collection.count(), 1)
+
+    def test_falls_back_to_direct_mode_without_daemon(self):
+        with patch.object(memory_daemon, "get_backend", return_value=self.backend) as get_backend:
+            self.run_cli(save_memory, "--text", "Recordar comprar pan")
+            result = memory_daemon.call("query", db_path=self.db_path, query="comprar pan")
+        self.assertEqual(result["documents"], ["Recordar comprar pan"])
+        self.assertEqual(get_backend.call_count, 2)
+
+    def test_stale_socket_and_other_database_fall_back(self):
+        # Socket huérfano: existe el archivo pero nadie escucha
+        open(self.socket_path, "w").close()
+        self.assertIsNone(memory_daemon.request("ping", db_path=self.db_path))
+
+        # Un daemon nuevo lo reemplaza; otra base de datos no se sirve por él
+        self.start_daemon()
+        self.assertTrue(memory_daemon.request("ping", db_path=self.db_path)["ok"])
+        self.assertIsNone(memory_daemon.request("ping", db_path=os.path.join(self.tmp, "otra_db")))
+        with self.assertRaises(RuntimeError):
+            MemoryDaemon(self.backend, self.socket_path)
+
+    def test_list_pages_newest_first_from_index(self):
+        for i in range(5):
+            self.backend.handle("add", {"documents": [f"nota {i}"], "ids": [f"m{i}"], "metadatas": [
+                {"timestamp": f"2026-01-0{i + 1}T10:00:00", "category": "par" if i % 2 == 0 else "impar",
+                 "chat_id": "42" if i < 3 else "7"}]})
+
+        with patch.object(memory_daemon, "get_backend", return_value=self.backend), \
+                patch.object(self.collection, "get", side_effect=AssertionError("no debería leer la colección")):
+            first = self.run_cli(list_memories, "--limit", "2")
+            second = self.run_cli(list_memories, "--limit", "2", "--cursor", first["next_cursor"])
+            last = self.run_cli(list_memories, "--limit", "2", "--cursor", second["next_cursor"])
+            evens = self.run_cli(list_memories, "--category", "par", "--chat-id", "42")
+
+        self.assertEqual([m["id"] for m in first["memories"] + second["memories"] + last["memories"]],
+                         ["m4", "m3", "m2", "m1", "m0"])
+        self.assertIsNone(last["next_cursor"])
+        self.assertEqual([m["id"] for m in evens["memories"]], ["m2", "m0"])
+
+        self.backend.handle("delete", {"ids": ["m4"]})
+        self.assertEqual(self.backend.index.list(1)[0][0]["id"], "m3")
+
+    def test_index_is_rebuilt_for_existing_collection(self):
+        self.collection.add(ids=["a", "b"], documents=["vieja", "nueva"],
+                            metadatas=[{"timestamp": "2025-01-01T00:00:00"}, {"timestamp": "2026-01-01T00:00:00"}])
+        with patch.object(memory_daemon, "get_backend", return_value=self.backend):
+            listed = self.run_cli(list_memories, "--limit", "5")
+        self.assertEqual([m["content"] for m in listed["memories"]], ["nueva", "vieja"])
+        self.assertEqual(self.backend.index.count(), 2)
+
+    def test_delete_by_text_and_keywords_uses_text_index(self):
+        notes = ["La capital de Francia es París", "El código de la puerta es 4521",
+                 "Paris Hilton no es una ciudad", "Comprar pan"]
+        self.backend.handle("add", {"documents": notes, "ids": ["m0", "m1", "m2", "m3"], "metadatas": [
+            {"timestamp": f"2026-01-0{i + 1}T10:00:00"} for i in range(4)]})
+
+        with patch.object(memory_daemon, "get_backend", return_value=self.backend), \
+                patch.object(self.collection, "get", side_effect=AssertionError("no debería leer la colección")):
+            preview = self.run_cli(delete_memory, "--text", "PARIS", "--dry-run")
+            by_keywords = self.run_cli(delete_memory, "--keywords", "paris capital", "--dry-run")
+            short = self.run_cli(delete_memory, "--text", "45", "--dry-run")
+            self.assertEqual(self.collection.count(), 4)
+            deleted = self.run_cli(delete_memory, "--keywords", "paris", "--batch-size", "1")
+
+        self.assertEqual([m["id"] for m in preview["matches"]], ["m2"])
+        self.assertEqual([m["id"] for m in by_keywords["matches"]], ["m0"])
+        self.assertEqual([m["id"] for m in short["matches"]], ["m1"])
+        self.assertIn("2 recuerdos", deleted["message"])
+        self.assertEqual(self.collection.count(), 2)
+        self.assertEqual(self.backend.handle("search", {"keywords": "paris"}), [])
+
+    def test_text_and_keywords_together(self):
+        notes = ["Cita con el dentista el lunes", "Cita con el médico el martes", "El dentista cobra 40 euros"]
+        self.backend.handle("add", {"documents": notes, "ids": ["m0", "m1", "m2"], "metadatas": [
+            {"timestamp": f"2026-01-0{i + 1}T10:00:00"} for i in range(3)]})
+
+        # El servicio devuelve solo los que cumplen las dos condiciones
+        both = self.backend.handle("search", {"text": "cita", "keywords": "dentista"})
+        self.assertEqual([m["id"] for m in both], ["m0"])
+
+        # La CLI no admite ambos a la vez: no se borra nada
+        err = io.StringIO()
+        with patch.object(memory_daemon, "get_backend", return_value=self.backend), redirect_stderr(err), \
+                self.assertRaises(SystemExit) as exit_info:
+            delete_memory.main(["--text", "cita", "--keywords", "dentista", "--db-path", self.db_path])
+        self.assertEqual(exit_info.exception.code, 2)
+        self.assertIn("not allowed with", err.getvalue())
+        self.assertEqual(self.collection.count(), 3)
+
+    def test_hybrid_query_fuses_vector_and_keyword_matches(self):
+        notes = ["El código de la alarma es ZX4521", "La alarma suena a las siete",
+                 "Mi color favorito es el verde", "Las plantas necesitan luz"]
+        self.backend.handle("add", {"documents": notes, "ids": ["m0", "m1", "m2", "m3"], "metadatas": [
+            {"timestamp": f"2026-01-0{i + 1}T10:00:00"} for i in range(4)]})
+
+        with patch.object(memory_daemon, "get_backend", return_value=self.backend):
+            hybrid = self.run_cli(query_memory, "--query", "código de la alarma", "--n-results", "2")
+            lexical = self.run_cli(query_memory, "--query", "zx4521", "--mode", "lexical")
+            unrelated = self.run_cli(query_memory, "--query", "pizza margarita")
+            no_cutoff = self.run_cli(query_memory, "--query", "pizza margarita", "--mode", "vector",
+                                     "--max-distance", "0")
+
+        self.assertEqual([r["id"] for r in hybrid["results"]], ["m0", "m1"])
+        self.assertEqual(hybrid["results"][0]["matched_by"], ["vector", "lexical"])
+        self.assertEqual(set(hybrid["timings_ms"]), {"vector", "lexical", "fusion"})
+        self.assertEqual([(r["id"], r["relevance_distance"]) for r in lexical["results"]], [("m0", None)])
+        self.assertEqual(set(lexical["timings_ms"]), {"lexical", "fusion"})
+        self.assertEqual(unrelated["results"], [])
+        self.assertEqual(len(no_cutoff["results"]), 3)
+
+    def test_memory_sharing_one_common_word_is_not_returned(self):
+        self.backend.handle("add", {"documents": ["La alarma suena a las siete", "El garaje tiene alarma nueva"],
+                                    "ids": ["m0", "m1"], "metadatas": [{"timestamp": "2026-01-01T10:00:00"},
+                                                                       {"timestamp": "2026-01-02T10:00:00"}]})
+        for mode in ("hybrid", "lexical"):
+            result = self.backend.handle("query", {"query": "alarma del garaje", "mode": mode})
+            self.assertEqual(result["ids"], ["m1"], mode)
+        # Sin corte léxico el recuerdo que solo comparte "alarma" sí entraría
+        result = self.backend.handle("query", {"query": "alarma del garaje", "mode": "lexical", "min_match": 0})
+        self.assertEqual(sorted(result["ids"]), ["m0", "m1"])
+
+    def test_reciprocal_rank_fusion(self):
+        scores = memory_daemon.reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+        self.assertEqual(sorted(scores, key=lambda key: -scores[key]), ["a", "c", "b"])
+        self.assertAlmostEqual(scores["a"], 1 / 61 + 1 / 62)
+
+    def test_bulk_import_is_batched_and_idempotent(self):
+        path = os.path.join(self.tmp, "notas.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(4):
+                f.write(json.dumps({"text": f"Nota número {i}", "category": "curso"}) + "\n")
+            f.write(json.dumps({"text": "Nota número 0", "category": "curso"}) + "\n")  # repetida
+            f.write(json.dumps({"id": "fija", "text": "Con ID propio", "metadata": {"tema": "x"}}) + "\n")
+            f.write("esto no es json\n")
+
+        self.start_daemon()
+        with patch.object(memory_daemon, "get_backend", side_effect=AssertionError("no debería abrir ChromaDB")), \
+                patch.object(self.collection, "add", wraps=self.collection.add) as add:
+            first = self.run_cli(save_memory, "--file", path, "--batch-size", "2")
+            with patch.object(sys, "stdin", io.StringIO(open(path, encoding="utf-8").read())):
+                again = self.run_cli(save_memory, "--file", "-")
+
+        self.assertEqual((first["ingested"], first["skipped"], first["invalid_lines"]), (5, 1, 1))
+        self.assertEqual(first["batches"], 3)
+        self.assertEqual(add.call_count, 3)  # un embedding por lote, no por nota
+        self.assertEqual((again["ingested"], again["skipped"]), (0, 6))
+        self.assertEqual(self.collection.count(), 5)
+        self.assertEqual(self.backend.index.count(), 5)
+        stored = self.collection.get(ids=["fija", save_memory.bulk_memory_id("curso", "Nota número 0")])
+        self.assertEqual(len(stored["ids"]), 2)
+        self.assertEqual(stored["metadatas"][stored["ids"].index("fija")]["tema"], "x")
+
+    def test_errors_are_reported(self):
+        self.start_daemon()
+        with self.assertRaises(memory_daemon.MemoryServiceError):
+            memory_daemon.call("drop_everything", db_path=self.db_path)
+        with self.assertRaises(memory_daemon.MemoryServiceError):
+            memory_daemon.call("add", db_path=self.db_path, documents=["sin id"])
+
+    def test_rag_context_uses_daemon(self):
+        self.collection.add(ids=["m1"], documents=["Mi color favorito es el verde"])
+        self.start_daemon()
+        sources = []
+        with patch.object(chat_with_llm, "MEMORY_DB_PATH", self.db_path), \
+                patch.object(memory_daemon, "get_backend", side_effect=AssertionError("no debería abrir ChromaDB")):
+            context = chat_with_llm.get_memory_context("¿cuál es mi color favorito?", sources=sources)
+        self.assertEqual(context, "- Mi color favorito es el verde")
+        self.assertEqual(sources, [("m1", "Mi color favorito es el verde")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chat_with_llm
+import provider_stats
+from provider_stats import ProviderStats
+from state_store import StateStore
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestProviderStats(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = StateStore(os.path.join(self.tmp, "state.db"), legacy_dir=None)
+        self.clock = FakeClock()
+        self.stats = ProviderStats(self.store, clock=self.clock)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_orders_by_ewma_latency_and_errors(self):
+        for _ in range(5):
+            self.stats.record("groq", latency=3.0)
+            self.stats.record("gemini", latency=1.0)
+            self.stats.record("openai", latency=0.5, ok=False)
+        # openai es el más rápido cuando responde, pero falla siempre
+        self.assertEqual(self.stats.order(["groq", "gemini", "openai"]), ["gemini", "groq", "openai"])
+        # Sin datos se respeta el orden dado
+        self.assertEqual(self.stats.order(["anthropic", "mistral"]), ["anthropic", "mistral"])
+
+    def test_breaker_opens_and_recovers_after_cooldown(self):
+        for _ in range(provider_stats.BREAKER_FAILURES):
+            self.stats.record("groq", ok=False, rate_limited=True)
+        self.assertTrue(self.stats.is_open("groq"))
+        self.assertEqual(self.stats.available(["groq", "gemini"]), ["gemini"])
+        # Si todos están abiertos, se devuelven igualmente como último recurso
+        self.assertEqual(self.stats.available(["groq"]), ["groq"])
+
+        self.clock.now += provider_stats.BREAKER_COOLDOWN + 1
+        self.assertFalse(self.stats.is_open("groq"))
+        # Un fallo en el intento de prueba vuelve a abrirlo; un acierto lo cierra
+        self.stats.record("groq", ok=False)
+        self.assertTrue(self.stats.is_open("groq"))
+        self.clock.now += provider_stats.BREAKER_COOLDOWN + 1
+        self.stats.record("groq", latency=1.0)
+        self.assertFalse(self.stats.is_open("groq"))
+
+    def test_stats_persist_per_model(self):
+        self.stats.record("gemini", "gemini-pro", latency=2.0)
+        self.stats.record("gemini", "gemini-1.5-flash", ok=False, rate_limited=True, aggregate=False)
+        reloaded = ProviderStats(self.store, clock=self.clock)
+        snapshot = reloaded.snapshot()
+        self.assertEqual(snapshot["gemini/*"]["calls"], 1)
+        self.assertEqual(snapshot["gemini/gemini-1.5-flash"]["rate_limited"], 1)
+        self.assertEqual(reloaded.order_models("gemini", ["gemini-1.5-flash", "gemini-pro"]),
+                         ["gemini-pro", "gemini-1.5-flash"])
+
+    def test_chat_skips_open_provider(self):
+        calls = []
+
+        def fake(name):
+            def call(messages, model=None, system_instruction=None):
+                calls.append(name)
+                return {"content": name}
+            return call
+
+        env = {"GROQ_API_KEY": "test", "GOOGLE_API_KEY": "test", "OPENAI_API_KEY": "", "ANTHROPIC_API_KEY": ""}
+        with patch.object(provider_stats.state_store, "get_store", return_value=self.store), \
+                patch.object(chat_with_llm, "get_memory_context", return_value=None), \
+                patch.object(chat_with_llm, "chat_groq", side_effect=fake("groq")), \
+                patch.object(chat_with_llm, "chat_gemini", side_effect=fake("gemini")), \
+                patch.dict(os.environ, env):
+            stats = provider_stats.get_stats()
+            for _ in range(provider_stats.BREAKER_FAILURES):
+                stats.record("groq", ok=False)
+            result = chat_with_llm.chat("hola", no_history=True)
+            # Forzar el proveedor ignora el circuit breaker
+            forced = chat_with_llm.chat("hola", provider="groq", no_history=True)
+
+        self.assertEqual(result, {"content": "gemini"})
+        self.assertEqual(forced, {"content": "groq"})
+        self.assertEqual(calls, ["gemini", "groq"])
+        self.assertFalse(stats.is_open("groq"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import datetime
+import os
+import sys
+import unittest
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from reminder_scheduler import ReminderScheduler, next_occurrence
+
+UTC = "UTC"
+
+
+def ts(text, tz=datetime.timezone.utc):
+    return datetime.datetime.fromisoformat(text).replace(tzinfo=tz).timestamp()
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestReminderScheduler(unittest.TestCase):
+
+    def make(self, reminders, now, **kwargs):
+        self.saved = []
+        self.deleted = []
+        self.sent = []
+        self.clock = Clock(now)
+        return ReminderScheduler(lambda: reminders, lambda r: self.saved.append(dict(r)), self.deleted.append,
+                                 self.sent.append, clock=self.clock, **kwargs)
+
+    def test_fires_in_time_order_and_reschedules_daily(self):
+        scheduler = self.make([], ts("2026-01-10 07:00"))
+        scheduler.add("1", "09:00", "b", tz=UTC)
+        scheduler.add("1", "08:00", "a", tz=UTC)
+        self.saved.clear()
+
+        self.assertEqual(scheduler.run_due(ts("2026-01-10 07:59")), [])
+        self.assertEqual(self.saved, [])  # sin I/O si no vence nada
+
+        fired = scheduler.run_due(ts("2026-01-10 09:00"))
+        self.assertEqual([r["message"] for r in fired], ["a", "b"])
+        # Solo se reescriben las dos filas reprogramadas
+        self.assertEqual([r["message"] for r in self.saved], ["a", "b"])
+        self.assertEqual(self.saved[0]["last_fired"], ts("2026-01-10 08:00"))
+        self.assertEqual(scheduler.next_fire_time(), ts("2026-01-11 08:00"))
+
+    def test_missed_fire_is_caught_up_within_window(self):
+        # El bot estuvo ocupado de 07:55 a 08:20: el de las 08:00 se envía igualmente
+        scheduler = self.make([], ts("2026-01-10 07:55"), catch_up_window=3600)
+        scheduler.add("1", "08:00", "pastilla", tz=UTC)
+        fired = scheduler.run_due(ts("2026-01-10 08:20"))
+        self.assertEqual([r["message"] for r in fired], ["pastilla"])
+        self.assertEqual(scheduler.run_due(ts("2026-01-10 08:21")), [])
+
+    def test_old_missed_fires_are_skipped_on_load(self):
+        legacy = [{"chat_id": "1", "time": "08:00", "message": "x", "last_sent": "2026-01-01"}]
+        scheduler = self.make(legacy, ts("2026-01-10 12:00"), catch_up_window=3600)
+        # Nada que recuperar (la última hora perdida fue hace 4 h); sí mañana a las 08:00
+        self.assertEqual(scheduler.run_due(), [])
+        self.assertEqual(scheduler.next_fire_time(), ts("2026-01-11 08:00", datetime.timezone(datetime.timedelta())))
+
+    def test_legacy_missed_fire_recovered_on_load(self):
+        legacy = [{"chat_id": "1", "time": "08:00", "message": "x", "last_sent": "2026-01-09", "tz": UTC}]
+        scheduler = self.make(legacy, ts("2026-01-10 09:00"), catch_up_window=3 * 3600)
+        self.assertEqual([r["message"] for r in scheduler.run_due()], ["x"])
+
+    def test_one_shot_is_removed_after_firing(self):
+        scheduler = self.make([], ts("2026-01-10 07:00"))
+        reminder = scheduler.add("1", "08:00", "cita", tz=UTC, date="2026-01-12")
+        self.assertEqual(scheduler.run_due(ts("2026-01-11 08:00")), [])
+        self.assertEqual(len(scheduler.run_due(ts("2026-01-12 08:00"))), 1)
+        self.assertEqual(len(scheduler), 0)
+        self.assertEqual(self.deleted, [reminder["id"]])
+
+    def test_one_shot_in_the_past_is_rejected(self):
+        scheduler = self.make([], ts("2026-01-10 07:00"))
+        with self.assertRaises(ValueError):
+            scheduler.add("1", "08:00", "tarde", tz=UTC, date="2026-01-09")
+
+    def test_remove_chat(self):
+        scheduler = self.make([], ts("2026-01-10 07:00"))
+        scheduler.add("1", "08:00", "a", tz=UTC)
+        scheduler.add("2", "08:00", "b", tz=UTC)
+        self.assertEqual(scheduler.remove_chat("1"), 1)
+        self.assertEqual(len(self.deleted), 1)
+        fired = scheduler.run_due(ts("2026-01-10 08:00"))
+        self.assertEqual([r["chat_id"] for r in fired], ["2"])
+
+    def test_time_zone(self):
+        reminder = {"time": "08:00", "tz": "America/Caracas"}  # UTC-4
+        self.assertEqual(next_occurrence(reminder, ts("2026-01-10 00:00")), ts("2026-01-10 12:00"))
+
+    def test_scales_to_thousands(self):
+        scheduler = self.make([], ts("2026-01-09 23:59"))
+        for i in range(3000):
+            scheduler.add(str(i), f"{i % 24:02d}:{i % 60:02d}", "m", tz=UTC)
+        self.saved.clear()
+        first = scheduler.run_due(ts("2026-01-10 00:00"))
+        # Cada disparo reescribe solo su fila, no las 3000
+        self.assertEqual(len(self.saved), len(first))
+        fired = scheduler.run_due(ts("2026-01-10 23:59"))
+        self.assertEqual(len(first) + len(fired), 3000)
+        self.assertEqual(fired, sorted(fired, key=lambda r: r["last_fired"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
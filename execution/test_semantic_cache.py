@@ -0,0 +1,130 @@
+import math
+import os
+import sys
+import unittest
+import uuid
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import chromadb
+    from chromadb import EmbeddingFunction
+except ImportError:
+    chromadb = None
+    EmbeddingFunction = object
+
+import chat_with_llm
+import semantic_cache
+from semantic_cache import SemanticCache, scope_key
+from test_chat_with_llm import ChatTestCase
+from test_provider_stats import FakeClock
+
+QUESTION = "¿Qué es la fotosíntesis de las plantas?"
+REWORDED = "¿qué es la fotosíntesis de las plantas"
+
+
+class BagOfWords(EmbeddingFunction):
+    """Embedding determinista para tests (sin descargar modelos)."""
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input):
+        vectors = []
+        for text in input:
+            v = [0.0] * 64
+            for word in text.lower().strip("¿?").split():
+                v[sum(map(ord, word.strip("¿?"))) % 64] += 1
+            norm = math.sqrt(sum(x * x for x in v)) or 1.0
+            vectors.append([x / norm for x in v])
+        return vectors
+
+    @staticmethod
+    def name():
+        return "bag_of_words"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return BagOfWords()
+
+
+@unittest.skipIf(chromadb is None, "chromadb no instalado")
+class TestSemanticCache(ChatTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = chromadb.EphemeralClient()
+        suffix = uuid.uuid4().hex[:8]
+        self.collection = self.client.get_or_create_collection(
+            f"cache_{suffix}", embedding_function=BagOfWords(), metadata={"hnsw:space": "cosine"})
+        self.memory = self.client.get_or_create_collection(f"memory_{suffix}", embedding_function=BagOfWords())
+        self.clock = FakeClock()
+        self.cache = SemanticCache(self.collection, self.memory, store=self.store, threshold=0.9, clock=self.clock)
+
+    def tearDown(self):
+        self.client.delete_collection(self.collection.name)
+        self.client.delete_collection(self.memory.name)
+        super().tearDown()
+
+    def test_reworded_question_hits_within_scope(self):
+        scope = scope_key("profe", "es")
+        self.cache.put(QUESTION, scope, "Es el proceso...")
+        self.assertEqual(self.cache.lookup(REWORDED, scope), "Es el proceso...")
+        self.assertIsNone(self.cache.lookup(REWORDED, scope_key("profe", "en")))
+        self.assertIsNone(self.cache.lookup(REWORDED, scope_key("pirata", "es")))
+        self.assertIsNone(self.cache.lookup("¿Cuál es la capital de Francia hoy?", scope))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_entry_invalidated_when_source_memory_changes(self):
+        scope = scope_key("profe", "es")
+        self.memory.add(ids=["m1"], documents=["La fotosíntesis usa luz solar"])
+        self.cache.put(QUESTION, scope, "Usa luz solar", sources=[("m1", "La fotosíntesis usa luz solar")])
+        self.assertEqual(self.cache.lookup(QUESTION, scope), "Usa luz solar")
+
+        self.memory.update(ids=["m1"], documents=["La fotosíntesis usa luz y CO2"])
+        self.assertIsNone(self.cache.lookup(QUESTION, scope))
+        self.assertEqual(self.collection.count(), 0)
+
+    def test_short_prompts_and_expired_entries_are_not_served(self):
+        scope = scope_key("profe", "es")
+        self.cache.put("¿por qué?", scope, "porque sí")
+        self.assertEqual(self.collection.count(), 0)
+
+        self.cache.put(QUESTION, scope, "Es el proceso...")
+        self.clock.now += self.cache.ttl + 1
+        self.assertIsNone(self.cache.lookup(QUESTION, scope))
+
+    def test_chat_reuses_answer_for_reworded_question(self):
+        with patch.object(semantic_cache, "get_semantic_cache", return_value=self.cache):
+            first = chat_with_llm.chat(QUESTION, no_history=True, semantic=True, persona="profe", language="es")
+            second = chat_with_llm.chat(REWORDED, no_history=True, semantic=True, persona="profe", language="es")
+            chat_with_llm.chat(REWORDED, no_history=True, semantic=True, persona="profe", language="en")
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_not_used_when_session_has_history(self):
+        with patch.object(semantic_cache, "get_semantic_cache", return_value=self.cache):
+            chat_with_llm.chat(QUESTION, session="otra", semantic=True, persona="profe", language="es")
+            chat_with_llm.chat("Hablemos de química", session="s1", semantic=True, persona="profe", language="es")
+            # Parece la misma pregunta, pero sigue a otra conversación
+            chat_with_llm.chat(REWORDED, session="s1", semantic=True, persona="profe", language="es")
+        self.assertEqual(len(self.calls), 3)
+
+    def test_client_is_opened_once_per_database(self):
+        with patch.object(chromadb, "PersistentClient", return_value=self.client) as client, \
+                patch.dict(semantic_cache._caches, clear=True):
+            first = semantic_cache.get_semantic_cache("/tmp/semantic_db")
+            second = semantic_cache.get_semantic_cache("/tmp/semantic_db")
+        self.assertIs(first, second)
+        self.assertEqual(client.call_count, 1)
+        self.client.delete_collection(semantic_cache.COLLECTION)
+        self.client.delete_collection(semantic_cache.MEMORY_COLLECTION)
+
+
+if __name__ == '__main__':
+    unittest.main()
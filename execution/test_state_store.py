@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from state_store import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, "state.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def open(self):
+        return StateStore(self.db_path, legacy_dir=self.tmp)
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp, name), 'w', encoding='utf-8') as f:
+            f.write(content if isinstance(content, str) else json.dumps(content))
+
+    def test_migrates_legacy_files_once(self):
+        self.write("telegram_users.txt", "111\n222\n111\n")
+        self.write("telegram_config.json", {"voice_lang": "en-US", "timezones": {"111": "America/Caracas"}})
+        self.write("telegram_persona.txt", "Eres un pirata.\n")
+        self.write("telegram_offset.txt", "987")
+        self.write("telegram_reminders.json", [{"chat_id": "111", "time": "08:00", "message": "pastilla"}])
+        self.write("chat_history.json", [{"role": "user", "content": "hola"},
+                                         {"role": "assistant", "content": "¡hola!"}])
+
+        store = self.open()
+        self.assertEqual(store.list_users(), ["111", "222"])
+        self.assertEqual(store.get_setting("voice_lang"), "en-US")
+        self.assertEqual(store.get_setting("persona"), "Eres un pirata.")
+        self.assertEqual(store.get_setting("telegram_offset"), 987)
+        self.assertEqual(store.get_chat_setting("111", "timezone"), "America/Caracas")
+        self.assertEqual(store.load_reminders("111")[0]["message"], "pastilla")
+        self.assertEqual(len(store.history_tail()), 2)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, "telegram_users.txt.migrated")))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, "telegram_users.txt")))
+        store.close()
+
+        # Reabrir no vuelve a importar nada
+        store = self.open()
+        self.assertEqual(len(store.history_tail()), 2)
+        self.assertEqual(store.list_users(), ["111", "222"])
+        store.close()
+
+    def test_users_are_cached_and_deduplicated(self):
+        store = self.open()
+        self.assertTrue(store.add_user(5))
+        self.assertFalse(store.add_user("5"))
+        store.add_user(6)
+        self.assertEqual(store.list_users(), ["5", "6"])
+        store.close()
+        self.assertEqual(self.open().list_users(), ["5", "6"])
+
+    def test_settings_persist(self):
+        store = self.open()
+        store.set_setting("persona", "serio")
+        store.set_chat_setting(1, "timezone", "Europe/Madrid")
+        store.close()
+        store = self.open()
+        self.assertEqual(store.get_setting("persona"), "serio")
+        self.assertEqual(store.get_chat_setting("1", "timezone"), "Europe/Madrid")
+        self.assertIsNone(store.get_chat_setting("2", "timezone"))
+
+    def test_reminders_replace(self):
+        store = self.open()
+        store.save_reminders([{"id": "a", "chat_id": "1"}, {"id": "b", "chat_id": "2"}])
+        store.save_reminders([{"id": "b", "chat_id": "2"}])
+        self.assertEqual([r["id"] for r in store.load_reminders()], ["b"])
+        self.assertEqual(store.load_reminders("1"), [])
+
+    def test_reminder_upsert_and_delete(self):
+        store = self.open()
+        store.upsert_reminder({"id": "a", "chat_id": "1", "message": "x"})
+        store.upsert_reminder({"id": "b", "chat_id": "2", "message": "y"})
+        store.upsert_reminder({"id": "a", "chat_id": "1", "message": "z"})
+        self.assertEqual([r["message"] for r in store.load_reminders()], ["z", "y"])
+        store.delete_reminder("a")
+        self.assertEqual([r["id"] for r in store.load_reminders()], ["b"])
+
+    def test_history_tail_and_clear(self):
+        store = self.open()
+        for i in range(15):
+            store.append_history([{"role": "user", "content": str(i)}])
+        store.append_history([{"role": "user", "content": "otro"}], session="x")
+        self.assertEqual([m["content"] for m in store.history_tail(limit=3)], ["12", "13", "14"])
+        since = store.history_since(after_id=5, limit=3)
+        self.assertEqual([m["content"] for m in since], ["12", "13", "14"])
+        older = store.history_before(after_id=since[0]["id"] - 10, before_id=since[0]["id"], limit=4)
+        self.assertEqual([m["content"] for m in older], ["3", "4", "5", "6"])
+        store.clear_history()
+        self.assertEqual(store.history_tail(), [])
+        self.assertEqual(len(store.history_tail(session="x")), 1)
+
+    def test_concurrent_writers(self):
+        store = self.open()
+
+        def register(offset):
+            for i in range(50):
+                store.add_user(offset + i)
+                store.set_chat_setting(offset + i, "timezone", "UTC")
+
+        threads = [threading.Thread(target=register, args=(n * 1000,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        store.close()
+        self.assertEqual(len(self.open().list_users()), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
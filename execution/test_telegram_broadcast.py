@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import telegram_broadcast
+from telegram_broadcast import Broadcast, RateLimiter
+from telegram_tool import TelegramAPIError
+
+
+class FakeTelegram:
+    """Registra los envíos y responde con los errores programados por chat."""
+
+    def __init__(self, errors=None, delay=0.0):
+        self.errors = {k: list(v) for k, v in (errors or {}).items()}
+        self.delay = delay
+        self.sent = []
+        self.times = []
+        self.lock = threading.Lock()
+
+    def __call__(self, chat_id, text):
+        with self.lock:
+            self.times.append(time.monotonic())
+            pending = self.errors.get(chat_id)
+            error = pending.pop(0) if pending else None
+        if self.delay:
+            time.sleep(self.delay)
+        if error:
+            raise error
+        with self.lock:
+            self.sent.append(chat_id)
+        return {"message_id": len(self.sent)}
+
+
+class TestBroadcast(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmp, "broadcast.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_rate_limiter_spaces_calls(self):
+        limiter = RateLimiter(rate=100)
+        start = time.monotonic()
+        for _ in range(21):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_delivers_to_all_within_global_rate(self):
+        users = [str(i) for i in range(60)] + ["5"]  # duplicado
+        telegram = FakeTelegram(delay=0.01)
+        summary = Broadcast("hola", users, send=telegram, rate=200, workers=8,
+                            checkpoint_path=self.checkpoint).run()
+        self.assertEqual(sorted(telegram.sent, key=int), [str(i) for i in range(60)])
+        self.assertEqual(summary["sent"], 60)
+        self.assertEqual(summary["failed"], 0)
+        # 60 envíos a 200/s no pueden durar menos de ~0.3 s
+        self.assertGreaterEqual(telegram.times[-1] - telegram.times[0], 0.28)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_honors_retry_after(self):
+        telegram = FakeTelegram(errors={"2": [TelegramAPIError("Too Many Requests", 429, retry_after=0.3)]})
+        start = time.monotonic()
+        summary = Broadcast("hola", ["1", "2", "3"], send=telegram, rate=1000, workers=1,
+                            checkpoint_path=self.checkpoint).run()
+        self.assertEqual(summary["sent"], 3)
+        self.assertEqual(summary["rate_limited"], 1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+
+    def test_blocked_chat_is_not_retried(self):
+        telegram = FakeTelegram(errors={"2": [TelegramAPIError("Forbidden: bot was blocked by the user", 403)]})
+        summary = Broadcast("hola", ["1", "2"], send=telegram, rate=1000,
+                            checkpoint_path=self.checkpoint).run()
+        self.assertEqual(summary["sent"], 1)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(len(telegram.times), 2)
+        self.assertIn("403", summary["failures"]["2"])
+
+    def test_progress_callback(self):
+        reports = []
+        Broadcast("hola", [str(i) for i in range(10)], send=FakeTelegram(), rate=1000,
+                  checkpoint_path=self.checkpoint, on_progress=reports.append, progress_interval=0).run()
+        self.assertTrue(reports)
+        self.assertEqual(reports[-1]["total"], 10)
+
+    def test_progress_notifications_share_rate_limit(self):
+        telegram = FakeTelegram()
+        broadcast = Broadcast("hola", [str(i) for i in range(20)], send=telegram, rate=100, workers=4,
+                              checkpoint_path=self.checkpoint, progress_interval=0)
+        broadcast.on_progress = lambda p: broadcast.notify("admin", f"{p['done']}/{p['total']}")
+        with patch.object(telegram_broadcast, "PRIVATE_CHAT_INTERVAL", 0.0):
+            broadcast.run()
+        self.assertEqual(len(telegram.times), 40)
+        # 20 envíos + 20 avisos de progreso a 100/s: el conjunto no puede durar menos de ~0.4 s
+        self.assertGreaterEqual(telegram.times[-1] - telegram.times[0], 0.38)
+
+    def test_notify_pauses_on_retry_after(self):
+        telegram = FakeTelegram(errors={"admin": [TelegramAPIError("Too Many Requests", 429, retry_after=0.3)]})
+        broadcast = Broadcast("hola", ["1"], send=telegram, rate=1000, checkpoint_path=self.checkpoint)
+        with self.assertRaises(TelegramAPIError):
+            broadcast.notify("admin", "progreso")
+        start = time.monotonic()
+        broadcast.run()
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_resume_from_checkpoint(self):
+        users = [str(i) for i in range(40)]
+        first = FakeTelegram(delay=0.01)
+        broadcast = Broadcast("hola", users, send=first, rate=1000, workers=2, checkpoint_path=self.checkpoint)
+        original = broadcast._record
+
+        def record_and_stop(chat_id, result):
+            original(chat_id, result)
+            if len(broadcast.results) >= 15:
+                broadcast.cancel()
+
+        broadcast._record = record_and_stop
+        summary = broadcast.run()
+        self.assertEqual(summary["status"], "cancelled")
+        self.assertGreater(summary["pending"], 0)
+        with open(self.checkpoint) as f:
+            self.assertEqual(len(json.load(f)["results"]), summary["done"])
+
+        second = FakeTelegram()
+        resumed = Broadcast.resume(self.checkpoint, send=second, rate=1000)
+        self.assertEqual(resumed.id, broadcast.id)
+        summary = resumed.run()
+        self.assertEqual(summary["status"], "completed")
+        self.assertEqual(summary["sent"], 40)
+        self.assertEqual(sorted(first.sent + second.sent, key=int), users)
+        self.assertIsNone(Broadcast.resume(self.checkpoint))
+
+    def test_per_chat_interval(self):
+        self.assertEqual(telegram_broadcast.chat_interval("-100123"), telegram_broadcast.GROUP_CHAT_INTERVAL)
+        self.assertEqual(telegram_broadcast.chat_interval("123"), telegram_broadcast.PRIVATE_CHAT_INTERVAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
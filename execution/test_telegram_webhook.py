@@ -0,0 +1,99 @@
+import json
+import os
+import queue
+import sys
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import telegram_tool
+import telegram_webhook
+
+SECRET = "s3cr3t-token"
+
+# Updates grabados tal como los envía la Bot API
+RECORDED_UPDATES = [
+    {"update_id": 1001, "message": {"message_id": 1, "chat": {"id": 111}, "text": "/ayuda"}},
+    {"update_id": 1002, "message": {"message_id": 2, "chat": {"id": 222},
+                                    "photo": [{"file_id": "small"}, {"file_id": "big"}], "caption": "mira"}},
+    {"update_id": 1003, "message": {"message_id": 3, "chat": {"id": 111}, "voice": {"file_id": "v1"}}},
+    {"update_id": 1004, "message": {"message_id": 4, "chat": {"id": 333},
+                                    "document": {"file_id": "d1", "file_name": "informe.pdf",
+                                                 "mime_type": "application/pdf"}}},
+]
+
+
+class FakeTelegram:
+    """Simula a Telegram enviando updates grabados al webhook."""
+
+    def __init__(self, port, path=telegram_webhook.WEBHOOK_PATH):
+        self.url = f"http://127.0.0.1:{port}{path}"
+
+    def post(self, update, secret=SECRET):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(update).encode(),
+            headers={"Content-Type": "application/json", telegram_webhook.SECRET_HEADER: secret},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class TestWebhookServer(unittest.TestCase):
+
+    def setUp(self):
+        self.allowed = patch.object(telegram_tool, "ALLOWED_USERS", "*")
+        self.allowed.start()
+        self.inbox = queue.Queue()
+        self.server = telegram_webhook.WebhookServer(self.inbox.put, SECRET, host="127.0.0.1", port=0).start()
+        self.telegram = FakeTelegram(self.server.port)
+
+    def tearDown(self):
+        self.server.stop()
+        self.allowed.stop()
+
+    def drain(self):
+        messages = []
+        while not self.inbox.empty():
+            messages.append(self.inbox.get_nowait())
+        return messages
+
+    def test_recorded_updates_reach_dispatch_queue(self):
+        for update in RECORDED_UPDATES:
+            self.assertEqual(self.telegram.post(update), 200)
+        self.assertEqual(self.drain(), [
+            "111|/ayuda",
+            "222|__PHOTO__:big|||mira",
+            "111|__VOICE__:v1",
+            "333|__DOCUMENT__:d1|||informe.pdf|||",
+        ])
+
+    def test_invalid_secret_is_rejected(self):
+        self.assertEqual(self.telegram.post(RECORDED_UPDATES[0], secret="otro"), 403)
+        self.assertEqual(self.drain(), [])
+
+    def test_retried_update_is_delivered_once(self):
+        self.telegram.post(RECORDED_UPDATES[0])
+        self.telegram.post(RECORDED_UPDATES[0])
+        self.assertEqual(self.drain(), ["111|/ayuda"])
+
+    def test_unauthorized_chat_is_ignored(self):
+        with patch.object(telegram_tool, "ALLOWED_USERS", "111"):
+            self.assertEqual(self.telegram.post(RECORDED_UPDATES[1]), 200)
+        self.assertEqual(self.drain(), [])
+
+    def test_requires_secret(self):
+        with self.assertRaises(ValueError):
+            telegram_webhook.WebhookServer(self.inbox.put, "", port=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest.mock import patch
+
+# Add execution dir to path to import the module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import tool_runtime
+
+
+def make_tool(main):
+    module = types.ModuleType("fake_tool")
+    module.main = main
+    return module
+
+
+class TestToolRuntime(unittest.TestCase):
+
+    def setUp(self):
+        self.tools = patch.dict(tool_runtime.TOOLS, {"fake_tool.py": {"isolated": False, "timeout": 2}})
+        self.tools.start()
+
+    def tearDown(self):
+        tool_runtime._modules.pop("fake_tool.py", None)
+        self.tools.stop()
+
+    def test_in_process_call_returns_json_contract(self):
+        def main(argv=None):
+            print(json.dumps({"status": "success", "argv": argv}))
+            print("log de depuración", file=sys.stderr)
+            sys.exit(1)
+
+        tool_runtime._modules["fake_tool.py"] = make_tool(main)
+        res = tool_runtime.run_tool("fake_tool.py", ["--x", "1"])
+        self.assertEqual(res, {"status": "success", "argv": ["--x", "1"]})
+
+    def test_in_process_timeout_cancels_tool(self):
+        progress = []
+
+        def main(argv=None):
+            for i in range(50):
+                time.sleep(0.05)
+                progress.append(i)
+
+        tool_runtime._modules["fake_tool.py"] = make_tool(main)
+        start = time.monotonic()
+        res = tool_runtime.run_tool("fake_tool.py", [], timeout=0.3)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(res["status"], "timeout")
+        self.assertEqual(res["tool"], "fake_tool.py")
+
+        time.sleep(0.3)
+        seen = len(progress)
+        time.sleep(0.3)
+        self.assertEqual(len(progress), seen)
+
+    def test_non_cancellable_tool_is_left_to_finish(self):
+        finished = []
+
+        def main(argv=None):
+            time.sleep(0.4)
+            finished.append(True)
+
+        tool_runtime.TOOLS["fake_tool.py"]["cancel"] = False
+        tool_runtime._modules["fake_tool.py"] = make_tool(main)
+        with patch.object(tool_runtime, "_cancel_thread") as cancel:
+            res = tool_runtime.run_tool("fake_tool.py", [], timeout=0.1)
+        self.assertEqual(res["status"], "timeout")
+        cancel.assert_not_called()
+        time.sleep(0.6)
+        self.assertEqual(finished, [True])
+
+    def test_network_tools_run_isolated_by_default(self):
+        with patch.dict(os.environ, {"AGENT_ISOLATED_TOOLS": ""}):
+            for script in ("research_topic.py", "scrape_single_site.py", "translate_text.py"):
+                self.assertTrue(tool_runtime.is_isolated(script), script)
+            self.assertFalse(tool_runtime.is_isolated("chat_with_llm.py"))
+        self.assertFalse(tool_runtime.is_cancellable("chat_with_llm.py"))
+        self.assertFalse(tool_runtime.is_cancellable("save_memory.py"))
+
+    def test_isolated_tool_is_killed_on_timeout(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "fake_tool.py"), "w") as f:
+                f.write("import time\ntime.sleep(30)\n")
+            with patch.object(tool_runtime, "EXECUTION_DIR", tmp), \
+                    patch.dict(os.environ, {"AGENT_ISOLATED_TOOLS": "fake_tool.py"}):
+                start = time.monotonic()
+                res = tool_runtime.run_tool("fake_tool.py", [], timeout=0.5)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(res["status"], "timeout")
+
+    def test_in_process_tool_does_not_spawn_subprocess(self):
+        tool_runtime._modules["fake_tool.py"] = make_tool(lambda argv=None: print(json.dumps({"ok": True})))
+        with patch.object(tool_runtime, "_run_subprocess") as run_subprocess:
+            res = tool_runtime.run_tool("fake_tool.py", [])
+        self.assertEqual(res, {"ok": True})
+        run_subprocess.assert_not_called()
+
+    def test_isolated_tool_runs_in_subprocess(self):
+        in_process = []
+        tool_runtime._modules["fake_tool.py"] = make_tool(lambda argv=None: in_process.append(argv))
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "fake_tool.py"), "w") as f:
+                f.write("import json, os, sys\n"
+                        "print('log del subproceso', file=sys.stderr)\n"
+                        "print(json.dumps({'pid': os.getpid(), 'argv': sys.argv[1:]}))\n")
+            with patch.object(tool_runtime, "EXECUTION_DIR", tmp), \
+                    patch.dict(os.environ, {"AGENT_ISOLATED_TOOLS": "fake_tool.py"}):
+                res = tool_runtime.run_tool("fake_tool.py", ["--x", "1"])
+        self.assertEqual(res["argv"], ["--x", "1"])
+        self.assertNotEqual(res["pid"], os.getpid())
+        self.assertEqual(in_process, [])
+
+    def test_stdout_is_captured_per_call(self):
+        def main(argv=None):
+            for i in range(20):
+                print(f"línea {i} de {argv[0]}", file=sys.stderr)
+                time.sleep(0.001)
+            print(json.dumps({"tool": argv[0]}))
+
+        tool_runtime._modules["fake_tool.py"] = make_tool(main)
+        results = {}
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            threads = [threading.Thread(target=lambda n=n: results.__setitem__(n, tool_runtime.run_tool("fake_tool.py", [n])))
+                       for n in ("a", "b", "c")]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        # Cada llamada recibe solo su JSON; al stdout del proceso llegan los logs, no el JSON
+        self.assertEqual(results, {n: {"tool": n} for n in ("a", "b", "c")})
+        self.assertNotIn('{"tool"', out.getvalue())
+        self.assertEqual(out.getvalue().count("[LOG fake_tool.py]"), 3)
+
+    def test_non_json_output_returns_none(self):
+        tool_runtime._modules["fake_tool.py"] = make_tool(lambda argv=None: print("no es JSON"))
+        self.assertIsNone(tool_runtime.run_tool("fake_tool.py", []))
+
+    def run_isolated(self, code, timeout=1.0, grace=0.5):
+        """Ejecuta `code` como herramienta aislada; devuelve (resultado, segundos, directorio temporal)."""
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp, True)
+        with open(os.path.join(tmp, "fake_tool.py"), "w") as f:
+            f.write(code)
+        with patch.object(tool_runtime, "EXECUTION_DIR", tmp), patch.object(tool_runtime, "KILL_GRACE", grace), \
+                patch.dict(os.environ, {"AGENT_ISOLATED_TOOLS": "fake_tool.py", "TOOL_TMP": tmp}):
+            start = time.monotonic()
+            res = tool_runtime.run_tool("fake_tool.py", [], timeout=timeout)
+        return res, time.monotonic() - start, tmp
+
+    def test_timeout_sends_sigterm_first(self):
+        res, elapsed, tmp = self.run_isolated(
+            "import os, signal, sys, time\n"
+            "def cleanup(*_):\n"
+            "    open(os.path.join(os.environ['TOOL_TMP'], 'limpio'), 'w').close()\n"
+            "    sys.exit(0)\n"
+            "signal.signal(signal.SIGTERM, cleanup)\n"
+            "time.sleep(30)\n", grace=5)
+        self.assertEqual(res["status"], "timeout")
+        # Sale al recibir SIGTERM: no hace falta esperar el margen de KILL_GRACE
+        self.assertLess(elapsed, 3)
+        self.assertTrue(os.path.exists(os.path.join(tmp, "limpio")))
+
+    def test_timeout_kills_tool_that_ignores_sigterm(self):
+        res, elapsed, tmp = self.run_isolated(
+            "import os, signal, time\n"
+            "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+            "with open(os.path.join(os.environ['TOOL_TMP'], 'pid'), 'w') as f:\n"
+            "    f.write(str(os.getpid()))\n"
+            "time.sleep(30)\n")
+        self.assertEqual(res["status"], "timeout")
+        self.assertGreaterEqual(elapsed, 1.4)  # plazo + KILL_GRACE
+        self.assertLess(elapsed, 5)
+        with open(os.path.join(tmp, "pid")) as f:
+            pid = int(f.read())
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def test_timeout_override_from_env(self):
+        with patch.dict(os.environ, {"AGENT_TOOL_TIMEOUTS": "fake_tool.py=7,otro.py=1"}):
+            self.assertEqual(tool_runtime.get_timeout("fake_tool.py"), 7)
+        self.assertEqual(tool_runtime.get_timeout("fake_tool.py"), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Runtime de herramientas en proceso.
+
+Importa una sola vez los scripts de execution/ y llama directamente a su
+main(argv), capturando la salida JSON (stdout) y los logs (stderr), en lugar de
+lanzar un intérprete de Python nuevo por cada llamada.
+
+El contrato es el mismo que con subprocess: la herramienta imprime JSON en
+stdout y se devuelve ya parseado (o None si la salida no es JSON válido).
+
+Las herramientas marcadas como "isolated" (o listadas en la variable de entorno
+AGENT_ISOLATED_TOOLS, separadas por comas; "*" para todas) siguen ejecutándose
+en un subproceso.
+
+Cada herramienta tiene un plazo (TOOLS[...]["timeout"]). Al vencer, el subproceso
+se termina (SIGTERM y luego SIGKILL) o el hilo en proceso se cancela, y run_tool()
+devuelve {"status": "timeout", ...}.
+
+La cancelación en proceso es solo best-effort: no interrumpe una lectura de socket
+ni una llamada en C bloqueadas, y podría caer dentro de un lock o de una transacción
+SQLite a medias. Por eso las herramientas de red sin timeouts propios van en
+subproceso, y las que usan state_store/SQLite se marcan cancel=False: al vencer se
+devuelve el timeout y su hilo termina solo, acotado por los timeouts de sus
+peticiones HTTP (chat_with_llm recibe además --deadline-ms).
+"""
+import os
+import sys
+import io
+import json
+import ctypes
+import importlib
+import threading
+import subprocess
+import traceback
+
+EXECUTION_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Registro de herramientas conocidas (único lugar donde se configuran).
+# isolated=True -> siempre en subproceso (Docker y las herramientas de red cuyos SDK
+#   no tienen timeout: solo un proceso aparte se puede cortar de verdad).
+# timeout -> plazo máximo en segundos; al vencer se cancela la ejecución.
+# cancel=False -> en proceso no se inyecta ToolCancelled (usan state_store/SQLite).
+TOOLS = {
+    "telegram_tool.py": {"isolated": False, "timeout": 90, "cancel": False},  # incluye el long polling (50 s)
+    "chat_with_llm.py": {"isolated": False, "timeout": 120, "cancel": False},
+    "research_topic.py": {"isolated": True, "timeout": 45},
+    "scrape_single_site.py": {"isolated": True, "timeout": 30},
+    "save_memory.py": {"isolated": False, "timeout": 60, "cancel": False},
+    "query_memory.py": {"isolated": False, "timeout": 60, "cancel": False},
+    "list_memories.py": {"isolated": False, "timeout": 60, "cancel": False},
+    "delete_memory.py": {"isolated": False, "timeout": 60, "cancel": False},
+    "monitor_resources.py": {"isolated": False, "timeout": 15},
+    "analyze_image.py": {"isolated": True, "timeout": 90},
+    "transcribe_audio.py": {"isolated": True, "timeout": 60},
+    "text_to_speech.py": {"isolated": True, "timeout": 60},
+    "translate_text.py": {"isolated": True, "timeout": 300},
+    "run_sandbox.py": {"isolated": True, "timeout": 150},  # docker wait ya limita a 120 s
+}
+DEFAULT_TIMEOUT = 60
+# Segundos que se espera a que un subproceso termine tras SIGTERM antes de matarlo
+KILL_GRACE = 5
+
+
+class ToolCancelled(BaseException):
+    """Se inyecta en el hilo de una herramienta en proceso cuando vence su plazo."""
+
+
+class _ToolTimeout(Exception):
+    pass
+
+
+_modules = {}
+_failed_imports = set()
+_import_lock = threading.Lock()
+
+
+class _ThreadLocalStream:
+    """Proxy de sys.stdout/sys.stderr que redirige la escritura a un buffer por hilo."""
+
+    def __init__(self, original):
+        self._original = original
+        self._local = threading.local()
+
+    def set_buffer(self, buffer):
+        self._local.buffer = buffer
+
+    def _target(self):
+        return getattr(self._local, "buffer", None) or self._original
+
+    def write(self, data):
+        return self._target().write(data)
+
+    def flush(self):
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._original, name)
+
+
+def _install_capture():
+    """Instala (una sola vez) los proxies de captura en sys.stdout y sys.stderr."""
+    if not isinstance(sys.stdout, _ThreadLocalStream):
+        sys.stdout = _ThreadLocalStream(sys.stdout)
+    if not isinstance(sys.stderr, _ThreadLocalStream):
+        sys.stderr = _ThreadLocalStream(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+def is_isolated(script):
+    """Indica si la herramienta debe ejecutarse en un subproceso."""
+    forced = os.getenv("AGENT_ISOLATED_TOOLS", "").strip()
+    if forced == "*":
+        return True
+    if script in [s.strip() for s in forced.split(",") if s.strip()]:
+        return True
+    return TOOLS.get(script, {"isolated": True})["isolated"]
+
+
+def is_cancellable(script):
+    """Indica si se puede inyectar ToolCancelled en el hilo de la herramienta en proceso."""
+    return TOOLS.get(script, {}).get("cancel", True)
+
+
+def get_timeout(script):
+    """
+    Plazo en segundos de una herramienta. Se puede ajustar sin tocar el código con
+    AGENT_TOOL_TIMEOUTS="chat_with_llm.py=60,research_topic.py=30".
+    """
+    for item in os.getenv("AGENT_TOOL_TIMEOUTS", "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip() == script and value.strip():
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    return TOOLS.get(script, {}).get("timeout", DEFAULT_TIMEOUT)
+
+
+def timeout_result(script, timeout):
+    """Resultado estructurado que devuelve run_tool() cuando vence el plazo."""
+    return {
+        "status": "timeout",
+        "tool": script,
+        "timeout": timeout,
+        "message": f"{script} no respondió en {timeout:g} s y se canceló.",
+    }
+
+
+def load_tool(script):
+    """Importa (una sola vez) el módulo de una herramienta. Devuelve None si no es posible."""
+    if script in _modules:
+        return _modules[script]
+    if script in _failed_imports:
+        return None
+
+    with _import_lock:
+        if script in _modules:
+            return _modules[script]
+        if EXECUTION_DIR not in sys.path:
+            sys.path.insert(0, EXECUTION_DIR)
+        module_name = os.path.splitext(script)[0]
+        out, err = _install_capture()
+        buffer = io.StringIO()
+        out.set_buffer(buffer)
+        err.set_buffer(buffer)
+        try:
+            # Algunos scripts hacen sys.exit() al importar si falta una dependencia
+            module = importlib.import_module(module_name)
+        except BaseException as e:
+            if isinstance(e, KeyboardInterrupt):
+                raise
+            _failed_imports.add(script)
+            out.set_buffer(None)
+            err.set_buffer(None)
+            print(f"   ⚠️ [RUNTIME] No se pudo importar {script} ({e!r}). Se usará subproceso.", file=sys.stderr)
+            return None
+        finally:
+            out.set_buffer(None)
+            err.set_buffer(None)
+
+        if not callable(getattr(module, "main", None)):
+            _failed_imports.add(script)
+            return None
+        _modules[script] = module
+        return module
+
+
+def preload(scripts=None):
+    """Importa por adelantado las herramientas en proceso (para pagar el coste al arrancar)."""
+    for script in scripts or TOOLS:
+        if not is_isolated(script):
+            load_tool(script)
+
+
+def _run_in_process(module, args):
+    """Llama a module.main(args) capturando stdout/stderr. Devuelve (exit_code, stdout, stderr)."""
+    out, err = _install_capture()
+    stdout_buf, stderr_buf = io.StringIO(), io.StringIO()
+    out.set_buffer(stdout_buf)
+    err.set_buffer(stderr_buf)
+    exit_code = 0
+    try:
+        module.main(list(args))
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            stderr_buf.write(f"{e.code}\n")
+            exit_code = 1
+    except Exception:
+        stderr_buf.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        out.set_buffer(None)
+        err.set_buffer(None)
+    return exit_code, stdout_buf.getvalue(), stderr_buf.getvalue()
+
+
+def _cancel_thread(thread):
+    """
+    Lanza ToolCancelled dentro del hilo de la herramienta. Se dispara en cuanto el
+    hilo vuelve a ejecutar código Python (p.ej. al volver de una petición HTTP), así
+    que corta reintentos y fallbacks pendientes en lugar de dejarlos correr.
+
+    Es best-effort: una lectura de socket o una llamada en C bloqueadas siguen hasta
+    que vuelven, y la excepción puede caer con un lock tomado o una transacción a
+    medias. Solo se usa con herramientas cancel=True (ver TOOLS).
+    """
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident), ctypes.py_object(ToolCancelled))
+
+
+def _with_timeout(fn, script, timeout, default=None):
+    """
+    Ejecuta fn() en un hilo aparte que se cancela al vencer el plazo. Si la herramienta
+    no es cancelable, el hilo se abandona y termina por su cuenta.
+    """
+    result = {}
+
+    def target():
+        try:
+            result["value"] = fn()
+        except ToolCancelled:
+            print(f"   🛑 [RUNTIME] {script} cancelado.", file=sys.stderr)
+
+    worker = threading.Thread(target=target, name=f"tool-{script}", daemon=True)
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        if is_cancellable(script):
+            _cancel_thread(worker)
+        else:
+            print(f"   ⏳ [RUNTIME] {script} no es cancelable; se deja terminar en segundo plano.", file=sys.stderr)
+        raise _ToolTimeout()
+    return result.get("value", default)
+
+
+def _run_in_process_with_timeout(module, script, args, timeout):
+    """Como _run_in_process(), pero en un hilo aparte que se cancela al vencer el plazo."""
+    return _with_timeout(lambda: _run_in_process(module, args), script, timeout, default=(1, "", ""))
+
+
+def _run_subprocess(script, args, timeout):
+    """Ejecuta la herramienta en un intérprete aparte. Devuelve (exit_code, stdout, stderr)."""
+    script_path = os.path.join(EXECUTION_DIR, script)
+    cmd = [sys.executable, script_path] + list(args)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        # SIGTERM primero para que la herramienta limpie (p.ej. el contenedor del sandbox)
+        proc.terminate()
+        try:
+            proc.communicate(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+        raise _ToolTimeout()
+    return proc.returncode, stdout, stderr
+
+
+def run_tool(script, args, timeout=None):
+    """
+    Ejecuta una herramienta del framework y devuelve su salida JSON.
+    Si vence el plazo (ver TOOLS / AGENT_TOOL_TIMEOUTS) devuelve timeout_result().
+    """
+    timeout = timeout or get_timeout(script)
+    module = None if is_isolated(script) else load_tool(script)
+    try:
+        if module is not None:
+            _, stdout, stderr = _run_in_process_with_timeout(module, script, args, timeout)
+        else:
+            _, stdout, stderr = _run_subprocess(script, args, timeout)
+
+        # Mostrar stderr para depuración (RAG, errores, etc.)
+        if stderr:
+            print(f"   🛠️  [LOG {script}]: {stderr.strip()}")
+
+        return json.loads(stdout)
+    except _ToolTimeout:
+        print(f"   ⏱️ [RUNTIME] {script} superó su plazo de {timeout:g} s.")
+        return timeout_result(script, timeout)
+    except json.JSONDecodeError:
+        return None
+    except Exception as e:
+        print(f"Error ejecutando {script}: {e}")
+        return None
+
+
+def call(script, function, *args, timeout=None, **kwargs):
+    """
+    Llama a una función de una herramienta en proceso (p.ej. chat_with_llm.chat con
+    un callback de streaming), con el mismo plazo y captura de logs que run_tool().
+
+    Devuelve lo que devuelva la función, timeout_result() si vence el plazo, o
+    None si la herramienta no puede ejecutarse en proceso (aislada o sin importar).
+    """
+    module = None if is_isolated(script) else load_tool(script)
+    if module is None or not callable(getattr(module, function, None)):
+        return None
+    timeout = timeout or get_timeout(script)
+
+    def invoke():
+        out, err = _install_capture()
+        buffer = io.StringIO()
+        out.set_buffer(buffer)
+        err.set_buffer(buffer)
+        try:
+            return getattr(module, function)(*args, **kwargs)
+        except Exception:
+            buffer.write(traceback.format_exc())
+            return None
+        finally:
+            out.set_buffer(None)
+            err.set_buffer(None)
+            if buffer.getvalue():
+                print(f"   🛠️  [LOG {script}]: {buffer.getvalue().strip()}")
+
+    try:
+        return _with_timeout(invoke, script, timeout)
+    except _ToolTimeout:
+        print(f"   ⏱️ [RUNTIME] {script} superó su plazo de {timeout:g} s.")
+        return timeout_result(script, timeout)
@@ -11,11 +11,11 @@ except ImportError:
     print(json.dumps({"status": "error", "message": "Faltan librerías. Ejecuta: pip install SpeechRecognition pydub"}))
     sys.exit(1)
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Transcribir archivo de audio a texto.")
     parser.add_argument("--file", required=True, help="Ruta al archivo de audio.")
     parser.add_argument("--lang", default="es-ES", help="Código de idioma (ej: es-ES, en-US).")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     if not os.path.exists(args.file):
         print(json.dumps({"status": "error", "message": "Archivo no encontrado"}))